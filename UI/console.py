@@ -28,6 +28,9 @@ class Console(QTextEdit):
 
         self.add_detectors()
 
+        if self.window.simulation_type != "photonic":
+            self.code += "circuit.optimize()\n"
+
         self.code += "circuit.run()\n"
 
         self.setPlainText(self.code)
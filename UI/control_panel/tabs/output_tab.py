@@ -1,8 +1,11 @@
 import numpy as np
-from PySide6.QtWidgets import QTextEdit, QTableWidget, QTableWidgetItem, QWidget, QStackedWidget, QVBoxLayout
+from PySide6.QtWidgets import QLabel, QTextEdit, QTableWidget, QTableWidgetItem, QWidget, QStackedWidget, QVBoxLayout
 from PySide6.QtCore import Qt
 
 class OutputTab(QWidget):
+    # Most likely basis states shown in the table. The rest are summarized in one row.
+    max_rows = 1000
+
     def __init__(self, window):
         super().__init__()
         self.window = window
@@ -20,24 +23,34 @@ class OutputTab(QWidget):
         self.stacked_widget.addWidget(self.output_table)
         self.stacked_widget.addWidget(self.error_message)
 
+        # Estimated peak memory and time of the run, shown when it starts
+        self.estimate_label = QLabel()
+        self.estimate_label.setWordWrap(True)
+        self.estimate_label.hide()
+
         layout = QVBoxLayout(self)
+        layout.addWidget(self.estimate_label)
         layout.addWidget(self.stacked_widget)
 
         self.output_data = None
 
     def print_output(self):
         try:
-            self.table_data = self.window.interface.circuit.get_output_data()
+            result = self.window.interface.circuit.result
+            shown = result.top_k(self.max_rows)
 
-            total_prob = sum(float(i) for i in self.table_data[:, 1])
+            labels = ["|"+label+">" for label in shown.labels]
+            probabilities = shown.probabilities.tolist()
+            total_prob = float(np.sum(result.probabilities))
 
-            self.table_data = np.vstack((self.table_data, ["Total", total_prob]))
+            if len(shown) < len(result):
+                labels.append(f"{len(result) - len(shown)} more")
+                probabilities.append(total_prob - float(np.sum(shown.probabilities)))
 
-            # vstack automatically converts total_prob to a string
-            self.table_data[-1, 1] = float(self.table_data[-1, 1])
+            labels.append("Total")
+            probabilities.append(total_prob)
 
-            for row in range(len(self.table_data[:, 1])):
-                self.table_data[row, 1] = f'{float(f"{self.table_data[row, 1]:.4g}"):g}'
+            self.table_data = np.array([[label, f'{float(f"{probability:.4g}"):g}'] for label, probability in zip(labels, probabilities)], dtype=object)
 
             n_rows = np.shape(self.table_data)[0]
             n_cols = np.shape(self.table_data)[1]
@@ -48,9 +61,6 @@ class OutputTab(QWidget):
                 for col in range(n_cols):
                     entry = self.table_data[row, col]
 
-                    if col == 0 and row != n_rows - 1:
-                        entry = "|"+entry+">"
-
                     item = QTableWidgetItem()
                     item.setTextAlignment(Qt.AlignCenter)
                     item.setText(entry)
@@ -61,6 +71,10 @@ class OutputTab(QWidget):
         except Exception as e:
             self.print_exception(e)
 
+    def show_estimate(self, text):
+        self.estimate_label.setText(text)
+        self.estimate_label.show()
+
     def print_exception(self, e):
         self.stacked_widget.setCurrentIndex(1)
         self.error_message.setText("\u274C ERROR: "+str(e))
\ No newline at end of file
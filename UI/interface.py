@@ -1,3 +1,6 @@
+from backends.result_cache import ResultCache
+from backends.cost_model import physical_memory
+
 class Interface:
     """
     Class containing communications between the UI and the backend. Translates the list of drawn components
@@ -8,19 +11,41 @@ class Interface:
         self.circuit = None
         self.chosen_backend = None
 
+        # Shared by every circuit built in the session, so rerunning an unchanged circuit is not simulated again
+        self.result_cache = ResultCache()
+
+        # Circuits estimated to need more than most of the machine's memory are refused before they are run
+        memory = physical_memory()
+        self.memory_budget = int(0.8*memory) if memory else None
+
+        # Estimate of the cost of the last circuit that was built
+        self.estimate = None
+
     def build_circuit(self):
-        """Creates a circuit in the chosen backend and adds all drawn components."""
+        """
+        Creates a circuit in the chosen backend and adds all drawn components. The input state, which allocates
+        the simulation state, is only set once the circuit's estimate is within the memory budget.
+        """
         if self.window.simulation_type == "photonic":
             self.circuit = self.chosen_backend(self.window.canvas.n_wires, self.window.canvas.n_photons)
-            self.circuit.set_input_state(self.input_fock_state)
+            input_state = self.input_fock_state
         else:
             self.circuit = self.chosen_backend(self.window.canvas.n_wires)
-            self.circuit.set_input_state(self.input_qubit_state)
+            input_state = self.input_qubit_state
+        self.circuit.cache = self.result_cache
+        self.circuit.memory_budget = self.memory_budget
 
         for comp in self.window.canvas.placed_components["components"]:
             comp.add_to_sim()
 
         self.add_detectors()
+
+        if self.window.simulation_type != "photonic":
+            self.circuit.optimize()
+
+        self.estimate = self.circuit.estimate(input_state)
+        self.circuit.check_memory_budget(input_state)
+        self.circuit.set_input_state(input_state)
     
     def add_detectors(self):
         """Add all detectors at once at the end of the simulation."""
@@ -45,6 +70,14 @@ class Interface:
     def run_circuit(self):
         self.circuit.run()
 
+    @property
+    def estimate_text(self):
+        """Estimate of the last circuit that was built, and the reason for the choice of an automatic backend."""
+        text = "Estimate: " + str(self.estimate)
+        if getattr(self.circuit, "reason", None):
+            text += "\n" + self.circuit.reason
+        return text
+
     @property
     def input_fock_state(self):
         """The Fock state at the beginning of the circuit, taken from the wires' properties entered by the user."""
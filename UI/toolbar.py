@@ -6,9 +6,10 @@ from functools import partial
 import qtawesome as qta
 from PySide6.QtWidgets import QFileDialog, QSizePolicy, QWidget, QToolBar, QApplication, QComboBox, QStyle
 from PySide6.QtGui import QAction, QActionGroup, QIcon
+from PySide6.QtCore import Qt
 from UI.component import Wire, BeamSplitter, Switch, Loss, Detector, PhaseShift, XGate, YGate, ZGate, Hadamard, Qubit, CNOT
 from UI.canvas import Select, Grab
-from backends import FockBackend, PermanentBackend, MrMustardBackend, PercevalBackend, MPBackend, QiskitBackend
+import backends
 
 class ToolBar(QToolBar):
     """
@@ -59,11 +60,13 @@ class ToolBar(QToolBar):
                 "Loss": (Loss, QIcon("assets/loss.png")),
                 "Detector": (Detector, QIcon("assets/detector.png"))
             }
+            # Backends are listed by name, and only imported when chosen
             backend_options = {
-                "Fock backend": FockBackend,
-                "Permanent backend": PermanentBackend,
-                "Mr Mustard": MrMustardBackend,
-                "Perceval": PercevalBackend
+                "Fock backend": "FockBackend",
+                "Permanent backend": "PermanentBackend",
+                "Mr Mustard": "MrMustardBackend",
+                "Perceval": "PercevalBackend",
+                "Auto": "AutoPhotonicBackend"
             }
         else:
             tools = {
@@ -77,8 +80,10 @@ class ToolBar(QToolBar):
                 "CNOT": (CNOT, QIcon("assets/CNOT.png"))
             }
             backend_options = {
-                "Matrix product backend": MPBackend,
-                "Qiskit": QiskitBackend
+                "Matrix product backend": "MPBackend",
+                "Qiskit": "QiskitBackend",
+                "Stabilizer": "StabilizerBackend",
+                "Auto": "AutoGateBasedBackend"
             }
 
         # Buttons
@@ -90,7 +95,8 @@ class ToolBar(QToolBar):
         self.add_tools(tools)
         self.add_button("Delete", self.delete_trigger, delete_icon)
         self.addSeparator()
-        self.add_dropdown(self.set_backend, backend_options)
+        unavailable_backends = [label for label, backend_name in backend_options.items() if not backends.is_available(backend_name)]
+        self.add_dropdown(self.set_backend, backend_options, disabled_options=unavailable_backends, disabled_tooltip="Not installed")
         self.addSeparator()
         self.add_button("Re-center", self.recenter_trigger, recenter_icon)
         self.add_button("Run", self.window.worker_thread.start_task, run_icon)
@@ -128,16 +134,22 @@ class ToolBar(QToolBar):
     def on_tool_triggered(self, tool_type):
         self.set_active_tool(tool_type)
 
-    def add_dropdown(self, dropdown_trigger, options):
+    def add_dropdown(self, dropdown_trigger, options, disabled_options=(), disabled_tooltip=""):
         """
-        Add a dropdown menu to the toolbar.
+        Add a dropdown menu to the toolbar. Disabled options are listed but can't be selected.
         """
         dropdown = QComboBox()
         dropdown.addItems(options.keys())
+        for index, option in enumerate(options.keys()):
+            if option in disabled_options:
+                dropdown.model().item(index).setEnabled(False)
+                dropdown.setItemData(index, disabled_tooltip, Qt.ToolTipRole)
+        enabled_options = [option for option in options.keys() if option not in disabled_options]
+        dropdown.setCurrentText(enabled_options[0])
         dropdown.currentIndexChanged.connect(lambda index: dropdown_trigger(options[dropdown.currentText()]))
         self.addWidget(dropdown)
 
-        # Trigger first option
+        # Trigger first enabled option
         dropdown_trigger(options[dropdown.currentText()])
 
     def add_button(self, name, trigger, icon, checkable=False, checked=False):
@@ -156,8 +168,8 @@ class ToolBar(QToolBar):
     def set_active_tool(self, tool_type):
         self.window.canvas.active_tool = tool_type(self.window)
 
-    def set_backend(self, backend_choice):
-        self.window.interface.chosen_backend = backend_choice
+    def set_backend(self, backend_name):
+        self.window.interface.chosen_backend = getattr(backends, backend_name)
         self.window.console.refresh()
 
     def darkmode_trigger(self):
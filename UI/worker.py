@@ -28,12 +28,14 @@ class ProgressBar(QWidget):
 class WorkerThread(QThread):
     finished = Signal()
     error_occurred = Signal(str)
+    estimate_ready = Signal(str)
 
     def __init__(self, window, parent=None):
         super().__init__(parent)
         self.window = window
         self.finished.connect(self.on_task_finished)
         self.error_occurred.connect(self.print_error)
+        self.estimate_ready.connect(self.show_estimate)
 
         self.error_flag = 0
 
@@ -41,10 +43,14 @@ class WorkerThread(QThread):
         self.window.control_panel.output_tab.print_exception(message)
         self.error_flag = 1
 
+    def show_estimate(self, text):
+        self.window.control_panel.output_tab.show_estimate(text)
+
     def run(self):
         self.error_flag = 0
         try:
             self.window.interface.build_circuit()
+            self.estimate_ready.emit(self.window.interface.estimate_text)
             self.window.interface.run_circuit()
         except Exception as e:
             self.error_occurred.emit(str(e))
@@ -1,2 +1,37 @@
-from .photonic import FockBackend, PermanentBackend, MrMustardBackend, PercevalBackend
-from .gatebased import MPBackend, QiskitBackend
\ No newline at end of file
+"""
+Simulator backends. Backends are imported on first access (PEP 562), so importing one backend does not load
+the simulators and dependencies of the others.
+"""
+
+import importlib
+import importlib.util
+
+# Subpackage or module containing each backend, and the optional packages it needs
+_backends = {
+    "FockBackend": (".photonic", []),
+    "PermanentBackend": (".photonic", []),
+    "MrMustardBackend": (".photonic", ["mrmustard"]),
+    "PercevalBackend": (".photonic", ["perceval"]),
+    "MPBackend": (".gatebased", []),
+    "QiskitBackend": (".gatebased", ["qiskit", "qiskit_aer"]),
+    "StabilizerBackend": (".gatebased", []),
+    "AutoPhotonicBackend": (".auto_backend", []),
+    "AutoGateBasedBackend": (".auto_backend", []),
+}
+
+__all__ = list(_backends)
+
+def is_available(backend_name):
+    """True if the packages needed by a backend are installed. This is checked without importing them."""
+    return all(importlib.util.find_spec(package) is not None for package in _backends[backend_name][1])
+
+def __getattr__(name):
+    if name in _backends:
+        subpackage = importlib.import_module(_backends[name][0], __name__)
+        backend = getattr(subpackage, name)
+        globals()[name] = backend
+        return backend
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
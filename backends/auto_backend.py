@@ -0,0 +1,213 @@
+"""
+Backends that choose the simulator for each run. The circuit is recorded as usual, and when it is run its features
+are passed to the cost model of every simulator that can simulate it. The fastest one within the memory budget
+is built from the recorded operations and runs the circuit.
+"""
+
+import backends
+from backends.backend import PhotonicBackend, GateBasedBackend
+from backends.cost_model import CircuitFeatures, MODELS, UNSUPPORTED_COMPONENTS, machine_constants, format_bytes, format_seconds
+
+class AutoBackend:
+    """
+    Dispatch shared by the photonic and gate-based automatic backends. After a run, choice is the name of the
+    backend that was used, reason explains why, and estimates holds the estimate of every candidate. Compiled
+    circuits and batches are run in one engine, chosen when they are compiled or start.
+    """
+    # Candidate backends and the settings they are created with
+    engines = {}
+
+    # Time to import a simulator's packages and warm it up on its first run, added to its estimate while it is not loaded
+    cold_start_seconds = {"MrMustardBackend": 5.0, "PercevalBackend": 1.0, "QiskitBackend": 3.0}
+
+    def init_dispatch(self, reference):
+        """
+        reference (BaseBackend): backend whose components are created when components are added, so they are
+        validated straight away, before any simulator is chosen.
+        """
+        self.reference = reference
+        self._component_registry = reference._component_registry
+        self.engine = None
+        self.choice = None
+        self.reason = None
+        self.estimates = None
+
+    def create_component(self, component_type, **kwargs):
+        return self.reference.create_component(component_type, **kwargs)
+
+    def candidate_estimates(self, features):
+        """Estimates of every installed engine, including its cold start, and the reasons the others were left out."""
+        constants = machine_constants()
+        estimates, excluded = [], []
+        for name, settings in self.engines.items():
+            unsupported = UNSUPPORTED_COMPONENTS.get(name, set()) & set(features.component_counts)
+            if unsupported:
+                excluded.append(f"{name} can't simulate {', '.join(sorted(unsupported))}")
+            elif not backends.is_available(name):
+                excluded.append(f"{name} is not installed")
+            else:
+                estimate = MODELS[name](features, constants, **settings)
+                if name not in vars(backends):
+                    estimate = estimate._replace(seconds=estimate.seconds + self.cold_start_seconds.get(name, 0))
+                estimates.append(estimate)
+        return sorted(estimates, key=lambda e: e.seconds), excluded
+
+    def choose(self, features):
+        """
+        Picks the fastest engine that fits in the memory budget. If none fit, picks the one needing least memory,
+        whose estimate is reported by estimate(), but no engine is built.
+        """
+        estimates, excluded = self.candidate_estimates(features)
+        if not estimates:
+            raise ValueError(f"No installed backend can simulate this circuit: {'; '.join(excluded)}.")
+
+        fitting = [e for e in estimates if self.memory_budget is None or e.peak_bytes <= self.memory_budget]
+        if fitting:
+            chosen = fitting[0]
+            reason = f"{chosen.backend} has the shortest estimated time"
+        else:
+            chosen = min(estimates, key=lambda e: e.peak_bytes)
+            reason = f"No backend fits in the memory budget, and {chosen.backend} would need the least memory"
+
+        over_budget = [e.backend for e in estimates if e not in fitting]
+        if over_budget:
+            excluded.append(f"{', '.join(over_budget)} would exceed the memory budget of {format_bytes(self.memory_budget)}")
+        ranking = ", ".join(f"{e.backend} {format_seconds(e.seconds)} and {format_bytes(e.peak_bytes)}" for e in estimates)
+        reason += f" ({ranking})."
+        if excluded:
+            reason += " " + "; ".join(excluded) + "."
+
+        self.choice, self.reason, self.estimates = chosen.backend, reason, estimates
+        return chosen
+
+    def build_engine(self, ir, input_basis_element):
+        """
+        Chooses an engine for the circuit and input state, and creates it with the operations of ir, which are
+        the recorded operations or a variant of them with other parameters. Raises an error if no engine fits in
+        the memory budget.
+        """
+        chosen = self.choose(CircuitFeatures.of(self, input_basis_element))
+        if self.memory_budget is not None and chosen.peak_bytes > self.memory_budget:
+            raise ValueError(self.reason)
+        engine = getattr(backends, self.choice)(*self.engine_size, **self.engines[self.choice])
+        for op in ir:
+            engine.add_component_by_type(op.component_type, **op.kwargs)
+        return engine
+
+    def estimate(self, input_basis_element=None):
+        """Estimate of the engine that would be chosen."""
+        return self.choose(CircuitFeatures.of(self, input_basis_element))
+
+    def set_input_state(self, input_basis_element):
+        super().set_input_state(input_basis_element)
+        self.engine = None
+
+    def simulate(self):
+        self.engine = self.build_engine(self.ir, self.input_basis_element)
+        self.prepare_engine()
+        self.engine.set_input_state(self.input_basis_element)
+        self.engine.simulate()
+
+    def prepare_engine(self):
+        """Applies settings of the automatic backend to a new engine before it runs."""
+        pass
+
+    def compile(self, ir):
+        """
+        Chooses an engine for the current input state, or the largest input if none is set, and compiles the
+        circuit in it once. Every execution uses the same engine.
+        """
+        compiled = super().compile(ir)
+        compiled.engine = self.build_engine(ir, self.input_basis_element)
+        compiled.engine_compiled = compiled.engine.compile(ir)
+        compiled.choice, compiled.reason, compiled.estimates = self.choice, self.reason, self.estimates
+        return compiled
+
+    def execute(self, compiled, input_basis_element):
+        self.validate_compiled(compiled)
+        self.set_input_state(input_basis_element)
+        self.engine, self.choice, self.reason, self.estimates = compiled.engine, compiled.choice, compiled.reason, compiled.estimates
+        self.engine.execute(compiled.engine_compiled, input_basis_element)
+        self.result = self.create_result()
+        return self.get_output_data()
+
+    def nonzero_output(self):
+        return self.engine.nonzero_output()
+
+    def state_nbytes(self):
+        return self.engine.state_nbytes() if self.engine is not None else 0
+
+    @property
+    def _probabilities(self):
+        return self.engine._probabilities
+
+    @property
+    def _occupied_ranks(self):
+        return self.engine._occupied_ranks
+
+    @property
+    def _nonzero_probabilities(self):
+        return self.engine._nonzero_probabilities
+
+    @property
+    def _basis_strings(self):
+        return self.engine._basis_strings
+
+class AutoPhotonicBackend(AutoBackend, PhotonicBackend):
+    """
+    Photonic backend that runs each circuit in the fastest photonic backend that can simulate it. Lossless
+    circuits with few photons usually go to the permanent or Perceval backends, and circuits with loss to a
+    density matrix.
+    """
+    engines = {"FockBackend": {}, "PermanentBackend": {}, "MrMustardBackend": {}, "PercevalBackend": {}}
+
+    def __init__(self, n_wires, n_photons):
+        super().__init__(n_wires, n_photons)
+        self.init_dispatch(backends.PermanentBackend(n_wires, n_photons))
+
+    @property
+    def engine_size(self):
+        return (self.n_wires, self.n_photons)
+
+    def run_many(self, input_states):
+        """Runs the batch in the engine chosen for its input with the most photons, using the engine's own batched path."""
+        for input_state in input_states:
+            self.validate_input_state(input_state)
+        engine = self.build_engine(self.ir, max(input_states, key=sum, default=None))
+        return engine.run_many(input_states)
+
+    def run_sweep(self, sweep):
+        """Runs the sweep in the engine chosen for the current input state, using the engine's own batched path."""
+        swept, _ = self.sweep_points(sweep)
+        engine = self.build_engine(self.ir, self.input_basis_element)
+        engine.set_input_state(self.input_basis_element)
+        return engine.run_sweep(swept)
+
+class AutoGateBasedBackend(AutoBackend, GateBasedBackend):
+    """
+    Gate-based backend that runs each circuit in the fastest gate-based backend that can simulate it. Circuits
+    of Clifford gates usually go to the stabilizer backend, and others to a state vector.
+    """
+    engines = {"StabilizerBackend": {}, "MPBackend": {"method": "statevector"}, "QiskitBackend": {}}
+
+    def __init__(self, n_qubits):
+        super().__init__(n_qubits)
+        self.init_dispatch(backends.MPBackend(n_qubits))
+        self.optimized = False
+
+    @property
+    def engine_size(self):
+        return (self.n_qubits,)
+
+    def optimize(self):
+        """
+        Optimizes the gates of every engine built afterwards, each with its own pass, so the Stabilizer backend
+        is not given fused unitaries. Returns the number of gates before and after optimizing for the reference backend.
+        """
+        self.optimized = True
+        _, self.gate_counts = self.optimized_components(self.component_list)
+        return self.gate_counts
+
+    def prepare_engine(self):
+        if self.optimized:
+            self.engine.optimize()
@@ -2,30 +2,150 @@
 Contains backend templates.
 """
 
+import time
+import numpy as np
 from abc import ABC, abstractmethod
-from backends.utils import fock_hilbert_dimension, fill_table, rank_to_fock_basis, fock_basis_to_rank
+from contextlib import contextmanager
+from backends.utils import fock_hilbert_dimension, rank_to_fock_basis, fock_basis_to_rank, degrees_to_radians
+from backends.gate_fusion import GATE_UNITARIES, GateBlock, optimize_gates
+from backends.circuit_ir import Operation, CircuitIR, CompiledCircuit
+from backends.result import Result
+from backends.basis import FockBasis, QubitBasis
+from backends.profiling import Profiler
+from backends.cost_model import CircuitFeatures, recommend, format_bytes, format_seconds
 
 class BaseBackend(ABC):
     """Base class for simulator backends."""
-    _component_registry = {}
+    # Attributes that change the results of a run, besides the components and input state. Part of the cache key.
+    cache_settings = ()
+
+    # Attributes holding the simulation state, whose size is reported when profiling
+    state_attributes = ()
+
+    # Methods timed as phases of a run when profiling. Backends add their own expensive steps.
+    profiled_phases = ("compile", "simulate", "create_result", "get_output_data")
+
+    # Largest estimated peak memory, in bytes, of a simulation that run() will start. None disables the check.
+    memory_budget = None
 
     def __init__(self):
         self.component_list = []
+        self.operations = []
+        self._component_registry = {}
+        self.input_basis_element = None
+
+        # Result of the last run
+        self.result = None
+
+        # Optional ResultCache consulted by run(), and the result it returned for the last run if there was a hit
+        self.cache = None
+        self.cached_result = None
 
-    @classmethod
-    def register_component(cls, component_type, component_class):
+        # Profiler measuring this backend's calls, while one is attached
+        self.profiler = None
+
+    def register_component(self, component_type, component_class):
         """Connect a component type with its class in a particular backend."""
-        cls._component_registry[component_type] = component_class
+        self._component_registry[component_type] = component_class
 
     def add_component_by_type(self, component_type, **kwargs):
-        """Add an arbitrary component to the simulation."""
-        component_type = self._component_registry[component_type]
-        component = component_type(self, **kwargs)
+        """Add an arbitrary component to the simulation. Returns the component."""
+        component = self.create_component(component_type, **kwargs)
         self.component_list.append(component)
+        self.operations.append(Operation.from_kwargs(component_type, kwargs))
+        return component
+
+    def create_component(self, component_type, **kwargs):
+        """Creates this backend's component for a component type, without adding it to the circuit."""
+        component_class = self._component_registry[component_type]
+        return component_class(self, **kwargs)
+
+    def component_types(self, components):
+        """Component type of each component, found from the classes registered for the types."""
+        component_types = {component_class: component_type for component_type, component_class in self._component_registry.items()}
+        return [component_types[type(comp)] for comp in components]
+
+    @property
+    def ir(self):
+        """Backend-independent record of the components added to the circuit."""
+        return CircuitIR(self.operations)
+
+    def compile(self, ir):
+        """
+        Prepares a circuit for repeated execution with execute(). The default creates this backend's components;
+        backends override this to also do their expensive preparation once.
+        """
+        components = [self.create_component(op.component_type, **op.kwargs) for op in ir]
+        return CompiledCircuit(self, ir, components)
+
+    def execute(self, compiled, input_basis_element):
+        """
+        Runs a compiled circuit on an input state, and returns the output table like get_output_data.
+        The default simulates the compiled components.
+        """
+        self.validate_compiled(compiled)
+        with self.using_components(compiled.components):
+            self.set_input_state(input_basis_element)
+            self.simulate()
+            self.result = self.create_result()
+        return self.get_output_data()
+
+    def validate_compiled(self, compiled):
+        if compiled.backend is not self:
+            raise ValueError("Circuit was compiled by a different backend.")
+
+    @contextmanager
+    def using_components(self, components):
+        """Temporarily replaces component_list, so compiled components can go through the usual simulate() machinery."""
+        component_list = self.component_list
+        self.component_list = components
+        try:
+            yield
+        finally:
+            self.component_list = component_list
+
+    @contextmanager
+    def preserving_state(self):
+        """
+        Restores the backend's attributes when the block ends, so runs inside it, such as the runs of a batch, leave
+        the input state, the result and the simulation state as they were. The arrays in state_attributes are
+        copied, since they may be changed in place.
+        """
+        saved = dict(vars(self))
+        for name in self.state_attributes:
+            if isinstance(saved.get(name), np.ndarray):
+                saved[name] = saved[name].copy()
+        try:
+            yield
+        finally:
+            for name in set(vars(self)) - set(saved):
+                delattr(self, name)
+            vars(self).update(saved)
 
     def get_output_data(self):
-        """Returns a 2-column array containing basis elements and their probabilities."""
-        return fill_table(self._basis_strings, self._nonzero_probabilities)
+        """
+        Returns a 2-column array containing basis elements and their probabilities. This is the table of the
+        Result returned by run(), which holds the same data as arrays.
+        """
+        result = self.result if self.result is not None else self.create_result()
+        return result.table.copy()
+
+    def create_result(self):
+        """Result holding the current output distribution."""
+        ranks, probabilities = self.nonzero_output()
+        return Result(ranks, probabilities, self.basis)
+
+    def nonzero_output(self):
+        """Ranks of the basis elements with nonzero probability, and their probabilities. The default reads _probabilities once."""
+        probabilities = self._probabilities
+        ranks = np.nonzero(probabilities)[0]
+        return ranks, probabilities[ranks]
+
+    @property
+    @abstractmethod
+    def basis(self):
+        """Basis of the state space, which converts between ranks and occupation numbers."""
+        raise NotImplementedError
 
     @abstractmethod
     def rank_to_basis(self, rank):
@@ -73,10 +193,106 @@ class BaseBackend(ABC):
         input_basis_element (list): a single basis element, ex. [0, 1, 0, 1].
         """
         self.validate_input_state(input_basis_element)
+        self.input_basis_element = input_basis_element
+        self.result = None
+        self.cached_result = None
 
-    @abstractmethod
     def run(self):
-        """Run the simulation."""
+        """
+        Run the simulation and return its Result. If a ResultCache is assigned to cache and the same circuit was
+        already run on the same input, its stored result is returned instead, and the simulation state is not updated.
+        """
+        key = self.lookup_cache()
+        if self.cached_result is not None:
+            return self.result
+
+        self.check_memory_budget()
+        start = time.perf_counter()
+        self.simulate()
+        self.result = self.create_result()
+        if key is not None:
+            self.cache.put(key, self.result.ranks, self.result.probabilities, time.perf_counter() - start)
+        return self.result
+
+    def lookup_cache(self):
+        """
+        Looks up the circuit and input state in the cache. On a hit, sets cached_result and result to the stored
+        result. Returns the cache key, or None if results are not cached.
+        """
+        self.cached_result = None
+        if self.cache is None or not self.cacheable:
+            return None
+        key = self.cache.key(self)
+        self.cached_result = self.cache.get(key)
+        if self.cached_result is not None:
+            self.result = Result(self.cached_result.ranks, self.cached_result.probabilities, self.basis)
+        return key
+
+    def iter_outputs(self, chunk_size=2**16):
+        """
+        Runs the simulation and yields (occupations, probabilities) for the basis elements with nonzero probability,
+        in rank order, in chunks of up to chunk_size elements. The default runs the whole simulation first and
+        only converts one chunk at a time to occupation numbers. Backends that compute the outputs incrementally
+        override this, so the first chunks arrive before the run finishes.
+        """
+        result = self.run()
+        for start in range(0, len(result), chunk_size):
+            yield self.basis.occupations(result.ranks[start:start + chunk_size]), result.probabilities[start:start + chunk_size]
+
+    def run_top_k(self, k):
+        """
+        Runs the simulation and returns a Result containing only the k most likely basis elements, most likely first.
+        The default selects them from the full result. Backends that can skip the other outputs override this.
+        """
+        return self.run().top_k(k)
+
+    @abstractmethod
+    def estimate(self, input_basis_element=None):
+        """
+        Estimate of the peak memory and time of a run, from a model of the backend's algorithm and constants
+        measured on this machine. Uses the input state if it is set, otherwise input_basis_element, or the
+        maximum number of photons if neither is given. See backends.cost_model.
+        """
+        raise NotImplementedError
+
+    def check_memory_budget(self, input_basis_element=None):
+        """
+        Raises an error if the estimated peak memory of a run is more than memory_budget, recommending the
+        fastest backend that would fit. Called by run() before simulating.
+        """
+        if self.memory_budget is None:
+            return
+        estimate = self.estimate(input_basis_element)
+        if estimate.peak_bytes <= self.memory_budget:
+            return
+
+        message = f"{type(self).__name__} is estimated to need {format_bytes(estimate.peak_bytes)}, which is more than the memory budget of {format_bytes(self.memory_budget)}."
+        alternatives = [e for e in recommend(CircuitFeatures.of(self, input_basis_element), self.memory_budget) if e.backend != type(self).__name__]
+        if alternatives:
+            message += f" {alternatives[0].backend} is estimated to need {format_bytes(alternatives[0].peak_bytes)} and {format_seconds(alternatives[0].seconds)}."
+        else:
+            message += " No other backend fits in the budget."
+        raise ValueError(message)
+
+    def profile(self, callback=None, trace_memory=True):
+        """
+        Profiler to use as a context manager. Inside it, every component's apply() and every phase of a run is
+        timed, with the memory allocated and the size of the state afterwards. See backends.profiling.Profiler.
+        """
+        return Profiler(self, callback, trace_memory)
+
+    def state_nbytes(self):
+        """Bytes held by the arrays in state_attributes."""
+        return sum(getattr(getattr(self, name, None), "nbytes", 0) for name in self.state_attributes)
+
+    @property
+    def cacheable(self):
+        """Whether a run always gives the same result, so it can be cached."""
+        return True
+
+    @abstractmethod
+    def simulate(self):
+        """Propagate the input state through the components."""
         raise NotImplementedError
     
     @abstractmethod
@@ -91,6 +307,11 @@ class PhotonicBackend(BaseBackend):
     The basis states are Fock states, (n_1, n_2, ..., n_M), where each n_i is the occupation
     number for mode i.
     """
+    cache_settings = ("n_wires", "n_photons")
+
+    # Parameter varied by run_sweep for each component type that has one
+    sweep_parameters = {"beamsplitter": "theta", "phaseshift": "phase", "loss": "eta"}
+
     def __init__(self, n_wires, n_photons):
         super().__init__()
 
@@ -103,6 +324,10 @@ class PhotonicBackend(BaseBackend):
     @property
     def hilbert_dimension(self):
         return fock_hilbert_dimension(self.n_wires, self.n_photons)
+
+    @property
+    def basis(self):
+        return FockBasis(self.n_wires, self.n_photons)
     
     def validate_input_state(self, input_basis_element):
         if not isinstance(input_basis_element, tuple):
@@ -114,6 +339,97 @@ class PhotonicBackend(BaseBackend):
         if not all(0 <= occupation_number <= self.n_photons for occupation_number in input_basis_element):
             raise ValueError(f"Occupation numbers must be between 0 and {self.n_photons}.")
     
+    def create_result(self):
+        result = super().create_result()
+        self.check_population(result.probabilities)
+        return result
+
+    def check_population(self, probabilities):
+        """
+        Raises an error if detectors heralded out every outcome of a run, or of any row of a batch of runs.
+        Backends whose detectors do not check this themselves rely on it being called on every result.
+        """
+        if "detector" in self.component_types(self.component_list) and not np.all(np.any(probabilities, axis=-1)):
+            raise ValueError("No population remaining.")
+
+    def run_many(self, input_states):
+        """
+        Runs the circuit on each input state. Returns an array of output probabilities with one row per input
+        state, with basis states in rank order. The circuit is compiled once and executed for every input, and
+        the input state, result and simulation state are restored afterwards.
+        """
+        for input_state in input_states:
+            self.validate_input_state(input_state)
+
+        probabilities = np.zeros((len(input_states), self.hilbert_dimension))
+        with self.preserving_state():
+            compiled = self.compile(self.ir)
+            for row, input_state in zip(probabilities, input_states):
+                self.execute(compiled, input_state)
+                row[:] = self._probabilities
+        return probabilities
+
+    def run_sweep(self, sweep):
+        """
+        Runs the circuit on the current input state at every point of a parameter sweep. Returns an array of
+        output probabilities with one row per point, with basis states in rank order.
+
+        sweep (dict): maps components, as returned by the add_* methods or by their index in component_list,
+        to equal-length arrays of values for their parameter: theta for beam splitters, phase for phase shifts
+        and eta for losses. Point i uses the i-th value of every array.
+
+        The default compiles and executes the circuit once per point, restoring the backend's state afterwards.
+        Backends override this to evaluate all points in one batched pass.
+        """
+        swept, n_points = self.sweep_points(sweep)
+        probabilities = np.zeros((n_points, self.hilbert_dimension))
+        with self.preserving_state():
+            for point, row in enumerate(probabilities):
+                operations = [op.with_params(**{self.sweep_parameters[op.component_type]: float(swept[index][point])}) if index in swept else op for index, op in enumerate(self.operations)]
+                self.execute(self.compile(CircuitIR(operations)), self.input_basis_element)
+                row[:] = self._probabilities
+        return probabilities
+
+    def sweep_points(self, sweep):
+        """Validates a sweep for run_sweep. Returns a dict of {index in component_list: array of values} and the number of points."""
+        if self.input_basis_element is None:
+            raise ValueError("Set an input state before running a sweep.")
+        if not sweep:
+            raise ValueError("Sweep must contain at least one component.")
+
+        swept = {}
+        for component, values in sweep.items():
+            if isinstance(component, (int, np.integer)):
+                if not 0 <= component < len(self.component_list):
+                    raise ValueError(f"Component index must be between 0 and {len(self.component_list) - 1}.")
+                index = int(component)
+            elif any(component is comp for comp in self.component_list):
+                index = next(i for i, comp in enumerate(self.component_list) if comp is component)
+            else:
+                raise ValueError("Swept component is not in the circuit.")
+
+            component_type = self.operations[index].component_type
+            if component_type not in self.sweep_parameters:
+                raise ValueError(f"Components of type {component_type} have no parameter to sweep.")
+
+            values = np.asarray(values, dtype=float)
+            if values.ndim != 1 or len(values) == 0:
+                raise ValueError("Swept values must be a non-empty 1-D array.")
+
+            # Parameter ranges are intervals, so checking the extremes validates every value
+            component = self.component_list[index]
+            for value in (values.min(), values.max()):
+                if self.sweep_parameters[component_type] == "eta":
+                    component.validate_transmission(float(value))
+                else:
+                    component.validate_angle(float(degrees_to_radians(value)))
+            swept[index] = values
+
+        n_points = {len(values) for values in swept.values()}
+        if len(n_points) > 1:
+            raise ValueError("All swept components must have the same number of values.")
+        return swept, n_points.pop()
+
     def rank_to_basis(self, rank):
         """Returns a Fock basis element given its rank in the space."""
         return rank_to_fock_basis(self.n_wires, self.n_photons, rank)
@@ -125,19 +441,19 @@ class PhotonicBackend(BaseBackend):
     # Add components
 
     def add_beamsplitter(self, **kwargs):
-        self.add_component_by_type("beamsplitter", **kwargs)
+        return self.add_component_by_type("beamsplitter", **kwargs)
 
     def add_switch(self, **kwargs):
-        self.add_component_by_type("switch", **kwargs)
+        return self.add_component_by_type("switch", **kwargs)
 
     def add_phaseshift(self, **kwargs):
-        self.add_component_by_type("phaseshift", **kwargs)
+        return self.add_component_by_type("phaseshift", **kwargs)
 
     def add_loss(self, **kwargs):
-        self.add_component_by_type("loss", **kwargs)
+        return self.add_component_by_type("loss", **kwargs)
 
     def add_detector(self, **kwargs):
-        self.add_component_by_type("detector", **kwargs)
+        return self.add_component_by_type("detector", **kwargs)
 
 
 class GateBasedBackend(BaseBackend):
@@ -146,6 +462,8 @@ class GateBasedBackend(BaseBackend):
     using logic gates. The basis states are computational states, i.e. lists of
     zeros and ones.
     """
+    cache_settings = ("n_qubits",)
+
     def __init__(self, n_qubits):
         super().__init__()
 
@@ -153,10 +471,50 @@ class GateBasedBackend(BaseBackend):
             raise ValueError("No qubits in the circuit.")
 
         self.n_qubits = n_qubits
+        self.gate_counts = None
 
     @property
     def hilbert_dimension(self):
         return 2**self.n_qubits
+
+    @property
+    def basis(self):
+        return QubitBasis(self.n_qubits)
+
+    def optimize(self):
+        """
+        Compilation pass over component_list, to be called before run(). Cancels pairs of self-inverse gates and,
+        if the backend can apply arbitrary unitaries, fuses consecutive gates on the same one or two qubits into
+        a single gate. Returns the number of gates before and after. The recorded operations are replaced as well,
+        so ir, and the circuits compiled or cached from it, are of the optimized gates.
+        """
+        operations = {id(comp): op for comp, op in zip(self.component_list, self.operations)}
+        self.component_list, self.gate_counts = self.optimized_components(self.component_list)
+        self.operations = [operations[id(comp)] if id(comp) in operations else Operation.from_kwargs("unitary", {"qubits": comp.targeted_qubits, "unitary": comp.unitary}) for comp in self.component_list]
+        return self.gate_counts
+
+    def optimized_components(self, components):
+        """Returns the optimized list of components, and the number of gates before and after."""
+        blocks = []
+        for comp, component_type in zip(components, self.component_types(components)):
+            unitary = comp.unitary if component_type == "unitary" else GATE_UNITARIES[component_type]
+            blocks.append(GateBlock(component_type, comp.reindexed_targeted_qubits, unitary, comp))
+
+        blocks = optimize_gates(blocks, fuse="unitary" in self._component_registry)
+
+        optimized = []
+        for block in blocks:
+            if block.is_fused:
+                optimized.append(self.create_component("unitary", qubits=[q + 1 for q in block.qubits], unitary=block.unitary))
+            else:
+                optimized.append(block.components[0])
+        return optimized, {"before": len(components), "after": len(optimized)}
+
+    def compile(self, ir):
+        """Creates the components and optimizes them once, so every execution runs the optimized gates."""
+        compiled = super().compile(ir)
+        compiled.components, compiled.gate_counts = self.optimized_components(compiled.components)
+        return compiled
     
     def validate_input_state(self, input_basis_element):
         if not isinstance(input_basis_element, tuple):
@@ -173,21 +531,25 @@ class GateBasedBackend(BaseBackend):
         return bin(rank)[2:].zfill(self.n_qubits)
     
     def basis_to_rank(self, basis_element):
-        pass
+        """Returns a computational basis element's rank by converting binary to decimal."""
+        return int("".join(str(qubit_state) for qubit_state in basis_element), 2)
     
     # Add components
 
     def add_xgate(self, **kwargs):
-        self.add_component_by_type("xgate", **kwargs)
+        return self.add_component_by_type("xgate", **kwargs)
 
     def add_ygate(self, **kwargs):
-        self.add_component_by_type("ygate", **kwargs)
+        return self.add_component_by_type("ygate", **kwargs)
 
     def add_zgate(self, **kwargs):
-        self.add_component_by_type("zgate", **kwargs)
+        return self.add_component_by_type("zgate", **kwargs)
 
     def add_hadamard(self, **kwargs):
-        self.add_component_by_type("hadamard", **kwargs)
+        return self.add_component_by_type("hadamard", **kwargs)
 
     def add_cnot(self, **kwargs):
-        self.add_component_by_type("cnot", **kwargs)
\ No newline at end of file
+        return self.add_component_by_type("cnot", **kwargs)
+
+    def add_unitary(self, **kwargs):
+        return self.add_component_by_type("unitary", **kwargs)
\ No newline at end of file
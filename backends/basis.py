@@ -0,0 +1,54 @@
+"""
+Bases of the state spaces simulated by the backends, which convert between ranks and occupation numbers for
+many basis elements at once.
+"""
+
+import numpy as np
+from backends.utils import fock_unrank, fock_ranks, fock_hilbert_dimension
+
+class FockBasis:
+    """Fock basis elements of n_wires wires with up to n_photons photons in total."""
+    def __init__(self, n_wires, n_photons):
+        self.n_wires = n_wires
+        self.n_photons = n_photons
+
+    @property
+    def dimension(self):
+        return fock_hilbert_dimension(self.n_wires, self.n_photons)
+
+    def occupations(self, ranks):
+        """Occupation numbers of the basis elements with the given ranks, one row per rank. Only those rows are built."""
+        return fock_unrank(self.n_wires, self.n_photons, ranks)
+
+    def ranks(self, occupations):
+        """Ranks of the basis elements given by the rows of occupations."""
+        return fock_ranks(occupations)
+
+    def subsystem(self, n_wires):
+        """Basis of a subset of n_wires wires, which can hold all of the photons."""
+        return FockBasis(n_wires, self.n_photons)
+
+class QubitBasis:
+    """Computational basis elements of n_qubits qubits."""
+    def __init__(self, n_qubits):
+        self.n_qubits = n_qubits
+
+    @property
+    def dimension(self):
+        return 2**self.n_qubits
+
+    def occupations(self, ranks):
+        """States of the qubits in the basis elements with the given ranks, one row per rank."""
+        shifts = np.arange(self.n_qubits - 1, -1, -1)
+        return (np.asarray(ranks).reshape(-1, 1) >> shifts) & 1
+
+    def ranks(self, occupations):
+        """Ranks of the basis elements given by the rows of occupations, which are binary numbers."""
+        occupations = np.asarray(occupations)
+        if self.n_qubits < 64:
+            return occupations.astype(np.int64) @ (1 << np.arange(self.n_qubits - 1, -1, -1, dtype=np.int64))
+        # Ranks of more than 63 qubits are Python integers
+        return np.array([int("".join(str(bit) for bit in row), 2) for row in occupations.tolist()], dtype=object)
+
+    def subsystem(self, n_qubits):
+        return QubitBasis(n_qubits)
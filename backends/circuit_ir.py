@@ -0,0 +1,70 @@
+"""
+Backend-independent representation of a circuit. A backend records an operation for every component added
+with the add_* methods, and any backend can compile the resulting CircuitIR once and execute it many times.
+"""
+
+from collections import namedtuple
+import numpy as np
+
+def _freeze(value):
+    """Immutable copy of a component argument. Lists become tuples and arrays become read-only."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, np.ndarray):
+        value = value.copy()
+        value.flags.writeable = False
+    return value
+
+def _thaw(value):
+    """Reverses _freeze for the arguments passed to components, which expect lists."""
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+class Operation(namedtuple("Operation", ["component_type", "params"])):
+    """A component type and the (name, value) pairs of the keyword arguments it was added with."""
+    __slots__ = ()
+
+    @classmethod
+    def from_kwargs(cls, component_type, kwargs):
+        return cls(component_type, tuple(sorted((name, _freeze(value)) for name, value in kwargs.items())))
+
+    @property
+    def kwargs(self):
+        """Keyword arguments for creating the component in a backend."""
+        return {name: _thaw(value) for name, value in self.params}
+
+    def with_params(self, **changes):
+        """Copy of the operation with some keyword arguments replaced."""
+        return Operation.from_kwargs(self.component_type, {**self.kwargs, **changes})
+
+class CircuitIR:
+    """Immutable sequence of operations."""
+    def __init__(self, operations=()):
+        self._operations = tuple(operations)
+
+    @property
+    def operations(self):
+        return self._operations
+
+    def __iter__(self):
+        return iter(self._operations)
+
+    def __len__(self):
+        return len(self._operations)
+
+    def __getitem__(self, index):
+        return self._operations[index]
+
+    def __repr__(self):
+        return f"CircuitIR({list(self._operations)})"
+
+class CompiledCircuit:
+    """
+    A circuit prepared by one backend for repeated execution. Holds the backend's components for the
+    circuit, and backends attach whatever else they precompute in compile().
+    """
+    def __init__(self, backend, ir, components):
+        self.backend = backend
+        self.ir = ir
+        self.components = components
@@ -1,3 +1,4 @@
+import numpy as np
 from abc import ABC, abstractmethod
 
 class Component(ABC):
@@ -82,4 +83,12 @@ class Component(ABC):
         self.validate_qubits(qubits, 1)
 
     def validate_two_qubit_gate(self, qubits):
-        self.validate_qubits(qubits, 2)
\ No newline at end of file
+        self.validate_qubits(qubits, 2)
+
+    def validate_unitary_gate(self, qubits, unitary):
+        self.validate_qubits(qubits, len(qubits))
+        size = 2**len(qubits)
+        if np.shape(unitary) != (size, size):
+            raise ValueError(f"Unitary must be a {size}x{size} matrix.")
+        if not np.allclose(unitary @ np.conjugate(unitary).T, np.eye(size)):
+            raise ValueError("Matrix must be unitary.")
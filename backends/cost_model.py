@@ -0,0 +1,289 @@
+"""
+Predicts the peak memory and running time of a simulation before it is run. Each backend has a model of its own
+algorithm in terms of the size of the state space, the number of photons or qubits, and the number of components
+of each type. Times are scaled by constants measured on this machine the first time they are needed.
+
+The estimates are meant to tell a run of seconds from a run of hours, and a state of megabytes from one of
+hundreds of gigabytes. They are not precise.
+"""
+
+import functools
+import math
+import os
+import time
+from collections import namedtuple, Counter
+import numpy as np
+from backends.utils import fock_hilbert_dimension, fock_hilbert_dimension_fixed_number
+
+COMPLEX_BYTES = np.dtype(complex).itemsize
+FLOAT_BYTES = np.dtype(float).itemsize
+
+class MachineConstants(namedtuple("MachineConstants", ["multiply_adds_per_second", "bytes_per_second", "python_op_seconds"])):
+    """
+    multiply_adds_per_second (float): complex multiply-adds per second in a matrix product.
+    bytes_per_second (float): bytes per second read and written by an elementwise complex array operation.
+    python_op_seconds (float): seconds for one iteration of a Python loop over NumPy scalars.
+    """
+    __slots__ = ()
+
+@functools.cache
+def machine_constants():
+    """Measures the machine once per session, which takes a few tens of milliseconds."""
+    def fastest(task, repeats=3):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            task()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    matrix = np.ones((128, 128), dtype=complex)
+    vector = np.ones(2**18, dtype=complex)
+    small_matrix = np.ones((4, 4), dtype=complex)
+    def python_ops():
+        product = 1
+        for _ in range(1000):
+            product *= small_matrix[..., 1, 2]
+
+    return MachineConstants(
+        multiply_adds_per_second = 4*128**3/fastest(lambda: [matrix @ matrix for _ in range(4)]),
+        bytes_per_second = 4*2*vector.nbytes/fastest(lambda: [vector*1j for _ in range(4)]),
+        python_op_seconds = fastest(python_ops)/1000,
+    )
+
+def physical_memory():
+    """Bytes of physical memory, or None where it can't be found."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE")*os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def format_bytes(n_bytes):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if n_bytes < 1024:
+            return f"{n_bytes:.3g} {unit}"
+        n_bytes /= 1024
+    return f"{n_bytes:.3g} TiB"
+
+def format_seconds(seconds):
+    if seconds < 1:
+        return f"{seconds*1e3:.3g} ms"
+    if seconds < 3600:
+        return f"{seconds:.3g} s"
+    return f"{seconds/3600:.3g} h"
+
+class Estimate(namedtuple("Estimate", ["backend", "peak_bytes", "seconds", "state_bytes", "output_bytes"])):
+    """
+    Predicted cost of a run.
+
+    backend (str): name of the backend class.
+    peak_bytes (int): largest memory in use during the run, including temporary arrays.
+    seconds (float): wall time of the run.
+    state_bytes (int): size of the simulation state.
+    output_bytes (int): size of the output probabilities and their ranks.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return f"{self.backend}: about {format_bytes(self.peak_bytes)} and {format_seconds(self.seconds)}"
+
+class CircuitFeatures(namedtuple("CircuitFeatures", ["simulation_type", "n_wires", "n_photons", "n_input_photons", "component_counts"])):
+    """
+    Everything the cost models need to know about a circuit.
+
+    simulation_type (str): "photonic" or "gatebased".
+    n_wires (int): number of wires, or qubits.
+    n_photons (int): maximum number of photons of the backend, or 0 for gate-based circuits.
+    n_input_photons (int): photons in the input state, or n_photons if it is not set yet.
+    component_counts (dict): number of components of each component type, ex. {"beamsplitter": 3}.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, backend, input_basis_element=None):
+        """
+        Features of a backend's circuit, with its input state or the one given. Components are counted from
+        component_list, so gates fused or cancelled by optimize() are taken into account.
+        """
+        input_basis_element = input_basis_element if input_basis_element is not None else backend.input_basis_element
+        counts = dict(Counter(backend.component_types(backend.component_list)))
+        if hasattr(backend, "n_qubits"):
+            return cls("gatebased", backend.n_qubits, 0, 0, counts)
+        n_input_photons = sum(input_basis_element) if input_basis_element else backend.n_photons
+        return cls("photonic", backend.n_wires, backend.n_photons, n_input_photons, counts)
+
+    def count(self, *component_types):
+        return sum(self.component_counts.get(component_type, 0) for component_type in component_types)
+
+    @property
+    def n_components(self):
+        return sum(self.component_counts.values())
+
+    @property
+    def hilbert_dimension(self):
+        if self.simulation_type == "gatebased":
+            return 2**self.n_wires
+        return fock_hilbert_dimension(self.n_wires, self.n_photons)
+
+    @property
+    def n_outputs(self):
+        """Largest number of output states with nonzero probability. Loss spreads the output over every photon number."""
+        if self.simulation_type == "gatebased" or self.count("loss"):
+            return self.hilbert_dimension
+        return fock_hilbert_dimension_fixed_number(self.n_wires, self.n_input_photons)
+
+def _estimate(backend, features, constants, state_bytes, temporary_bytes, seconds):
+    """
+    Adds the output arrays, one probability and one rank per output, to an estimate of the simulation itself,
+    and the fixed cost of a run, which validates the circuit and builds the Result.
+    """
+    output_bytes = 2*FLOAT_BYTES*features.n_outputs
+    seconds += 2000*constants.python_op_seconds
+    return Estimate(backend, int(state_bytes + temporary_bytes + output_bytes), float(seconds), int(state_bytes), int(output_bytes))
+
+def fock_estimate(features, constants):
+    """
+    The density matrix has dimension D squared. Each linear optical component builds a D x D unitary and
+    multiplies the density matrix by it on both sides, and each loss does the same for a Kraus operator per
+    number of lost photons.
+    """
+    dimension = features.hilbert_dimension
+    state_bytes = COMPLEX_BYTES*dimension**2
+    n_kraus = features.n_photons + 1
+
+    matrix_products = 3*features.count("beamsplitter", "switch", "phaseshift") + (2*n_kraus + 1)*features.count("loss")
+    seconds = matrix_products*dimension**3/constants.multiply_adds_per_second
+    seconds += (features.count("detector") + 1)*dimension*features.n_wires*constants.python_op_seconds
+
+    # The unitary and the intermediate product, or every term of the Kraus sum
+    temporary_bytes = (n_kraus + 2 if features.count("loss") else 3)*state_bytes + FLOAT_BYTES*dimension*features.n_wires
+    return _estimate("FockBackend", features, constants, state_bytes, temporary_bytes, seconds)
+
+def permanent_estimate(features, constants):
+    """
+    One permanent of an N x N submatrix is computed for every output with the N input photons, by summing over
+    the N! permutations in Python, where each multiplication costs several NumPy scalar operations. Every output also costs the conversion of its rank to occupation numbers.
+    """
+    n = features.n_input_photons
+    dimension = features.hilbert_dimension
+    seconds = dimension*50*features.n_wires*constants.python_op_seconds
+    seconds += features.n_outputs*math.factorial(n)*(n + 1)*6*constants.python_op_seconds
+    state_bytes = COMPLEX_BYTES*features.n_wires**2 + FLOAT_BYTES*dimension
+    return _estimate("PermanentBackend", features, constants, state_bytes, 0, seconds)
+
+def mr_mustard_estimate(features, constants, cutoff=None):
+    """
+    The ket is a tensor with one axis per wire, of length cutoff. Two-wire components contract it with a
+    cutoff^4 tensor, and every component has a fixed overhead in Mr Mustard.
+    """
+    cutoff = cutoff or features.n_input_photons + 1
+    entries = cutoff**features.n_wires
+    state_bytes = COMPLEX_BYTES*entries
+    multiply_adds = entries*(cutoff**2*features.count("beamsplitter", "switch") + cutoff*features.count("phaseshift") + features.count("detector"))
+    seconds = multiply_adds/constants.multiply_adds_per_second + 1000*features.n_components*constants.python_op_seconds
+    temporary_bytes = 2*state_bytes + FLOAT_BYTES*features.hilbert_dimension*(features.n_wires + 1)
+    return _estimate("MrMustardBackend", features, constants, state_bytes, temporary_bytes, seconds)
+
+def perceval_estimate(features, constants, simulator="automatic"):
+    """
+    SLOS keeps the amplitudes of every intermediate photon number, Naive computes a permanent for each output
+    state in 2^N N operations, and MPS keeps a matrix product state whose bond dimension is truncated. Each
+    output state is also stored as a Python object.
+    """
+    n = features.n_input_photons
+    n_outputs = features.n_outputs
+    if simulator == "automatic":
+        simulator = "SLOS" if fock_hilbert_dimension_fixed_number(features.n_wires, features.n_photons) <= 2**20 else "Naive"
+
+    if simulator == "SLOS":
+        state_bytes = COMPLEX_BYTES*sum(fock_hilbert_dimension_fixed_number(features.n_wires, k) for k in range(n + 1))
+        multiply_adds = state_bytes/COMPLEX_BYTES*features.n_wires
+    elif simulator == "Naive":
+        state_bytes = COMPLEX_BYTES*features.n_wires**2
+        multiply_adds = n_outputs*2**n*(n + 1)
+    else:
+        bond_dimension = 64
+        state_bytes = COMPLEX_BYTES*features.n_wires*(n + 1)*bond_dimension**2
+        multiply_adds = n_outputs*features.n_wires*bond_dimension**2
+
+    seconds = multiply_adds/constants.multiply_adds_per_second + n_outputs*100*constants.python_op_seconds
+    return _estimate("PercevalBackend", features, constants, state_bytes, 200*n_outputs, seconds)
+
+def mp_estimate(features, constants, method="density_matrix"):
+    """
+    Each gate passes over the 2^n state vector, or the 4^n density matrix, once per basis state of the qubits
+    it acts on. Fused gates can act on two qubits. The density matrix is contracted with the gate by tensordot,
+    which also transposes it, so each of its passes is several times slower.
+    """
+    size = 2**features.n_wires if method == "statevector" else 4**features.n_wires
+    state_bytes = COMPLEX_BYTES*size
+    passes = features.count("xgate", "ygate", "zgate", "hadamard") + 2*features.count("cnot") + 4*features.count("unitary")
+    passes *= 2 if method == "statevector" else 10
+    seconds = (passes + 2)*2*state_bytes/constants.bytes_per_second
+    return _estimate("MPBackend", features, constants, state_bytes, 3*state_bytes, seconds)
+
+def qiskit_estimate(features, constants, method="automatic"):
+    """
+    Aer simulates Clifford circuits with a stabilizer tableau, and others like the matrix product backend, with a
+    fixed overhead for each submission. The probabilities of every basis state are returned in either case.
+    """
+    if method == "automatic":
+        method = "statevector" if features.count("unitary") else "stabilizer"
+    if method == "stabilizer":
+        state_bytes = 2*features.n_wires**2
+        seconds = features.n_components*features.n_wires*constants.python_op_seconds
+    else:
+        estimate = mp_estimate(features, constants, method)
+        state_bytes, seconds = estimate.state_bytes, estimate.seconds
+    seconds += 2*FLOAT_BYTES*features.hilbert_dimension/constants.bytes_per_second + 5000*constants.python_op_seconds
+    return _estimate("QiskitBackend", features, constants, state_bytes, 2*FLOAT_BYTES*features.hilbert_dimension, seconds)
+
+def stabilizer_estimate(features, constants):
+    """
+    The tableau has 2n rows of 2n bits, and each gate updates two of its columns. The number of outputs is only
+    known after the simulation, so the outputs are left out of the estimate. Their expansion is limited by
+    max_expanded_outcomes.
+    """
+    n = features.n_wires
+    state_bytes = 4*n**2 + 2*n
+    seconds = (100*features.n_components + 2000)*constants.python_op_seconds + n**3/constants.multiply_adds_per_second
+    return Estimate("StabilizerBackend", state_bytes, seconds, state_bytes, 0)
+
+MODELS = {
+    "FockBackend": fock_estimate,
+    "PermanentBackend": permanent_estimate,
+    "MrMustardBackend": mr_mustard_estimate,
+    "PercevalBackend": perceval_estimate,
+    "MPBackend": mp_estimate,
+    "QiskitBackend": qiskit_estimate,
+    "StabilizerBackend": stabilizer_estimate,
+}
+
+SIMULATION_TYPES = {
+    "FockBackend": "photonic",
+    "PermanentBackend": "photonic",
+    "MrMustardBackend": "photonic",
+    "PercevalBackend": "photonic",
+    "MPBackend": "gatebased",
+    "QiskitBackend": "gatebased",
+    "StabilizerBackend": "gatebased",
+}
+
+# Component types each backend can't simulate
+UNSUPPORTED_COMPONENTS = {
+    "PermanentBackend": {"loss"},
+    "MrMustardBackend": {"loss"},
+    "StabilizerBackend": {"unitary"},
+}
+
+def supports(backend_name, features):
+    """True if a backend can simulate a circuit with these features."""
+    return (SIMULATION_TYPES[backend_name] == features.simulation_type
+            and not UNSUPPORTED_COMPONENTS.get(backend_name, set()) & set(features.component_counts))
+
+def recommend(features, memory_budget=None):
+    """Estimates for every installed backend that can simulate the circuit within the memory budget, fastest first."""
+    from backends import is_available
+    constants = machine_constants()
+    estimates = [MODELS[name](features, constants) for name in MODELS if supports(name, features) and is_available(name)]
+    return sorted([e for e in estimates if memory_budget is None or e.peak_bytes <= memory_budget], key=lambda e: e.seconds)
@@ -0,0 +1,117 @@
+"""
+Compilation pass for gate-based circuits, which cancels and fuses gates before the circuit is run.
+"""
+
+import numpy as np
+from backends.utils import pauli_x, pauli_y, pauli_z, hadamard, cnot
+
+# Unitaries of the gates that can be placed in a gate-based circuit, keyed by component type
+GATE_UNITARIES = {
+    "xgate": pauli_x(),
+    "ygate": pauli_y(),
+    "zgate": pauli_z(),
+    "hadamard": hadamard(),
+    "cnot": cnot()
+}
+
+# Gates that are their own inverse, so two in a row on the same qubits cancel
+SELF_INVERSE_GATES = {"xgate", "ygate", "zgate", "hadamard", "cnot"}
+
+class GateBlock:
+    """One or more consecutive gates acting on the same set of qubits, represented by a single unitary."""
+    def __init__(self, component_type, qubits, unitary, component):
+        self.component_type = component_type
+        self.qubits = list(qubits)
+        self.unitary = unitary
+        self.components = [component]
+
+    @property
+    def is_fused(self):
+        return len(self.components) > 1
+
+    @property
+    def is_identity(self):
+        """True if the block does nothing, up to a global phase."""
+        phase = self.unitary[0, 0]
+        return np.isclose(np.abs(phase), 1) and np.allclose(self.unitary, phase*np.eye(len(self.unitary)))
+
+    def absorb(self, block):
+        """Adds a block acting on a subset of this block's qubits after this block."""
+        self.unitary = embed_unitary(block.unitary, block.qubits, self.qubits) @ self.unitary
+        self.components.extend(block.components)
+
+    def absorb_preceding(self, block):
+        """Adds a block acting on a subset of this block's qubits before this block."""
+        self.unitary = self.unitary @ embed_unitary(block.unitary, block.qubits, self.qubits)
+        self.components[:0] = block.components
+
+def embed_unitary(unitary, qubits, block_qubits):
+    """Extends a unitary acting on qubits to all of block_qubits, which contains qubits."""
+    n_block = len(block_qubits)
+    n_targets = len(qubits)
+    positions = [block_qubits.index(q) for q in qubits]
+
+    identity = np.eye(2**n_block, dtype=complex).reshape((2,)*2*n_block)
+    embedded = np.tensordot(unitary.reshape((2,)*2*n_targets), identity, axes=(list(range(n_targets, 2*n_targets)), positions))
+    embedded = np.moveaxis(embedded, list(range(n_targets)), positions)
+    return embedded.reshape((2**n_block, 2**n_block))
+
+def cancel_inverses(blocks):
+    """Removes pairs of identical self-inverse gates with nothing between them on their qubits."""
+    remaining = []
+    stacks = {} # indices in remaining of the gates on each qubit, most recent last
+
+    for block in blocks:
+        previous = {stacks[q][-1] if stacks.get(q) else None for q in block.qubits}
+        if len(previous) == 1 and None not in previous:
+            index = previous.pop()
+            previous_block = remaining[index]
+            if block.component_type in SELF_INVERSE_GATES and previous_block.component_type == block.component_type and previous_block.qubits == block.qubits:
+                remaining[index] = None
+                for q in block.qubits:
+                    stacks[q].pop()
+                continue
+
+        remaining.append(block)
+        for q in block.qubits:
+            stacks.setdefault(q, []).append(len(remaining) - 1)
+
+    return [block for block in remaining if block is not None]
+
+def fuse_gates(blocks):
+    """
+    Merges each gate into the last block acting on its qubits when that block covers all of them, so
+    runs of single-qubit gates become one 2x2 unitary and gates on the same pair become one 4x4 unitary.
+    Single-qubit blocks directly before a multi-qubit gate are pulled into it. Blocks equal to the
+    identity are removed.
+    """
+    fused = []
+    last_block = {} # index in fused of the last block acting on each qubit
+
+    for block in blocks:
+        previous = {last_block.get(q) for q in block.qubits}
+        if len(previous) == 1 and None not in previous:
+            previous_block = fused[previous.pop()]
+            if set(block.qubits) <= set(previous_block.qubits):
+                previous_block.absorb(block)
+                continue
+
+        if len(block.qubits) > 1:
+            for q in block.qubits:
+                index = last_block.get(q)
+                if index is not None and fused[index] is not None and fused[index].qubits == [q]:
+                    block.absorb_preceding(fused[index])
+                    fused[index] = None
+
+        fused.append(block)
+        for q in block.qubits:
+            last_block[q] = len(fused) - 1
+
+    return [block for block in fused if block is not None and not block.is_identity]
+
+def optimize_gates(blocks, fuse=True):
+    """Cancels inverse pairs, then optionally fuses the remaining gates. Returns the list of blocks to apply."""
+    blocks = cancel_inverses(blocks)
+    if fuse:
+        blocks = fuse_gates(blocks)
+    return blocks
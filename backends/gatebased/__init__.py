@@ -1,2 +1,25 @@
-from .matrix_product_backend import MPBackend
-from .qiskit_backend import QiskitBackend
\ No newline at end of file
+"""
+Gate-based backends, each imported on first access.
+"""
+
+import importlib
+
+# Module containing each backend
+_backend_modules = {
+    "MPBackend": ".matrix_product_backend",
+    "QiskitBackend": ".qiskit_backend",
+    "StabilizerBackend": ".stabilizer_backend",
+}
+
+__all__ = list(_backend_modules)
+
+def __getattr__(name):
+    if name in _backend_modules:
+        module = importlib.import_module(_backend_modules[name], __name__)
+        backend = getattr(module, name)
+        globals()[name] = backend
+        return backend
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -4,26 +4,55 @@ Basic matrix product model
 
 import numpy as np
 from abc import abstractmethod
-from backends.utils import insert_gate, pauli_x, pauli_y, pauli_z, computational_basis_to_rho, tuple_to_str, eliminate_tolerance
+from backends.utils import apply_local_gate, pauli_x, pauli_y, pauli_z, hadamard, cnot, computational_basis_to_rho, tuple_to_str, eliminate_tolerance
 from backends.backend import GateBasedBackend
+from backends.cost_model import CircuitFeatures, machine_constants, mp_estimate
 from backends.component import Component
+from backends.gatebased import statevector_kernels
 
 class MPBackend(GateBasedBackend):
-    def __init__(self, n_qubits):
+    """
+    Matrix product backend. With method="density_matrix" the full 4^n density matrix is propagated, while
+    method="statevector" stores only the 2^n amplitudes, which is possible because all gates are unitary.
+    """
+    methods = ["density_matrix", "statevector"]
+
+    cache_settings = GateBasedBackend.cache_settings + ("method",)
+    state_attributes = ("statevector", "density_matrix")
+
+    def __init__(self, n_qubits, method="density_matrix"):
         super().__init__(n_qubits)
 
+        if method not in self.methods:
+            raise ValueError(f"Method must be one of {self.methods}.")
+        self.method = method
+
         # Register components
         self.register_component("xgate", MPXGate)
         self.register_component("ygate", MPYGate)
         self.register_component("zgate", MPZGate)
         self.register_component("hadamard", MPHadamard)
         self.register_component("cnot", MPCNOT)
+        self.register_component("unitary", MPUnitaryGate)
 
         self.density_matrix = None
+        self.statevector = None
 
     def set_input_state(self, input_basis_element):
         super().set_input_state(input_basis_element)
-        self.density_matrix = self.create_density_matrix(input_basis_element)
+
+        # The state is only allocated once it is known to fit in the memory budget
+        self.density_matrix = self.statevector = None
+        self.check_memory_budget()
+        if self.method == "statevector":
+            self.statevector = self.create_statevector(input_basis_element)
+        else:
+            self.density_matrix = self.create_density_matrix(input_basis_element)
+
+    def create_statevector(self, input_basis_element):
+        statevector = np.zeros(self.hilbert_dimension, dtype=complex)
+        statevector[self.basis_to_rank(input_basis_element)] = 1
+        return statevector
         
     def create_density_matrix(self, input_basis_element):
         density_matrix = computational_basis_to_rho(input_basis_element[0])
@@ -31,13 +60,40 @@ class MPBackend(GateBasedBackend):
             density_matrix = np.kron(density_matrix, computational_basis_to_rho(input_basis_element[qubit]))
         return density_matrix
 
-    def run(self):
+    def estimate(self, input_basis_element=None):
+        return mp_estimate(CircuitFeatures.of(self), machine_constants(), self.method)
+
+    def simulate(self):
         for comp in self.component_list:
             comp.apply()
-        self.density_matrix = eliminate_tolerance(self.density_matrix)
+        if self.method == "statevector":
+            self.statevector = eliminate_tolerance(self.statevector)
+        else:
+            self.density_matrix = eliminate_tolerance(self.density_matrix)
+
+    def reduced_density_matrix(self, qubits):
+        """
+        Partial trace of the state over every qubit not in qubits (1-indexed). Returns the density matrix of the
+        kept qubits, in their order in qubits, computed from the state vector directly when method="statevector".
+        """
+        if len(set(qubits)) != len(qubits) or not all(isinstance(q, int) and 1 <= q <= self.n_qubits for q in qubits):
+            raise ValueError(f"Qubits must be distinct integers between 1 and {self.n_qubits}.")
+
+        kept = [q - 1 for q in qubits]
+        traced = [q for q in range(self.n_qubits) if q not in kept]
+        if self.method == "statevector":
+            amplitudes = np.transpose(self.statevector.reshape((2,)*self.n_qubits), kept + traced).reshape(2**len(kept), -1)
+            return amplitudes @ np.conjugate(amplitudes).T
+
+        # Row axes are 0 to n-1 and column axes n to 2n-1. Traced row and column axes are paired and summed.
+        density_matrix = np.transpose(self.density_matrix.reshape((2,)*2*self.n_qubits), kept + traced + [self.n_qubits + q for q in kept + traced])
+        density_matrix = density_matrix.reshape(2**len(kept), 2**len(traced), 2**len(kept), 2**len(traced))
+        return np.trace(density_matrix, axis1=1, axis2=3)
 
     @property
     def _probabilities(self):
+        if self.method == "statevector":
+            return np.abs(self.statevector)**2
         return np.real(self.density_matrix.diagonal())
     
     @property
@@ -60,11 +116,19 @@ class MPComponent(Component):
         super().__init__(backend)
 
     def apply(self):
-        unitary = self.unitary()
-        self.backend.density_matrix = unitary @ self.backend.density_matrix @ np.conjugate(unitary).T
+        if self.backend.method == "statevector":
+            self.backend.statevector = self.apply_to_statevector(self.backend.statevector)
+        else:
+            self.backend.density_matrix = apply_local_gate(self.backend.density_matrix, self.local_unitary, self.reindexed_targeted_qubits, self.backend.n_qubits)
+
+    def apply_to_statevector(self, statevector):
+        """Returns the state vector after the gate. Overridden by gates with a faster dedicated kernel."""
+        return statevector_kernels.apply_local_gate(statevector, self.local_unitary, self.reindexed_targeted_qubits, self.backend.n_qubits)
 
+    @property
     @abstractmethod
-    def unitary(self):
+    def local_unitary(self):
+        """Unitary acting only on the targeted qubits, in the order they are given."""
         raise NotImplementedError
 
 class MPXGate(MPComponent):
@@ -75,11 +139,11 @@ class MPXGate(MPComponent):
         self.validate_single_qubit_gate(self.targeted_qubits)
 
     @property
-    def single_qubit_unitary(self):
+    def local_unitary(self):
         return pauli_x()
 
-    def unitary(self):
-        return insert_gate(self.single_qubit_unitary, self.reindexed_targeted_qubits[0], self.backend.n_qubits)
+    def apply_to_statevector(self, statevector):
+        return statevector_kernels.apply_x(statevector, self.reindexed_targeted_qubits[0], self.backend.n_qubits)
 
 class MPYGate(MPComponent):
     def __init__(self, backend, *, qubits):
@@ -89,11 +153,11 @@ class MPYGate(MPComponent):
         self.validate_single_qubit_gate(self.targeted_qubits)
 
     @property
-    def single_qubit_unitary(self):
+    def local_unitary(self):
         return pauli_y()
 
-    def unitary(self):
-        return insert_gate(self.single_qubit_unitary, self.reindexed_targeted_qubits[0], self.backend.n_qubits)
+    def apply_to_statevector(self, statevector):
+        return statevector_kernels.apply_single_qubit_gate(statevector, self.local_unitary, self.reindexed_targeted_qubits[0], self.backend.n_qubits)
 
 class MPZGate(MPComponent):
     def __init__(self, backend, *, qubits):
@@ -103,11 +167,11 @@ class MPZGate(MPComponent):
         self.validate_single_qubit_gate(self.targeted_qubits)
 
     @property
-    def single_qubit_unitary(self):
+    def local_unitary(self):
         return pauli_z()
 
-    def unitary(self):
-        return insert_gate(self.single_qubit_unitary, self.reindexed_targeted_qubits[0], self.backend.n_qubits)
+    def apply_to_statevector(self, statevector):
+        return statevector_kernels.apply_z(statevector, self.reindexed_targeted_qubits[0], self.backend.n_qubits)
 
 class MPHadamard(MPComponent):
     def __init__(self, backend, *, qubits):
@@ -117,11 +181,11 @@ class MPHadamard(MPComponent):
         self.validate_single_qubit_gate(self.targeted_qubits)
 
     @property
-    def single_qubit_unitary(self):
-        return (1/np.sqrt(2))*np.array([[1, 1], [1, -1]], dtype=complex)
+    def local_unitary(self):
+        return hadamard()
 
-    def unitary(self):
-        return insert_gate(self.single_qubit_unitary, self.reindexed_targeted_qubits[0], self.backend.n_qubits)
+    def apply_to_statevector(self, statevector):
+        return statevector_kernels.apply_single_qubit_gate(statevector, self.local_unitary, self.reindexed_targeted_qubits[0], self.backend.n_qubits)
 
 class MPCNOT(MPComponent):
     def __init__(self, backend, *, qubits):
@@ -130,18 +194,22 @@ class MPCNOT(MPComponent):
     def validate(self):
         self.validate_two_qubit_gate(self.targeted_qubits)
 
-    def unitary(self):
-        control_qubit = self.reindexed_targeted_qubits[0]
-        target_qubit = self.reindexed_targeted_qubits[1]
+    @property
+    def local_unitary(self):
+        return cnot()
+
+    def apply_to_statevector(self, statevector):
+        return statevector_kernels.apply_cnot(statevector, *self.reindexed_targeted_qubits, self.backend.n_qubits)
 
-        control_is_zero = np.array([[1, 0], [0, 0]], dtype=complex)
-        control_is_one = np.array([[0, 0], [0, 1]], dtype=complex)
+class MPUnitaryGate(MPComponent):
+    def __init__(self, backend, *, qubits, unitary):
+        self.unitary = np.asarray(unitary, dtype=complex)
 
-        # Operation conditioned on the control qubit being zero
-        project_control_onto_zero = insert_gate(control_is_zero, control_qubit, self.backend.n_qubits)
+        super().__init__(backend, qubits)
 
-        # Operation conditioned on the control qubit being one
-        project_control_onto_one = insert_gate(control_is_one, control_qubit, self.backend.n_qubits)
-        flip_target = insert_gate(pauli_x(), target_qubit, self.backend.n_qubits)
+    def validate(self):
+        self.validate_unitary_gate(self.targeted_qubits, self.unitary)
 
-        return project_control_onto_zero + project_control_onto_one @ flip_target
\ No newline at end of file
+    @property
+    def local_unitary(self):
+        return self.unitary
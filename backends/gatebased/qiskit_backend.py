@@ -2,54 +2,244 @@
 Qiskit backend
 """
 
+import hashlib
+from collections import OrderedDict
 from qiskit import QuantumCircuit, transpile
 from qiskit_aer.aerprovider import AerSimulator
 import numpy as np
 from backends.component import Component
 from backends.backend import GateBasedBackend
-from backends.utils import computational_basis_to_rho, tuple_to_str
+from backends.cost_model import CircuitFeatures, machine_constants, qiskit_estimate
+from backends.utils import tuple_to_str, eliminate_tolerance
+
+# Simulators shared by every QiskitBackend in the process, keyed by their options
+_simulator_pool = {}
+
+# Transpiled circuits keyed by a structural hash of the circuit and the simulator options, least recently used first
+_transpile_cache = OrderedDict()
+TRANSPILE_CACHE_SIZE = 256
+
+def get_simulator(options):
+    """Returns the shared simulator for the given options, creating it on first use."""
+    key = tuple(sorted(options.items()))
+    if key not in _simulator_pool:
+        _simulator_pool[key] = AerSimulator(**options)
+    return _simulator_pool[key]
+
+def structural_hash(circuit, options):
+    """Hash of the gates in a circuit, the qubits they act on, their parameters, and the simulator options."""
+    digest = hashlib.sha256(repr(sorted(options.items())).encode())
+    digest.update(str(circuit.num_qubits).encode())
+    for instruction in circuit.data:
+        qubits = tuple(circuit.find_bit(qubit).index for qubit in instruction.qubits)
+        digest.update(f"{instruction.operation.name}{qubits}".encode())
+        for param in instruction.operation.params:
+            digest.update(np.asarray(param).tobytes() if isinstance(param, np.ndarray) else repr(param).encode())
+    return digest.hexdigest()
+
+def transpile_cached(circuit, simulator, options):
+    """Transpiles a circuit for a simulator, reusing the result for structurally identical circuits."""
+    return transpile_batch_cached([circuit], simulator, options)[0]
+
+def transpile_batch_cached(circuits, simulator, options):
+    """Transpiles a list of circuits, reusing cached results and transpiling all of the remaining ones together."""
+    keys = [structural_hash(circuit, options) for circuit in circuits]
+
+    missing = {key: circuit for key, circuit in zip(keys, circuits) if key not in _transpile_cache}
+    if missing:
+        # Optimizing Clifford circuits can produce rotations with floating point angles, which the stabilizer method rejects
+        optimization_level = 0 if options.get("method") == "stabilizer" else None
+        transpiled = transpile(list(missing.values()), simulator, optimization_level=optimization_level)
+        _transpile_cache.update(zip(missing.keys(), transpiled))
+
+    compiled_circuits = []
+    for key in keys:
+        _transpile_cache.move_to_end(key)
+        compiled_circuits.append(_transpile_cache[key])
+
+    while len(_transpile_cache) > max(TRANSPILE_CACHE_SIZE, len(keys)):
+        _transpile_cache.popitem(last=False)
+    return compiled_circuits
 
 class QiskitBackend(GateBasedBackend):
-    def __init__(self, n_qubits):
+    """
+    Qiskit Aer backend. With method="automatic", circuits containing only Clifford gates use the stabilizer
+    method and all other circuits use the statevector method, since every gate is unitary and the input is a
+    basis state. The density_matrix method is still available explicitly. With shots=None the exact
+    probabilities are returned, otherwise they are estimated by sampling.
+    """
+    methods = ["automatic", "statevector", "stabilizer", "density_matrix"]
+    clifford_gates = {"x", "y", "z", "h", "cx"}
+
+    cache_settings = GateBasedBackend.cache_settings + ("method", "shots")
+    state_attributes = ("probabilities",)
+    profiled_phases = GateBasedBackend.profiled_phases + ("build_circuit", "run_experiments")
+
+    def __init__(self, n_qubits, method="automatic", max_parallel_threads=0, shots=None):
         super().__init__(n_qubits)
 
+        if method not in self.methods:
+            raise ValueError(f"Method must be one of {self.methods}.")
+
         # Register components
         self.register_component("xgate", QiskitXGate)
         self.register_component("ygate", QiskitYGate)
         self.register_component("zgate", QiskitZGate)
         self.register_component("hadamard", QiskitHadamard)
         self.register_component("cnot", QiskitCNOT)
+        self.register_component("unitary", QiskitUnitaryGate)
+
+        self.method = method
+        self.max_parallel_threads = max_parallel_threads # 0 lets Aer use every available core
+        self.shots = shots
 
         self.circuit = QuantumCircuit(self.n_qubits)
-        self.density_matrix = None
+        self.input_basis_element = None
+        self.probabilities = None
+
+    def simulation_method_for(self, variants):
+        """The Aer method used to run a list of circuits, resolving method="automatic" from their components."""
+        if self.method != "automatic":
+            return self.method
+        if all(comp.gate_name in self.clifford_gates for variant in variants for comp in variant.component_list):
+            return "stabilizer"
+        return "statevector"
+
+    def simulator_options_for(self, variants):
+        return {"method": self.simulation_method_for(variants), "max_parallel_threads": self.max_parallel_threads}
+
+    @property
+    def simulation_method(self):
+        return self.simulation_method_for([self])
+
+    @property
+    def simulator_options(self):
+        return self.simulator_options_for([self])
 
     def set_input_state(self, input_basis_element):
         super().set_input_state(input_basis_element)
-        self.density_matrix = self._create_density_matrix(input_basis_element)
-        self.circuit.set_density_matrix(self.density_matrix)
+        self.input_basis_element = input_basis_element
 
-    def _create_density_matrix(self, input_basis_element):
-        density_matrix = computational_basis_to_rho(input_basis_element[0])
-        for qubit in reversed(range(1, self.n_qubits)): # qiskit uses a reversed tensor product space
-            density_matrix = np.kron(density_matrix, computational_basis_to_rho(input_basis_element[qubit]))
-        return density_matrix
+    def build_circuit(self, sampled=None):
+        """
+        Creates the circuit containing all components, without the input state. Rebuilt on every run, so running
+        twice gives the same circuit. Ends in measurements if sampled, which defaults to whether shots is set.
+        """
+        if sampled is None:
+            sampled = self.shots is not None
 
-    def run(self):
-        # add the components
+        self.circuit = QuantumCircuit(self.n_qubits)
         for comp in self.component_list:
             comp.apply()
+        if sampled:
+            self.circuit.measure_all()
+        else:
+            self.circuit.save_probabilities()
+        return self.circuit
+
+    def input_circuit(self, input_basis_element=None):
+        """Circuit preparing the input state with X gates, which is prepended to the compiled circuit."""
+        if input_basis_element is None:
+            input_basis_element = self.input_basis_element
+
+        input_circuit = QuantumCircuit(self.n_qubits)
+        for qubit, qubit_state in enumerate(input_basis_element):
+            if qubit_state == 1:
+                input_circuit.x(qubit)
+        return input_circuit
 
-        # choose a qiskit backend
-        simulator = AerSimulator(method='density_matrix')
-        self.circuit = transpile(self.circuit, simulator)
-        self.circuit.save_state()
+    def estimate(self, input_basis_element=None):
+        return qiskit_estimate(CircuitFeatures.of(self), machine_constants(), self.simulation_method)
 
-        result = simulator.run(self.circuit).result()
-        self.density_matrix = result.data().get('density_matrix')
+    def simulate(self):
+        self.probabilities = self.run_batch(input_states=[self.input_basis_element])[0]
+
+    @property
+    def cacheable(self):
+        """Sampled results are not cached, so every run draws new samples."""
+        return self.shots is None
+
+    def run_batch(self, input_states=None, variants=None):
+        """
+        Runs many input states and/or circuit variants in a single submission to Aer, which can parallelize across
+        the experiments. Returns an array of probabilities with one row per experiment.
+
+        input_states (list): input basis elements. Run through this circuit, or paired with the variants if both are given.
+        variants (list): QiskitBackends with the same number of qubits. Each uses its own input state unless input_states is given.
+        """
+        if input_states is None and variants is None:
+            raise ValueError("Give input states, circuit variants, or both.")
+        if variants is None:
+            variants = [self]*len(input_states)
+        if input_states is None:
+            input_states = [variant.input_basis_element for variant in variants]
+        if len(input_states) != len(variants):
+            raise ValueError("There must be the same number of input states and circuit variants.")
+
+        for variant, input_state in zip(variants, input_states):
+            if not isinstance(variant, QiskitBackend) or variant.n_qubits != self.n_qubits:
+                raise ValueError(f"Circuit variants must be QiskitBackends with {self.n_qubits} qubits.")
+            self.validate_input_state(input_state)
+
+        options = self.simulator_options_for(variants)
+        simulator = get_simulator(options)
+
+        # Each distinct variant is transpiled once, and the transpiled circuits only depend on the components,
+        # so they are reused when just the input state changes
+        distinct_variants = list({id(variant): variant for variant in variants}.values())
+        compiled_circuits = dict(zip(
+            [id(variant) for variant in distinct_variants],
+            transpile_batch_cached([variant.build_circuit(sampled=self.shots is not None) for variant in distinct_variants], simulator, options)
+        ))
+        experiments = [compiled_circuits[id(variant)].compose(self.input_circuit(input_state), front=True, inplace=False) for variant, input_state in zip(variants, input_states)]
+        return self.run_experiments(experiments, simulator, sampled=self.shots is not None)
+
+    def run_experiments(self, experiments, simulator, sampled):
+        """Runs transpiled circuits, which already prepare their input states, in one submission. Returns one row of probabilities per circuit."""
+        if not sampled:
+            result = simulator.run(experiments).result()
+            probabilities = [self.from_qiskit_order(result.data(index).get('probabilities')) for index in range(len(experiments))]
+        else:
+            result = simulator.run(experiments, shots=self.shots).result()
+            probabilities = [self.counts_to_probabilities(result.get_counts(index)) for index in range(len(experiments))]
+
+        return eliminate_tolerance(np.array(probabilities))
+
+    def compile(self, ir):
+        """
+        Optimizes and transpiles the circuit once. Each execution only prepends the input state and runs it.
+        Whether the circuit is sampled is fixed by shots at compile time.
+        """
+        compiled = super().compile(ir)
+        with self.using_components(compiled.components):
+            compiled.sampled = self.shots is not None
+            options = self.simulator_options
+            compiled.simulator = get_simulator(options)
+            compiled.transpiled_circuit = transpile_cached(self.build_circuit(sampled=compiled.sampled), compiled.simulator, options)
+        return compiled
+
+    def execute(self, compiled, input_basis_element):
+        self.validate_compiled(compiled)
+        self.set_input_state(input_basis_element)
+        experiment = compiled.transpiled_circuit.compose(self.input_circuit(input_basis_element), front=True, inplace=False)
+        self.probabilities = self.run_experiments([experiment], compiled.simulator, compiled.sampled)[0]
+        return self.get_output_data()
+
+    def from_qiskit_order(self, qiskit_probabilities):
+        """Reorders a probability vector from qiskit's reversed tensor product space into rank order."""
+        qiskit_probabilities = np.asarray(qiskit_probabilities).reshape((2,)*self.n_qubits)
+        return qiskit_probabilities.transpose(list(reversed(range(self.n_qubits)))).reshape(self.hilbert_dimension)
+
+    def counts_to_probabilities(self, counts):
+        """Estimates the probabilities from measurement counts, whose keys list the qubits in reverse order."""
+        probabilities = np.zeros(self.hilbert_dimension)
+        for bits, count in counts.items():
+            probabilities[int(bits.replace(" ", "")[::-1], 2)] = count/self.shots
+        return probabilities
 
     @property
     def _probabilities(self):
-        return np.real(self.density_matrix.diagonal())
+        return self.probabilities
     
     @property
     def _occupied_ranks(self):
@@ -61,51 +251,69 @@ class QiskitBackend(GateBasedBackend):
     
     @property
     def _basis_strings(self):
-        return [tuple_to_str(self.rank_to_basis(rank)[::-1]) for rank in self._occupied_ranks] # qiskit uses a reversed tensor product space
+        return [tuple_to_str(self.rank_to_basis(rank)) for rank in self._occupied_ranks]
 
 class QiskitComponent(Component):
-    def __init__(self, backend, qubits, gate_function):
+    def __init__(self, backend, qubits, gate_name):
         self.targeted_qubits = qubits
         self.reindexed_targeted_qubits = [q - 1 for q in qubits]
 
         super().__init__(backend)
 
-        self.gate_function = gate_function
+        self.gate_name = gate_name
+
+    @property
+    def gate_function(self):
+        """Method adding this gate to the backend's current circuit."""
+        return getattr(self.backend.circuit, self.gate_name)
 
     def apply(self):
         self.gate_function(*self.reindexed_targeted_qubits)
 
 class QiskitXGate(QiskitComponent):
     def __init__(self, backend, *, qubits):
-        super().__init__(backend, qubits, backend.circuit.x)
+        super().__init__(backend, qubits, "x")
 
     def validate(self):
         self.validate_single_qubit_gate(self.targeted_qubits)
 
 class QiskitYGate(QiskitComponent):
     def __init__(self, backend, *, qubits):
-        super().__init__(backend, qubits, backend.circuit.y)
+        super().__init__(backend, qubits, "y")
 
     def validate(self):
         self.validate_single_qubit_gate(self.targeted_qubits)
 
 class QiskitZGate(QiskitComponent):
     def __init__(self, backend, *, qubits):
-        super().__init__(backend, qubits, backend.circuit.z)
+        super().__init__(backend, qubits, "z")
 
     def validate(self):
         self.validate_single_qubit_gate(self.targeted_qubits)
 
 class QiskitHadamard(QiskitComponent):
     def __init__(self, backend, *, qubits):
-        super().__init__(backend, qubits, backend.circuit.h)
+        super().__init__(backend, qubits, "h")
 
     def validate(self):
         self.validate_single_qubit_gate(self.targeted_qubits)
 
 class QiskitCNOT(QiskitComponent):
     def __init__(self, backend, *, qubits):
-        super().__init__(backend, qubits, backend.circuit.cx)
+        super().__init__(backend, qubits, "cx")
+
+    def validate(self):
+        self.validate_two_qubit_gate(self.targeted_qubits)
+
+class QiskitUnitaryGate(QiskitComponent):
+    def __init__(self, backend, *, qubits, unitary):
+        self.unitary = np.asarray(unitary, dtype=complex)
+
+        super().__init__(backend, qubits, "unitary")
 
     def validate(self):
-        self.validate_two_qubit_gate(self.targeted_qubits)
\ No newline at end of file
+        self.validate_unitary_gate(self.targeted_qubits, self.unitary)
+
+    def apply(self):
+        # qiskit treats the first qubit of a gate as the least significant
+        self.gate_function(self.unitary, self.reindexed_targeted_qubits[::-1])
@@ -0,0 +1,288 @@
+"""
+Stabilizer tableau model for Clifford circuits (Aaronson and Gottesman, Phys. Rev. A 70, 052328 (2004))
+"""
+
+import numpy as np
+from abc import abstractmethod
+from backends.backend import GateBasedBackend
+from backends.cost_model import CircuitFeatures, machine_constants, stabilizer_estimate
+from backends.component import Component
+from backends.result import Result
+
+class StabilizerBackend(GateBasedBackend):
+    """
+    Every gate available in gate-based circuits is a Clifford gate, so the state can be tracked as a
+    tableau of 2n Pauli operators instead of 2^n amplitudes. The output distribution of a stabilizer state
+    is uniform over an affine subspace of bit strings, which is available directly as output_subspace and
+    is only expanded into individual basis states on request.
+    """
+    # Largest number of output states that will be expanded from the affine subspace
+    max_expanded_outcomes = 2**24
+
+    def __init__(self, n_qubits):
+        super().__init__(n_qubits)
+
+        # Register components
+        self.register_component("xgate", StabilizerXGate)
+        self.register_component("ygate", StabilizerYGate)
+        self.register_component("zgate", StabilizerZGate)
+        self.register_component("hadamard", StabilizerHadamard)
+        self.register_component("cnot", StabilizerCNOT)
+
+        self.tableau = None
+        self._output_subspace = None
+
+    def set_input_state(self, input_basis_element):
+        super().set_input_state(input_basis_element)
+        self.tableau = StabilizerTableau(self.n_qubits)
+        for qubit, qubit_state in enumerate(input_basis_element):
+            if qubit_state == 1:
+                self.tableau.xgate(qubit)
+        self._output_subspace = None
+
+    def estimate(self, input_basis_element=None):
+        return stabilizer_estimate(CircuitFeatures.of(self), machine_constants())
+
+    def simulate(self):
+        for comp in self.component_list:
+            comp.apply()
+        self._output_subspace = self.tableau.output_subspace()
+
+    def state_nbytes(self):
+        """Bytes held by the tableau."""
+        if self.tableau is None:
+            return 0
+        return self.tableau.x.nbytes + self.tableau.z.nbytes + self.tableau.r.nbytes
+
+    @property
+    def output_subspace(self):
+        """
+        Compact form of the output distribution, (offset, generators). Each output state is
+        offset XOR (any combination of generators), and they all have probability 2^-len(generators).
+        """
+        return self._output_subspace
+
+    @property
+    def output_bits(self):
+        """Bits of every output state, one row per state, sorted by rank."""
+        offset, generators = self.output_subspace
+        n_generators = len(generators)
+        if 2**n_generators > self.max_expanded_outcomes:
+            raise ValueError(f"The output contains 2^{n_generators} basis states, which is too many to expand. Use output_subspace instead.")
+        return self.first_output_bits(2**n_generators)
+
+    def first_output_bits(self, n_outputs):
+        """Bits of the first n_outputs output states in rank order, one row per state."""
+        offset, generators = self.output_subspace
+        n_generators = len(generators)
+
+        # Generators are in reduced row echelon form and the offset is zero in their pivot columns,
+        # so counting in binary over the generators visits the outputs in rank order
+        coefficients = np.zeros((n_outputs, n_generators), dtype=np.uint8)
+        n_counted = min(n_generators, max(1, n_outputs - 1).bit_length())
+        if n_counted:
+            coefficients[:, n_generators - n_counted:] = (np.arange(n_outputs).reshape(-1, 1) >> np.arange(n_counted - 1, -1, -1)) & 1
+        return offset ^ (coefficients @ generators) % 2
+
+    def run_top_k(self, k):
+        """
+        Every output state is equally likely, so the k most likely are the first k in rank order, which are
+        expanded from the output subspace without expanding the others. A result in the cache is used if there
+        is one, but the partial result is not stored.
+        """
+        self.lookup_cache()
+        if self.cached_result is not None:
+            return self.result.top_k(k)
+
+        # The tableau may already have been evolved by an earlier run
+        self.check_memory_budget()
+        self.set_input_state(self.input_basis_element)
+        self.simulate()
+        n_generators = len(self.output_subspace[1])
+        bits = self.first_output_bits(min(k, 2**n_generators))
+        ranks = np.array([self.basis_to_rank(b) for b in bits]) if len(bits) else np.array([], dtype=int)
+        return Result(ranks, np.full(len(bits), 2.0**-n_generators), self.basis)
+
+    def nonzero_output(self):
+        """Read from the output subspace, since the full probability array has 2^n entries."""
+        return self._occupied_ranks, self._nonzero_probabilities
+
+    @property
+    def cacheable(self):
+        """Ranks of more than 63 qubits don't fit in the integer arrays stored by the cache."""
+        return self.n_qubits < 64
+
+    @property
+    def _probabilities(self):
+        probabilities = np.zeros(self.hilbert_dimension)
+        probabilities[self._occupied_ranks] = self._nonzero_probabilities
+        return probabilities
+
+    @property
+    def _occupied_ranks(self):
+        return np.array([self.basis_to_rank(bits) for bits in self.output_bits])
+
+    @property
+    def _nonzero_probabilities(self):
+        n_generators = len(self.output_subspace[1])
+        return np.full(2**n_generators, 2.0**-n_generators)
+
+    @property
+    def _basis_strings(self):
+        return ["".join(str(bit) for bit in bits) for bits in self.output_bits]
+
+
+class StabilizerTableau:
+    """
+    Tableau of n destabilizers (rows 0 to n-1) and n stabilizers (rows n to 2n-1). Row i represents the
+    Pauli operator (-1)^r[i] * prod_j X_j^x[i, j] Z_j^z[i, j], with Y = iXZ.
+    """
+    def __init__(self, n_qubits):
+        self.n_qubits = n_qubits
+
+        # The all-zero state is stabilized by Z on each qubit, and destabilized by X on each qubit
+        self.x = np.zeros((2*n_qubits, n_qubits), dtype=bool)
+        self.z = np.zeros((2*n_qubits, n_qubits), dtype=bool)
+        self.r = np.zeros(2*n_qubits, dtype=bool)
+        self.x[:n_qubits] = np.eye(n_qubits, dtype=bool)
+        self.z[n_qubits:] = np.eye(n_qubits, dtype=bool)
+
+    # Gates, each O(n)
+
+    def xgate(self, qubit):
+        self.r ^= self.z[:, qubit]
+
+    def ygate(self, qubit):
+        self.r ^= self.x[:, qubit] ^ self.z[:, qubit]
+
+    def zgate(self, qubit):
+        self.r ^= self.x[:, qubit]
+
+    def hadamard(self, qubit):
+        self.r ^= self.x[:, qubit] & self.z[:, qubit]
+        self.x[:, qubit], self.z[:, qubit] = self.z[:, qubit].copy(), self.x[:, qubit].copy()
+
+    def cnot(self, control_qubit, target_qubit):
+        a, b = control_qubit, target_qubit
+        self.r ^= self.x[:, a] & self.z[:, b] & ~(self.x[:, b] ^ self.z[:, a])
+        self.x[:, b] ^= self.x[:, a]
+        self.z[:, a] ^= self.z[:, b]
+
+    # Measurement, O(n^3)
+
+    def output_subspace(self):
+        """
+        Returns (offset, generators) describing the computational basis states in the support of the state.
+        The generators are the independent X parts of the stabilizer group. The offset satisfies the
+        constraints z.s = r imposed by the stabilizers with no X part.
+        """
+        n = self.n_qubits
+        x, z, r = self.x[n:].copy(), self.z[n:].copy(), self.r[n:].copy()
+
+        # Row reduce the X parts, so the first n_generators rows have independent X parts and the rest are Z-type
+        n_generators = self._row_reduce(x, z, r, x, 0)
+
+        # Row reduce the Z-type rows on their Z parts and solve for the offset, taking free bits to be zero
+        self._row_reduce(x, z, r, z, n_generators)
+        offset = np.zeros(n, dtype=np.uint8)
+        for row in range(n_generators, n):
+            pivot = np.argmax(z[row])
+            offset[pivot] = r[row]
+
+        # Use the representative with zeros in the generators' pivot columns, so outputs can be listed in rank order
+        generators = x[:n_generators].astype(np.uint8)
+        for generator in generators:
+            if offset[np.argmax(generator)]:
+                offset ^= generator
+
+        return offset, generators
+
+    def _row_reduce(self, x, z, r, bits, first_row):
+        """Reduces rows first_row onwards of the tableau (x, z, r) to reduced row echelon form in bits (x or z). Returns the number of pivot rows."""
+        pivot_row = first_row
+        for col in range(self.n_qubits):
+            candidates = np.nonzero(bits[pivot_row:, col])[0]
+            if len(candidates) == 0:
+                continue
+            source = pivot_row + candidates[0]
+            for arr in (x, z, r):
+                arr[[pivot_row, source]] = arr[[source, pivot_row]]
+            rows = np.nonzero(bits[first_row:, col])[0] + first_row
+            self._rowsum(x, z, r, rows[rows != pivot_row], pivot_row)
+            pivot_row += 1
+            if pivot_row == len(r):
+                break
+        return pivot_row - first_row
+
+    @staticmethod
+    def _rowsum(x, z, r, rows, i):
+        """Replaces each row h in rows with the product of rows i and h, keeping track of the sign."""
+        x1, z1 = x[i].astype(int), z[i].astype(int)
+        x2, z2 = x[rows].astype(int), z[rows].astype(int)
+        # Exponent of i picked up when multiplying the single-qubit Paulis of row i and row h
+        g = x1*z1*(z2 - x2) + x1*(1 - z1)*z2*(2*x2 - 1) + (1 - x1)*z1*x2*(1 - 2*z2)
+        r[rows] = (2*r[rows] + 2*int(r[i]) + np.sum(g, axis=1)) % 4 == 2
+        x[rows] ^= x[i]
+        z[rows] ^= z[i]
+
+
+class StabilizerComponent(Component):
+    def __init__(self, backend, qubits):
+        self.targeted_qubits = qubits
+        self.reindexed_targeted_qubits = [q - 1 for q in qubits]
+
+        super().__init__(backend)
+
+    @abstractmethod
+    def apply(self):
+        raise NotImplementedError
+
+class StabilizerXGate(StabilizerComponent):
+    def __init__(self, backend, *, qubits):
+        super().__init__(backend, qubits)
+
+    def validate(self):
+        self.validate_single_qubit_gate(self.targeted_qubits)
+
+    def apply(self):
+        self.backend.tableau.xgate(*self.reindexed_targeted_qubits)
+
+class StabilizerYGate(StabilizerComponent):
+    def __init__(self, backend, *, qubits):
+        super().__init__(backend, qubits)
+
+    def validate(self):
+        self.validate_single_qubit_gate(self.targeted_qubits)
+
+    def apply(self):
+        self.backend.tableau.ygate(*self.reindexed_targeted_qubits)
+
+class StabilizerZGate(StabilizerComponent):
+    def __init__(self, backend, *, qubits):
+        super().__init__(backend, qubits)
+
+    def validate(self):
+        self.validate_single_qubit_gate(self.targeted_qubits)
+
+    def apply(self):
+        self.backend.tableau.zgate(*self.reindexed_targeted_qubits)
+
+class StabilizerHadamard(StabilizerComponent):
+    def __init__(self, backend, *, qubits):
+        super().__init__(backend, qubits)
+
+    def validate(self):
+        self.validate_single_qubit_gate(self.targeted_qubits)
+
+    def apply(self):
+        self.backend.tableau.hadamard(*self.reindexed_targeted_qubits)
+
+class StabilizerCNOT(StabilizerComponent):
+    def __init__(self, backend, *, qubits):
+        super().__init__(backend, qubits)
+
+    def validate(self):
+        self.validate_two_qubit_gate(self.targeted_qubits)
+
+    def apply(self):
+        self.backend.tableau.cnot(*self.reindexed_targeted_qubits)
@@ -0,0 +1,101 @@
+"""
+State vector kernels for gate-based backends. Qubit 0 is the most significant bit of a basis state's rank.
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# State vectors larger than this are split into chunks that are processed in a thread pool
+CHUNK_SIZE = 2**18
+
+_thread_pool = None
+
+def thread_pool():
+    """Shared thread pool used to process large state vectors. Created on first use."""
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+    return _thread_pool
+
+def for_each_chunk(size, task):
+    """Calls task(start, stop) on consecutive chunks of range(size), in parallel when there is more than one chunk."""
+    if size <= CHUNK_SIZE:
+        task(0, size)
+        return
+    futures = [thread_pool().submit(task, start, min(start + CHUNK_SIZE, size)) for start in range(0, size, CHUNK_SIZE)]
+    for future in futures:
+        future.result()
+
+def bit_mask(qubit, n_qubits):
+    return 1 << (n_qubits - qubit - 1)
+
+def qubit_view(state, qubit, n_qubits):
+    """View of the state vector with shape (2^qubit, 2, 2^(n_qubits-qubit-1)), where the middle axis is the targeted qubit."""
+    return state.reshape((2**qubit, 2, 2**(n_qubits - qubit - 1)))
+
+def for_each_view_chunk(view, task):
+    """Calls task(sub_view) on chunks of a qubit view, slicing along whichever outer axis is longest."""
+    axis = 0 if view.shape[0] >= view.shape[2] else 2
+    length = view.shape[axis]
+    chunk = max(1, CHUNK_SIZE // (view.size // length))
+
+    def sliced_task(start, stop):
+        index = [slice(None)]*3
+        index[axis] = slice(start, stop)
+        task(view[tuple(index)])
+
+    if length <= chunk or view.size <= CHUNK_SIZE:
+        task(view)
+        return
+    futures = [thread_pool().submit(sliced_task, start, min(start + chunk, length)) for start in range(0, length, chunk)]
+    for future in futures:
+        future.result()
+
+def permute(state, permuted_rank):
+    """Returns new_state, where new_state[rank] = state[permuted_rank(ranks)], evaluated in chunks."""
+    new_state = np.empty_like(state)
+
+    def task(start, stop):
+        new_state[start:stop] = state[permuted_rank(np.arange(start, stop))]
+
+    for_each_chunk(state.size, task)
+    return new_state
+
+def apply_x(state, qubit, n_qubits):
+    """Pauli X as an index permutation: flip the qubit's bit in every rank."""
+    mask = bit_mask(qubit, n_qubits)
+    return permute(state, lambda ranks: ranks ^ mask)
+
+def apply_cnot(state, control_qubit, target_qubit, n_qubits):
+    """CNOT as an index permutation: flip the target bit of every rank whose control bit is set."""
+    control_shift = n_qubits - control_qubit - 1
+    target_shift = n_qubits - target_qubit - 1
+    return permute(state, lambda ranks: ranks ^ (((ranks >> control_shift) & 1) << target_shift))
+
+def apply_z(state, qubit, n_qubits):
+    """Pauli Z as a sign flip on the half of the state where the qubit is one."""
+    def task(view):
+        view[:, 1, :] *= -1
+
+    for_each_view_chunk(qubit_view(state, qubit, n_qubits), task)
+    return state
+
+def apply_single_qubit_gate(state, gate, qubit, n_qubits):
+    """Applies a 2x2 gate by updating the pairs of amplitudes that differ only in the targeted qubit."""
+    def task(view):
+        zero = view[:, 0, :].copy()
+        one = view[:, 1, :]
+        view[:, 0, :] = gate[0, 0]*zero + gate[0, 1]*one
+        view[:, 1, :] = gate[1, 0]*zero + gate[1, 1]*one
+
+    for_each_view_chunk(qubit_view(state, qubit, n_qubits), task)
+    return state
+
+def apply_local_gate(state, gate, qubits, n_qubits):
+    """Applies an arbitrary 2^k x 2^k gate acting on k qubits by contracting it with the targeted tensor axes."""
+    n_targets = len(qubits)
+    gate_tensor = gate.reshape((2,)*2*n_targets)
+    new_state = np.tensordot(gate_tensor, state.reshape((2,)*n_qubits), axes=(list(range(n_targets, 2*n_targets)), list(qubits)))
+    new_state = np.moveaxis(new_state, list(range(n_targets)), list(qubits))
+    return np.ascontiguousarray(new_state).reshape(2**n_qubits)
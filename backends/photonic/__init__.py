@@ -1,4 +1,26 @@
-from .fock_backend import FockBackend
-from .permanent_backend import PermanentBackend
-from .mr_mustard_backend import MrMustardBackend
-from .perceval_backend import PercevalBackend
\ No newline at end of file
+"""
+Photonic backends, each imported on first access.
+"""
+
+import importlib
+
+# Module containing each backend
+_backend_modules = {
+    "FockBackend": ".fock_backend",
+    "PermanentBackend": ".permanent_backend",
+    "MrMustardBackend": ".mr_mustard_backend",
+    "PercevalBackend": ".perceval_backend",
+}
+
+__all__ = list(_backend_modules)
+
+def __getattr__(name):
+    if name in _backend_modules:
+        module = importlib.import_module(_backend_modules[name], __name__)
+        backend = getattr(module, name)
+        globals()[name] = backend
+        return backend
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
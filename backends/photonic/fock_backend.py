@@ -8,9 +8,15 @@ import scipy
 from abc import abstractmethod
 from backends.component import Component
 from backends.backend import PhotonicBackend
-from backends.utils import rank_to_fock_basis, fock_hilbert_dimension, spin_y_matrix, tuple_to_str, degrees_to_radians, eliminate_tolerance
+from backends.cost_model import CircuitFeatures, machine_constants, fock_estimate
+from backends.utils import rank_to_fock_basis, fock_hilbert_dimension, spin_y_matrix, tuple_to_str, degrees_to_radians, eliminate_tolerance, hermitian_exponentials, fock_basis_array, fock_ranks
 
 class FockBackend(PhotonicBackend):
+    # Largest stack of density matrices, in bytes, propagated at once by run_many and run_sweep
+    max_stack_bytes = 2**28
+
+    state_attributes = ("density_matrix",)
+
     def __init__(self, n_wires, n_photons):
         super().__init__(n_wires, n_photons)
 
@@ -21,26 +27,113 @@ class FockBackend(PhotonicBackend):
         self.register_component("loss", FockLoss)
         self.register_component("detector", FockDetector)
 
-        self.density_matrix = np.zeros((self.hilbert_dimension, self.hilbert_dimension))
+        # Allocated by set_input_state, once it is known to fit in the memory budget
+        self.density_matrix = None
 
     def set_input_state(self, input_basis_element):
         super().set_input_state(input_basis_element)
+        self.density_matrix = None
+        self.check_memory_budget()
         input_basis_rank = self.basis_to_rank(input_basis_element)
-        self.density_matrix[:] = 0
+        self.density_matrix = np.zeros((self.hilbert_dimension, self.hilbert_dimension))
         self.density_matrix[input_basis_rank, input_basis_rank] = 1
 
-    def run(self):
+    def estimate(self, input_basis_element=None):
+        return fock_estimate(CircuitFeatures.of(self, input_basis_element), machine_constants())
+
+    def simulate(self):
         for comp in self.component_list:
             comp.apply()
         self.density_matrix = eliminate_tolerance(self.density_matrix)
 
+    def run_many(self, input_states):
+        """
+        Propagates the input states together as a stack of density matrices, so each component's operator is
+        built once for the whole stack. Inputs are split into chunks whose stack fits in max_stack_bytes.
+        """
+        for input_state in input_states:
+            self.validate_input_state(input_state)
+
+        density_matrix = self.density_matrix
+        probabilities = np.zeros((len(input_states), self.hilbert_dimension))
+        chunk_size = max(1, self.max_stack_bytes // (np.dtype(complex).itemsize * self.hilbert_dimension**2))
+        try:
+            for start in range(0, len(input_states), chunk_size):
+                chunk = input_states[start:start + chunk_size]
+                input_ranks = [self.basis_to_rank(input_state) for input_state in chunk]
+                self.density_matrix = np.zeros((len(chunk), self.hilbert_dimension, self.hilbert_dimension), dtype=complex)
+                self.density_matrix[np.arange(len(chunk)), input_ranks, input_ranks] = 1
+                self.simulate()
+                probabilities[start:start + len(chunk)] = self._probabilities
+        finally:
+            self.density_matrix = density_matrix
+        return probabilities
+
+    def run_sweep(self, sweep):
+        """
+        Propagates a stack of density matrices with one per point of the sweep. Swept components apply a stack
+        of operators built from batched two-wire blocks, and the other components apply one operator to the
+        whole stack. Points are split into chunks whose stack fits in max_stack_bytes.
+        """
+        swept, n_points = self.sweep_points(sweep)
+
+        density_matrix = self.density_matrix
+        input_rank = self.basis_to_rank(self.input_basis_element)
+        probabilities = np.zeros((n_points, self.hilbert_dimension))
+        chunk_size = max(1, self.max_stack_bytes // (np.dtype(complex).itemsize * self.hilbert_dimension**2))
+        try:
+            for start in range(0, n_points, chunk_size):
+                stop = min(start + chunk_size, n_points)
+                self.density_matrix = np.zeros((stop - start, self.hilbert_dimension, self.hilbert_dimension), dtype=complex)
+                self.density_matrix[:, input_rank, input_rank] = 1
+                for index, comp in enumerate(self.component_list):
+                    if index in swept:
+                        comp.apply_sweep(swept[index][start:stop])
+                    else:
+                        comp.apply()
+                self.density_matrix = eliminate_tolerance(self.density_matrix)
+                probabilities[start:stop] = self._probabilities
+        finally:
+            self.density_matrix = density_matrix
+        return probabilities
+
+    def reduced_density_matrix(self, wires):
+        """
+        Partial trace of the density matrix over every wire not in wires (1-indexed). Returns the density matrix of
+        the kept wires, in the rank order of their Fock basis with up to n_photons photons. Basis elements that
+        agree on the traced-out wires are grouped, so each group adds one block to the reduced density matrix.
+        """
+        if len(set(wires)) != len(wires) or not all(isinstance(w, int) and 1 <= w <= self.n_wires for w in wires):
+            raise ValueError(f"Wires must be distinct integers between 1 and {self.n_wires}.")
+
+        kept = [w - 1 for w in wires]
+        traced = [w for w in range(self.n_wires) if w not in kept]
+        occupations = fock_basis_array(self.n_wires, self.n_photons)
+        kept_ranks = fock_ranks(occupations[:, kept])
+
+        reduced = np.zeros((fock_hilbert_dimension(len(kept), self.n_photons),)*2, dtype=complex)
+        if not traced:
+            reduced[np.ix_(kept_ranks, kept_ranks)] = self.density_matrix
+            return reduced
+
+        traced_ranks = fock_ranks(occupations[:, traced])
+        order = np.argsort(traced_ranks, kind="stable")
+        for group in np.split(order, np.nonzero(np.diff(traced_ranks[order]))[0] + 1):
+            reduced[np.ix_(kept_ranks[group], kept_ranks[group])] += self.density_matrix[np.ix_(group, group)]
+        return reduced
+
     @property
     def _probabilities(self):
-        return np.real(self.density_matrix.diagonal())
+        """Diagonal of the density matrix, or of each density matrix in a stack."""
+        return np.real(np.diagonal(self.density_matrix, axis1=-2, axis2=-1))
     
     @property
     def _occupied_ranks(self):
-        return np.nonzero(self._probabilities)[0]
+        """Ranks with nonzero probability, in any of the density matrices in a stack."""
+        probabilities = self._probabilities
+        if probabilities.ndim > 1:
+            probabilities = np.any(probabilities, axis=0)
+        return np.nonzero(probabilities)[0]
     
     @property
     def _nonzero_probabilities(self):
@@ -59,12 +152,22 @@ class FockComponent(Component):
 
     def apply(self):
         unitary = self.unitary()
+        # Works for a single density matrix or a stack of them
         self.backend.density_matrix = unitary @ self.backend.density_matrix @ np.conjugate(unitary).T
 
+    def apply_sweep(self, values):
+        """Applies the component with each value of its swept parameter to a stack of density matrices, one per value."""
+        unitaries = self.swept_unitaries(values)
+        self.backend.density_matrix = unitaries @ self.backend.density_matrix @ np.conjugate(np.swapaxes(unitaries, -1, -2))
+
     @abstractmethod
     def unitary(self):
         raise NotImplementedError
 
+    def swept_unitaries(self, values):
+        """Stack of operators in the full Fock space, one for each value of the component's swept parameter."""
+        raise NotImplementedError
+
 
 class FockBeamSplitter(FockComponent):
     def __init__(self, backend, *, wires, theta=90):
@@ -81,7 +184,19 @@ class FockBeamSplitter(FockComponent):
 
     def unitary(self):
         """Unitary operator in the full Fock space."""
-        unitary = np.eye(self.backend.hilbert_dimension, dtype=complex)
+        return self.embed(self.two_wire_unitaries)
+
+    def swept_unitaries(self, values):
+        """Unitaries in the full Fock space for each angle, with the two-wire blocks for every angle from one eigendecomposition per photon number."""
+        thetas = degrees_to_radians(np.asarray(values))
+        two_wire_unitaries = {n_photons: hermitian_exponentials(spin_y_matrix(n_photons+1), thetas/2) for n_photons in range(self.backend.n_photons+1)}
+        return self.embed(two_wire_unitaries, len(thetas))
+
+    def embed(self, two_wire_unitaries, n_points=None):
+        """Inserts the two-wire unitary for each photon number into the full Fock space, or stacks of them when n_points is given."""
+        hilbert = self.backend.hilbert_dimension
+        shape = (hilbert, hilbert) if n_points is None else (n_points, hilbert, hilbert)
+        unitary = np.broadcast_to(np.eye(hilbert, dtype=complex), shape).copy()
 
         self.photon_count_per_rank = self.log_entering_photons()
 
@@ -95,7 +210,7 @@ class FockBeamSplitter(FockComponent):
             connected_ranks = self.connected_ranks(rank)
 
             # Insert the two-wire unitary into the full Fock space
-            unitary[np.ix_(connected_ranks, connected_ranks)] = self.two_wire_unitaries[photons]
+            unitary[(Ellipsis,) + np.ix_(connected_ranks, connected_ranks)] = two_wire_unitaries[photons]
 
             # Track the ranks we have dealt with
             used_ranks.extend(connected_ranks)
@@ -165,11 +280,18 @@ class FockPhaseShift(FockComponent):
 
     def unitary(self):
         """Switch operator in the full Fock space."""
-        hilbert = self.backend.hilbert_dimension
-        unitary = np.eye(hilbert, dtype=complex)
-
         if self.phase == 0 or self.phase == 2*np.pi:
-            return unitary
+            return np.eye(self.backend.hilbert_dimension, dtype=complex)
+
+        return self.phase_unitary(self.phase)
+
+    def swept_unitaries(self, values):
+        return self.phase_unitary(degrees_to_radians(np.asarray(values)))
+
+    def phase_unitary(self, phase):
+        """Phase shift operator in the full Fock space, or a stack of them when phase is an array."""
+        hilbert = self.backend.hilbert_dimension
+        unitary = np.broadcast_to(np.eye(hilbert, dtype=complex), np.shape(phase) + (hilbert, hilbert)).copy()
 
         for rank in self.backend._occupied_ranks:
             basis_element = self.backend.rank_to_basis(rank)
@@ -178,7 +300,7 @@ class FockPhaseShift(FockComponent):
             if photons_in_wire == 0:
                 continue
 
-            unitary[rank, rank] = np.exp(1j*self.phase*photons_in_wire)
+            unitary[..., rank, rank] = np.exp(1j*phase*photons_in_wire)
 
         return unitary
     
@@ -193,13 +315,21 @@ class FockLoss(FockComponent):
         self.validate_loss(self.wires, self.eta)
 
     def apply(self):
-        self.backend.density_matrix = sum([kraus @ self.backend.density_matrix @ np.conjugate(kraus).T for kraus in self.kraus_operators().values()])
+        self.apply_kraus(self.kraus_operators(self.eta))
+
+    def apply_sweep(self, values):
+        self.apply_kraus(self.kraus_operators(np.asarray(values)))
+
+    def apply_kraus(self, kraus_operators):
+        # Works for a single density matrix or a stack of them, with a stack of Kraus operators
+        self.backend.density_matrix = sum([kraus @ self.backend.density_matrix @ np.conjugate(np.swapaxes(kraus, -1, -2)) for kraus in kraus_operators.values()])
 
     def unitary(self):
         pass
 
-    def kraus_operators(self):
-        kraus_operators = {lost_photons: np.zeros((self.backend.hilbert_dimension, self.backend.hilbert_dimension)) for lost_photons in range(self.backend.n_photons + 1)}
+    def kraus_operators(self, eta):
+        """Kraus operators for each number of lost photons, or stacks of them when eta is an array."""
+        kraus_operators = {lost_photons: np.zeros(np.shape(eta) + (self.backend.hilbert_dimension, self.backend.hilbert_dimension)) for lost_photons in range(self.backend.n_photons + 1)}
 
         for lost_photons in range(self.backend.n_photons + 1):
 
@@ -211,7 +341,7 @@ class FockLoss(FockComponent):
                     new_basis_element = [n if wire != self.reindexed_wires[0] else n - lost_photons for wire, n in enumerate(basis_element)]
                     new_rank = self.backend.basis_to_rank(new_basis_element)
 
-                    kraus_operators[lost_photons][new_rank, rank] = np.sqrt(math.comb(photons_in_wire, lost_photons))*self.eta**((photons_in_wire - lost_photons)/2)*(1 - self.eta)**(lost_photons / 2)
+                    kraus_operators[lost_photons][..., new_rank, rank] = np.sqrt(math.comb(photons_in_wire, lost_photons))*eta**((photons_in_wire - lost_photons)/2)*(1 - eta)**(lost_photons / 2)
         return kraus_operators
     
 class FockDetector(FockComponent):
@@ -229,11 +359,11 @@ class FockDetector(FockComponent):
             basis_element = np.array(self.backend.rank_to_basis(rank))
             keep = np.all(basis_element[self.reindexed_wires] == self.herald)
             if not keep:
-                self.backend.density_matrix[rank, :] = 0
-                self.backend.density_matrix[:, rank] = 0
+                self.backend.density_matrix[..., rank, :] = 0
+                self.backend.density_matrix[..., :, rank] = 0
 
-        if len(self.backend._occupied_ranks) == 0:
-            raise ValueError("No population remaining.")
+        # Each density matrix in a stack must keep some population
+        self.backend.check_population(self.backend._probabilities)
         
     def unitary(self):
         pass
\ No newline at end of file
@@ -1,18 +1,41 @@
 from backends.backend import PhotonicBackend
-from mrmustard.lab import Fock, BSgate, MZgate, Attenuator, Rgate
+from backends.cost_model import CircuitFeatures, machine_constants, mr_mustard_estimate
+from mrmustard.lab import State, BSgate, MZgate, Attenuator, Rgate
 import mrmustard.math as math
 # from mrmustard import settings
 import numpy as np
 from abc import abstractmethod
 from backends.component import Component
-from backends.utils import tuple_to_str, degrees_to_radians, eliminate_tolerance
-
-math.change_backend("tensorflow")
+from backends.utils import tuple_to_str, degrees_to_radians, eliminate_tolerance, fock_basis_array
 
 class MrMustardBackend(PhotonicBackend):
-    def __init__(self, n_wires, n_photons):
+    """
+    The state is a ket tensor with one axis per wire, so its size is the product of the Fock cutoffs of
+    the modes. The components conserve the number of photons, so by default each mode's cutoff is one more
+    than the number of photons in the input state. A larger cutoff can be given with cutoff.
+
+    Mr Mustard's NumPy math backend is used by default. TensorFlow, which is slow to import, can be chosen
+    with math_backend="tensorflow", for example to differentiate through the circuit.
+    """
+    # Largest ket tensor, in bytes, that set_input_state will create
+    max_tensor_bytes = 2**31
+
+    math_backends = ["numpy", "tensorflow"]
+
+    cache_settings = PhotonicBackend.cache_settings + ("cutoff", "math_backend")
+    state_attributes = ("ket", "output_probabilities")
+
+    def __init__(self, n_wires, n_photons, cutoff=None, math_backend="numpy"):
         super().__init__(n_wires, n_photons)
 
+        if cutoff is not None and cutoff < 1:
+            raise ValueError("Cutoff must be positive.")
+        if math_backend not in self.math_backends:
+            raise ValueError(f"Math backend must be one of {self.math_backends}.")
+        self.cutoff = cutoff
+        self.math_backend = math_backend
+        self.use_math_backend()
+
         # Register components
         self.register_component("beamsplitter", MrMustardBeamSplitter)
         self.register_component("switch", MrMustardSwitch)
@@ -23,40 +46,93 @@ class MrMustardBackend(PhotonicBackend):
         self.state = None
         self.ket = None
         self.output_probabilities = None
-
-    def run(self):
+        self.tensor_size = None
+
+    def use_math_backend(self):
+        """
+        Selects the math backend in Mr Mustard, which only imports TensorFlow if it is selected. Mr Mustard
+        fixes the math backend after its first calculation, so all instances in a session must use the same one.
+        """
+        if math.backend_name != self.math_backend:
+            try:
+                math.change_backend(self.math_backend)
+            except ValueError:
+                raise ValueError(f"Mr Mustard is already using the {math.backend_name} math backend, which can't be changed in this session.") from None
+
+    def estimate(self, input_basis_element=None):
+        return mr_mustard_estimate(CircuitFeatures.of(self, input_basis_element), machine_constants(), self.cutoff)
+
+    def simulate(self):
+        self.clear_outputs()
         for comp in self.component_list:
             comp.apply()
 
+    def clear_outputs(self):
+        """Discards the ket and probabilities computed from the previous state."""
+        self.ket = None
+        self.output_probabilities = None
+
     def set_input_state(self, input_basis_element):
-        self.state = Fock(list(input_basis_element), cutoffs = [self.hilbert_dimension]*self.n_wires)
+        super().set_input_state(input_basis_element)
+        self.tensor_size = self.preflight(input_basis_element)
+
+        # The ket is created at its full size, since padding a smaller one fails for more than 6 modes in TensorFlow
+        ket = np.zeros(self.tensor_size["cutoffs"], dtype=np.complex128)
+        ket[input_basis_element] = 1
+        self.state = State(ket = ket)
+        self.clear_outputs()
+
+    def cutoffs(self, input_basis_element):
+        """Fock cutoff of each mode for an input state."""
+        n_input_photons = sum(input_basis_element)
+        if self.cutoff is None:
+            return [n_input_photons + 1]*self.n_wires
+        if self.cutoff <= n_input_photons:
+            raise ValueError(f"Cutoff must be larger than the number of photons in the input state, {n_input_photons}.")
+        return [self.cutoff]*self.n_wires
+
+    def preflight(self, input_basis_element):
+        """
+        Returns the cutoffs, number of entries and size in bytes of the ket tensor needed for an input state.
+        Raises an error if the tensor would be larger than max_tensor_bytes.
+        """
+        cutoffs = self.cutoffs(input_basis_element)
+        n_entries = int(np.prod(cutoffs, dtype=object))
+        n_bytes = n_entries*np.dtype(np.complex128).itemsize
+        if n_bytes > self.max_tensor_bytes:
+            raise ValueError(f"The ket tensor would have {n_entries} entries ({n_bytes/2**30:.1f} GiB), which is more than the limit of {self.max_tensor_bytes/2**30:.1f} GiB.")
+        return {"cutoffs": cutoffs, "entries": n_entries, "bytes": n_bytes}
 
     @property
     def _occupied_ranks(self):
-        occ = np.nonzero(self._probabilities)[0]
-        return occ
-    
+        return np.nonzero(self._probabilities)[0]
+
     @property
     def _nonzero_probabilities(self):
         return self._probabilities[self._occupied_ranks]
-    
+
     @property
     def _basis_strings(self):
-        return [tuple_to_str(self.rank_to_basis(rank)) for rank in self._occupied_ranks]
-    
+        occupations = fock_basis_array(self.n_wires, self.n_photons)[self._occupied_ranks]
+        return [tuple_to_str(tuple(occupation)) for occupation in occupations.tolist()]
+
     @property
     def _probabilities(self):
-        if self.ket is None:
-            self.ket = self.state.ket()
+        if self.output_probabilities is None:
+            if self.ket is None:
+                self.ket = np.asarray(self.state.ket())
+
+            # Gather |ket|^2 at the occupation numbers of every basis element that fits within the cutoffs
+            occupations = fock_basis_array(self.n_wires, self.n_photons)
+            in_cutoffs = np.all(occupations < self.ket.shape, axis=1)
+            indices = np.ravel_multi_index(occupations[in_cutoffs].T, self.ket.shape)
 
-        probs = np.zeros(self.hilbert_dimension)
-        for rank in range(self.hilbert_dimension):
-            basis_element = self.rank_to_basis(rank)
-            if all(0 <= idx < dim_size for idx, dim_size in zip(basis_element, self.ket.shape)):
-                probs[rank] = np.abs(self.ket[basis_element])**2
+            probs = np.zeros(self.hilbert_dimension)
+            probs[in_cutoffs] = np.abs(self.ket.ravel()[indices])**2
+            self.output_probabilities = eliminate_tolerance(probs)
+
+        return self.output_probabilities
 
-        return eliminate_tolerance(probs)
-        
 
 class MrMustardComponent(Component):
     def __init__(self, backend, wires):
@@ -134,10 +210,14 @@ class MrMustardDetector(MrMustardComponent):
         self.validate_detector(self.wires, self.herald)
 
     def apply(self):
-        self.backend.ket = self.backend.state.ket()
+        ket = np.asarray(self.backend.state.ket())
+
+        # post select on herald by keeping only the slice of the ket where each detected wire holds its herald
+        selected_ket = np.zeros_like(ket)
+        if all(h < ket.shape[wire] for wire, h in zip(self.reindexed_wires, self.herald)):
+            index = [slice(None)]*ket.ndim
+            for wire, h in zip(self.reindexed_wires, self.herald):
+                index[wire] = h
+            selected_ket[tuple(index)] = ket[tuple(index)]
 
-        # post select on herald
-        for idx, wire in enumerate(self.wires):
-            for n in range(self.backend.n_photons + 1):
-                if n != self.herald[idx]:
-                    self.backend.ket[(slice(None),) * wire + (n,)] = 0
+        self.backend.state = State(ket = selected_ket)
@@ -1,14 +1,41 @@
+import numpy as np
+from collections import Counter
 import perceval as pcvl
 from abc import abstractmethod
 from perceval.components import BS, PS, PERM, LC
 from backends.backend import PhotonicBackend
+from backends.cost_model import CircuitFeatures, machine_constants, perceval_estimate
 from backends.component import Component
-from backends.utils import tuple_to_str, degrees_to_radians
+from backends.utils import tuple_to_str, degrees_to_radians, fock_hilbert_dimension_fixed_number
 
 class PercevalBackend(PhotonicBackend):
-    def __init__(self, n_wires, n_photons):
+    """
+    The Perceval processor is compiled from the component list on the first run and kept afterwards, so
+    runs that only change the input state reuse it. With shots set, run() estimates the probabilities from
+    Perceval's sampler instead of computing the full output distribution.
+    """
+    simulators = ["automatic", "SLOS", "Naive", "MPS"]
+
+    # Largest number of output states for which SLOS, which keeps every intermediate amplitude in memory, is chosen automatically
+    slos_max_dimension = 2**20
+
+    # Largest number of photons for which Naive, which computes one permanent per output state, is chosen automatically
+    naive_max_photons = 12
+
+    cache_settings = PhotonicBackend.cache_settings + ("simulator", "shots")
+    profiled_phases = PhotonicBackend.profiled_phases + ("build_processor",)
+
+    def __init__(self, n_wires, n_photons, simulator="automatic", shots=None):
         super().__init__(n_wires, n_photons)
 
+        if simulator not in self.simulators:
+            raise ValueError(f"Simulator must be one of {self.simulators}.")
+        if shots is not None and shots < 1:
+            raise ValueError("Number of shots must be positive.")
+
+        self.simulator = simulator
+        self.shots = shots
+
         # Register components
         self.register_component("beamsplitter", PercevalBeamSplitter)
         self.register_component("switch", PercevalSwitch)
@@ -16,39 +43,179 @@ class PercevalBackend(PhotonicBackend):
         self.register_component("loss", PercevalLoss)
         self.register_component("detector", PercevalDetector)
 
-        self.circuit = pcvl.Processor("SLOS", self.n_wires)
+        self.input_basis_element = None
+        self.circuit = None
+        self.sampler = None
+        self._compiled_key = None
 
         self.output_dict = {}
 
-        self.sampler = pcvl.algorithm.Sampler(self.circuit)
+    @property
+    def simulator_name(self):
+        """
+        Perceval backend used to simulate the circuit, chosen from the circuit size and photon number when automatic.
+        MPS truncates the bond dimension, so it is approximate, and it does not support loss.
+        """
+        if self.simulator != "automatic":
+            return self.simulator
+        if fock_hilbert_dimension_fixed_number(self.n_wires, self.n_photons) <= self.slos_max_dimension:
+            return "SLOS"
+        if self.n_photons <= self.naive_max_photons or self.has_loss:
+            return "Naive"
+        return "MPS"
 
-    def run(self):
-        for comp in self.component_list:
-            comp.apply()
+    @property
+    def has_loss(self):
+        return any(isinstance(comp, PercevalLoss) for comp in self.component_list)
+
+    def build_processor(self):
+        """Builds the Perceval processor and sampler from the component list."""
+        self.circuit = pcvl.Processor(self.simulator_name, self.n_wires)
+        self.circuit.min_detected_photons_filter(-1) # this should really be zero, but the current version of Perceval seems to have a mistake
+
+        if self.simulator_name == "MPS":
+            if self.has_loss:
+                raise ValueError("Perceval's MPS simulator does not support loss.")
+
+            # The MPS simulator only accepts components acting on neighbouring modes, so lossless components are added one at a time
+            for comp in self.component_list:
+                if isinstance(comp, PercevalLinearComponent):
+                    self.add_neighbouring_unitary(comp.reindexed_wires, comp.sub_unitary())
+                else:
+                    comp.apply()
+        else:
+            # Consecutive lossless components are composed into one mode unitary, which is given to Perceval as a single component
+            unitary = np.eye(self.n_wires, dtype=complex)
+            for comp in self.component_list:
+                if isinstance(comp, PercevalLinearComponent):
+                    unitary = comp.unitary() @ unitary
+                else:
+                    self.add_unitary(unitary)
+                    unitary = np.eye(self.n_wires, dtype=complex)
+                    comp.apply()
+            self.add_unitary(unitary)
 
-        self.output_dict = self.sampler.probs()["results"]
+        self.sampler = pcvl.algorithm.Sampler(self.circuit)
+        self._compiled_key = self._compilation_key()
+
+    def _compilation_key(self):
+        return self.simulator_name, tuple(self.component_list)
+
+    def prepare(self):
+        """Compiles the circuit if it has changed since the last run, then gives it the input state."""
+        if self._compiled_key != self._compilation_key():
+            self.build_processor()
+        self.circuit.with_input(pcvl.BasicState(self._remove_heralds(self.input_basis_element)))
+
+    def compile(self, ir):
+        """Builds the Perceval processor once. Each execution only gives it the input state."""
+        compiled = super().compile(ir)
+        with self.using_components(compiled.components):
+            self.build_processor()
+        compiled.processor = self.circuit
+        compiled.sampler = self.sampler
+        compiled.key = self._compiled_key
+        return compiled
+
+    def execute(self, compiled, input_basis_element):
+        self.validate_compiled(compiled)
+        self.circuit = compiled.processor
+        self.sampler = compiled.sampler
+        self._compiled_key = compiled.key
+        return super().execute(compiled, input_basis_element)
+
+    def estimate(self, input_basis_element=None):
+        return perceval_estimate(CircuitFeatures.of(self, input_basis_element), machine_constants(), self.simulator_name)
+
+    def simulate(self):
+        self.prepare()
+        if self.shots is None:
+            results = self.sampler.probs()["results"]
+            outputs = {self._insert_heralds(state): probability for state, probability in results.items()}
+        else:
+            counts = Counter(self.sample(self.shots))
+            outputs = {state: count/self.shots for state, count in counts.items()}
+
+        self.output_dict = dict(sorted(outputs.items(), key=lambda item: self.basis_to_rank(item[0])))
+
+    @property
+    def cacheable(self):
+        """Sampled results are not cached, so every run draws new samples."""
+        return self.shots is None
+
+    def sample(self, n_samples):
+        """Draws output states from the circuit using Perceval's sampler. Returns a list of basis elements."""
+        self.prepare()
+        samples = self.sampler.samples(n_samples)["results"]
+        return [self._insert_heralds(state) for state in samples]
+
+    def add_unitary(self, unitary):
+        """Adds a mode unitary acting on all wires to the Perceval circuit, unless it does nothing."""
+        if not np.allclose(unitary, np.eye(self.n_wires)):
+            self.circuit.add(0, pcvl.Unitary(pcvl.Matrix(unitary)))
+
+    def add_neighbouring_unitary(self, wires, unitary):
+        """Adds a unitary acting on one or two wires, moving the second wire next to the first with swaps of neighbouring wires if needed."""
+        if len(wires) == 1:
+            self.circuit.add(wires[0], pcvl.Unitary(pcvl.Matrix(unitary)))
+            return
+
+        if wires[0] > wires[1]:
+            wires = wires[::-1]
+            unitary = unitary[::-1, ::-1]
+        first, second = wires
+
+        swaps = range(second - 1, first, -1)
+        for wire in swaps:
+            self.circuit.add(wire, PERM([1, 0]))
+        # Perceval's MPS simulator applies generic unitaries transposed, so the transpose is given to it
+        self.circuit.add(first, pcvl.Unitary(pcvl.Matrix(np.ascontiguousarray(unitary.T))))
+        for wire in reversed(swaps):
+            self.circuit.add(wire, PERM([1, 0]))
 
     def set_input_state(self, input_basis_element):
         super().set_input_state(input_basis_element)
-        self.circuit.min_detected_photons_filter(-1) # this should really be zero, but the current version of Perceval seems to have a mistake
-        self.circuit.with_input(pcvl.BasicState(list(input_basis_element)))
+        self.input_basis_element = input_basis_element
+
+    def _remove_heralds(self, basis_element):
+        """
+        Perceval's input state excludes the heralded wires, whose values are set by the heralds. The input on those
+        wires must already match, or Perceval would simulate a different number of photons.
+        """
+        heralds = self.circuit.heralds
+        mismatched = sorted(wire + 1 for wire, n in heralds.items() if basis_element[wire] != n)
+        if mismatched:
+            raise ValueError(f"Perceval sets the input of heralded wires to their heralds, so the input state must match the heralds on wires {mismatched}.")
+        return [n for wire, n in enumerate(basis_element) if wire not in heralds]
+
+    def _insert_heralds(self, state):
+        """Perceval's output states exclude the heralded wires, so their values are added back in."""
+        heralds = self.circuit.heralds
+        occupations = iter(state)
+        return tuple(heralds[wire] if wire in heralds else next(occupations) for wire in range(self.n_wires))
+
+    def nonzero_output(self):
+        """Read from output_dict, without filling the full probability array."""
+        return self._occupied_ranks, np.array(self._nonzero_probabilities)
 
     @property
     def _probabilities(self):
-        pass
-    
+        probabilities = np.zeros(self.hilbert_dimension)
+        probabilities[self._occupied_ranks] = self._nonzero_probabilities
+        return probabilities
+
     @property
     def _occupied_ranks(self):
-        pass
-    
+        return np.array([self.basis_to_rank(state) for state in self.output_dict.keys()], dtype=int)
+
     @property
     def _nonzero_probabilities(self):
-        return self.output_dict.values()
-    
+        return list(self.output_dict.values())
+
     @property
     def _basis_strings(self):
         return [tuple_to_str(key) for key in self.output_dict.keys()]
-    
+
 class PercevalComponent(Component):
     def __init__(self, backend, wires):
         self.wires = wires
@@ -60,7 +227,22 @@ class PercevalComponent(Component):
     def apply(self):
         raise NotImplementedError
 
-class PercevalBeamSplitter(PercevalComponent):
+class PercevalLinearComponent(PercevalComponent):
+    """Lossless component, which is composed into the circuit's mode unitary instead of being added to Perceval directly."""
+    def apply(self):
+        raise NotImplementedError("Lossless components are composed into the mode unitary by the backend.")
+
+    def unitary(self):
+        unitary = np.eye(self.backend.n_wires, dtype=complex)
+        unitary[np.ix_(self.reindexed_wires, self.reindexed_wires)] = self.sub_unitary()
+        return unitary
+
+    @abstractmethod
+    def sub_unitary(self):
+        """Unitary operator in the subspace of the wires affected by the component, using Perceval's conventions."""
+        raise NotImplementedError
+
+class PercevalBeamSplitter(PercevalLinearComponent):
     def __init__(self, backend, *, wires, theta=90):
 
         self.theta = degrees_to_radians(theta)
@@ -70,34 +252,20 @@ class PercevalBeamSplitter(PercevalComponent):
     def validate(self):
         self.validate_beamsplitter(self.wires, self.theta)
 
-    def apply(self):
-        # Perceval can only do beam splitters and switches on consecutive wires (it claims it can handle non-consecutive wires but it doesn't seem to work)
-        all_wires = tuple(range(self.backend.n_wires))
-        switched = False
-        if self.reindexed_wires[0] + 1 != self.reindexed_wires[1]:
-            permuted_wires = list(range(self.backend.n_wires))
-            w0, w1 = self.reindexed_wires[0] + 1, self.reindexed_wires[1]
-            permuted_wires[w0], permuted_wires[w1] = permuted_wires[w1], permuted_wires[w0]
-            self.backend.circuit.add(all_wires, PERM(permuted_wires))
-            switched = True
-        self.backend.circuit.add((self.reindexed_wires[0], self.reindexed_wires[0]+1), BS.H(self.theta))
-        # Perceval automatically switches wire indices during a beam splitter
-        self.backend.circuit.add((self.reindexed_wires[0], self.reindexed_wires[0]+1), PERM([1, 0]))
-        # Switch back
-        if switched:
-            self.backend.circuit.add(all_wires, PERM(permuted_wires))
-
-class PercevalSwitch(PercevalComponent):
+    def sub_unitary(self):
+        return np.array(BS.Ry(-self.theta).compute_unitary())
+
+class PercevalSwitch(PercevalLinearComponent):
     def __init__(self, backend, *, wires):
         super().__init__(backend, wires)
 
     def validate(self):
         self.validate_switch(self.wires)
 
-    def apply(self):
-        self.backend.circuit.add(tuple(self.reindexed_wires), PERM([1, 0]))
+    def sub_unitary(self):
+        return np.array(PERM([1, 0]).compute_unitary())
 
-class PercevalPhaseShift(PercevalComponent):
+class PercevalPhaseShift(PercevalLinearComponent):
     def __init__(self, backend, *, wires, phase = 180):
 
         self.phase = degrees_to_radians(phase)
@@ -107,8 +275,8 @@ class PercevalPhaseShift(PercevalComponent):
     def validate(self):
         self.validate_phaseshift(self.wires, self.phase)
 
-    def apply(self):
-        self.backend.circuit.add(self.reindexed_wires, PS(phi = self.phase))
+    def sub_unitary(self):
+        return np.array(PS(phi = self.phase).compute_unitary())
 
 class PercevalLoss(PercevalComponent):
     def __init__(self, backend, *, wires, eta = 1):
@@ -121,11 +289,8 @@ class PercevalLoss(PercevalComponent):
         self.validate_loss(self.wires, self.eta)
 
     def apply(self):
-        for wire in range(self.backend.n_wires):
-            if wire in self.reindexed_wires:
-                self.backend.circuit.add(wire, LC(1 - self.eta))
-            else:
-                self.backend.circuit.add(wire, LC(0)) # perceval seems to have a problem with applying loss to only 1 wire
+        for wire in self.reindexed_wires:
+            self.backend.circuit.add(wire, LC(1 - self.eta))
 
 class PercevalDetector(PercevalComponent):
     def __init__(self, backend, *, wires, herald):
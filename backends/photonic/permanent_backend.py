@@ -9,10 +9,14 @@ import numpy as np
 from abc import abstractmethod
 from backends.component import Component
 from backends.backend import PhotonicBackend
-from backends.utils import spin_y_matrix, tuple_to_str, degrees_to_radians, pauli_x, eliminate_tolerance
+from backends.cost_model import CircuitFeatures, machine_constants, permanent_estimate
+from backends.utils import spin_y_matrix, tuple_to_str, degrees_to_radians, pauli_x, eliminate_tolerance, fock_basis_array, hermitian_exponentials, fock_basis_chunks
 
 
 class PermanentBackend(PhotonicBackend):
+    state_attributes = ("circuit_unitary", "output_probabilities")
+    profiled_phases = PhotonicBackend.profiled_phases + ("compose_unitary", "compute_output_probabilities")
+
     def __init__(self, n_wires, n_photons):
         super().__init__(n_wires, n_photons)
 
@@ -32,52 +36,178 @@ class PermanentBackend(PhotonicBackend):
         super().set_input_state(input_basis_element)
         self.input_basis_element = input_basis_element
 
-    def run(self):
-        for comp in self.component_list:
-            if not isinstance(comp, PermanentDetector):
-                comp.apply()
+    def estimate(self, input_basis_element=None):
+        return permanent_estimate(CircuitFeatures.of(self, input_basis_element), machine_constants())
+
+    def simulate(self):
+        self.circuit_unitary = self.compose_unitary(self.component_list)
+        self.compute_output_probabilities(self.component_list)
 
+    def compose_unitary(self, components):
+        """
+        Mode unitary of the whole circuit, composed from the components other than detectors. The components
+        compose it in circuit_unitary, which is restored afterwards, so it keeps matching output_probabilities.
+        """
+        circuit_unitary = self.circuit_unitary
+        self.circuit_unitary = np.eye(self.n_wires)
+        try:
+            for comp in components:
+                if not isinstance(comp, PermanentDetector):
+                    comp.apply()
+            return self.circuit_unitary
+        finally:
+            self.circuit_unitary = circuit_unitary
+
+    def compute_output_probabilities(self, components):
+        """Output probabilities from circuit_unitary and the input state, post-selected by the detectors among components."""
         for rank in range(self.hilbert_dimension):
             output_basis_element = self.rank_to_basis(rank)
             self.output_probabilities[rank] = self.output_probability(self.circuit_unitary, output_basis_element)
 
-        for comp in self.component_list:
+        for comp in components:
             if isinstance(comp, PermanentDetector):
                 comp.apply()
 
         self.output_probabilities = eliminate_tolerance(self.output_probabilities)
 
+    def compile(self, ir):
+        """Composes the circuit's mode unitary once, so executing it only computes permanents."""
+        compiled = super().compile(ir)
+        compiled.circuit_unitary = self.compose_unitary(compiled.components)
+        return compiled
+
+    def execute(self, compiled, input_basis_element):
+        self.validate_compiled(compiled)
+        self.set_input_state(input_basis_element)
+        self.circuit_unitary = compiled.circuit_unitary
+        self.compute_output_probabilities(compiled.components)
+        return self.get_output_data()
+
+    def run_many(self, input_states):
+        """
+        Runs the circuit on each input state, composing the circuit's unitary once. The rows of the unitary
+        selected by each output basis element are shared by every input, and the columns selected by each
+        input by every output.
+        """
+        for input_state in input_states:
+            self.validate_input_state(input_state)
+
+        circuit_unitary = self.compose_unitary(self.component_list)
+        occupations = fock_basis_array(self.n_wires, self.n_photons)
+        wires = np.arange(self.n_wires)
+        output_rows = [np.repeat(wires, output_basis_element) for output_basis_element in occupations]
+        output_norms = np.array([np.prod([math.factorial(n) for n in output_basis_element]) for output_basis_element in occupations.tolist()])
+        output_photons = occupations.sum(axis=1)
+
+        probabilities = np.zeros((len(input_states), self.hilbert_dimension))
+        for row, input_basis_element in zip(probabilities, input_states):
+            input_columns = circuit_unitary[:, np.repeat(wires, input_basis_element)]
+            norm_input = np.prod([math.factorial(n) for n in input_basis_element])
+            for rank in np.nonzero(output_photons == sum(input_basis_element))[0]:
+                row[rank] = np.abs(self.matrix_permanent(input_columns[output_rows[rank]]))**2/(norm_input * output_norms[rank])
+
+        for comp in self.component_list:
+            if isinstance(comp, PermanentDetector):
+                probabilities[:, ~comp.heralded(occupations)] = 0
+                self.check_population(probabilities)
+
+        return eliminate_tolerance(probabilities)
+
+    def run_sweep(self, sweep):
+        """
+        Evaluates every point of the sweep together. The circuit unitary is composed as a stack with one unitary
+        per point, using stacked sub-unitaries for the swept components, and each permanent is computed for the
+        whole stack at once.
+        """
+        swept, n_points = self.sweep_points(sweep)
+
+        circuit_unitary = self.circuit_unitary
+        self.circuit_unitary = np.broadcast_to(np.eye(self.n_wires, dtype=complex), (n_points, self.n_wires, self.n_wires))
+        try:
+            for index, comp in enumerate(self.component_list):
+                if isinstance(comp, PermanentDetector):
+                    continue
+                if index in swept:
+                    comp.apply_sweep(swept[index])
+                else:
+                    comp.apply()
+            circuit_unitaries = self.circuit_unitary
+        finally:
+            self.circuit_unitary = circuit_unitary
+
+        occupations = fock_basis_array(self.n_wires, self.n_photons)
+        wires = np.arange(self.n_wires)
+        input_columns = circuit_unitaries[:, :, np.repeat(wires, self.input_basis_element)]
+        norm_input = np.prod([math.factorial(n) for n in self.input_basis_element])
+
+        probabilities = np.zeros((n_points, self.hilbert_dimension))
+        for rank in np.nonzero(occupations.sum(axis=1) == sum(self.input_basis_element))[0]:
+            output_basis_element = occupations[rank]
+            norm_output = np.prod([math.factorial(n) for n in output_basis_element.tolist()])
+            probabilities[:, rank] = np.abs(self.matrix_permanent(input_columns[:, np.repeat(wires, output_basis_element)]))**2/(norm_input * norm_output)
+
+        for comp in self.component_list:
+            if isinstance(comp, PermanentDetector):
+                probabilities[:, ~comp.heralded(occupations)] = 0
+                self.check_population(probabilities)
+
+        return eliminate_tolerance(probabilities)
+
+    def iter_outputs(self, chunk_size=2**16):
+        """
+        Computes the output probabilities one chunk of output ranks at a time and yields the nonzero ones in each
+        chunk as soon as it is evaluated. Only outputs with as many photons as the input can be occupied, and the
+        basis elements are generated chunk by chunk, so memory is bounded by chunk_size.
+        """
+        circuit_unitary = self.compose_unitary(self.component_list)
+        detectors = [comp for comp in self.component_list if isinstance(comp, PermanentDetector)]
+        wires = np.arange(self.n_wires)
+        input_columns = circuit_unitary[:, np.repeat(wires, self.input_basis_element)]
+        norm_input = np.prod([math.factorial(n) for n in self.input_basis_element])
+
+        population = False
+        for occupations in fock_basis_chunks(self.n_wires, sum(self.input_basis_element), chunk_size):
+            keep = np.ones(len(occupations), dtype=bool)
+            for comp in detectors:
+                keep &= comp.heralded(occupations)
+            occupations = occupations[keep]
+
+            probabilities = np.zeros(len(occupations))
+            for row, output_basis_element in enumerate(occupations.tolist()):
+                norm_output = np.prod([math.factorial(n) for n in output_basis_element])
+                probabilities[row] = np.abs(self.matrix_permanent(input_columns[np.repeat(wires, output_basis_element)]))**2/(norm_input * norm_output)
+            probabilities = eliminate_tolerance(probabilities)
+
+            nonzero = probabilities > 0
+            if np.any(nonzero):
+                population = True
+                yield occupations[nonzero], probabilities[nonzero]
+
+        if detectors and not population:
+            raise ValueError("No population remaining.")
+
     def output_probability(self, circuit_unitary, output_basis_element):
+        if sum(output_basis_element) != sum(self.input_basis_element):
+            return 0
         circuit_submatrix = self.submatrix(circuit_unitary, output_basis_element)
         norm_input = np.prod([math.factorial(n) for n in self.input_basis_element])
         norm_output = np.prod([math.factorial(n) for n in output_basis_element])
         return np.abs(self.matrix_permanent(circuit_submatrix))**2/(norm_input * norm_output)
 
     def submatrix(self, circuit_unitary, output_basis_element):
-        UT = np.zeros((self.n_wires, self.n_photons), dtype=complex)
-        used_photons = 0
-        for j, tj in enumerate(self.input_basis_element):
-            for n in range(used_photons, used_photons + tj):
-                UT[:, n] = circuit_unitary[:, j]
-            used_photons += tj
-
-        used_photons = 0
-        UST = np.zeros((self.n_photons, self.n_photons), dtype=complex)
-        for i, si in enumerate(output_basis_element):
-            for n in range(used_photons, used_photons + si):
-                UST[n, :] = UT[i, :]
-            used_photons += si
-
-        return UST
+        """Rows of the circuit unitary repeated by the output's occupation numbers, and columns repeated by the input's."""
+        wires = np.arange(self.n_wires)
+        return circuit_unitary[np.ix_(np.repeat(wires, output_basis_element), np.repeat(wires, self.input_basis_element))]
         
     def matrix_permanent(self, matrix):
-        n = len(matrix)
+        """Permanent of a square matrix, or of each matrix in a stack."""
+        n = matrix.shape[-1]
         perms = itertools.permutations(range(n))
         total = 0
         for perm in perms:
             product = 1
             for i in range(n):
-                product *= matrix[i, perm[i]]
+                product *= matrix[..., i, perm[i]]
             total += product
         return total
     
@@ -106,11 +236,21 @@ class PermanentComponent(Component):
 
     def apply(self):
         unitary = self.unitary()
+        # Works for a single circuit unitary or a stack of them
         self.backend.circuit_unitary = unitary @ self.backend.circuit_unitary
 
+    def apply_sweep(self, values):
+        """Applies the component with each value of its swept parameter to a stack of circuit unitaries, one per value."""
+        self.backend.circuit_unitary = self.embed(self.swept_sub_unitaries(values), len(values)) @ self.backend.circuit_unitary
+
     def unitary(self):
-        unitary = np.eye(self.backend.n_wires, dtype=complex)
-        unitary[np.ix_(self.reindexed_wires, self.reindexed_wires)] = self.sub_unitary()
+        return self.embed(self.sub_unitary())
+
+    def embed(self, sub_unitary, n_points=None):
+        """Mode unitary of the whole circuit containing sub_unitary, or a stack of them when n_points is given."""
+        shape = (self.backend.n_wires, self.backend.n_wires) if n_points is None else (n_points, self.backend.n_wires, self.backend.n_wires)
+        unitary = np.broadcast_to(np.eye(self.backend.n_wires, dtype=complex), shape).copy()
+        unitary[(Ellipsis,) + np.ix_(self.reindexed_wires, self.reindexed_wires)] = sub_unitary
         return unitary
     
     @abstractmethod
@@ -118,6 +258,10 @@ class PermanentComponent(Component):
         """Unitary operator in the subspace of the wires affected by the component."""
         raise NotImplementedError
 
+    def swept_sub_unitaries(self, values):
+        """Stack of sub-unitaries, one for each value of the component's swept parameter."""
+        raise NotImplementedError
+
 
 class PermanentBeamSplitter(PermanentComponent):
     def __init__(self, backend, *, wires, theta=90):
@@ -131,6 +275,9 @@ class PermanentBeamSplitter(PermanentComponent):
     def sub_unitary(self):
         return scipy.linalg.expm(1j*(self.theta/2)*spin_y_matrix(2))
 
+    def swept_sub_unitaries(self, values):
+        return hermitian_exponentials(spin_y_matrix(2), degrees_to_radians(values)/2)
+
 
 class PermanentSwitch(PermanentComponent):
     def __init__(self, backend, *, wires):
@@ -156,6 +303,9 @@ class PermanentPhaseShift(PermanentComponent):
     def sub_unitary(self):
         return np.exp(1j*self.phase)
 
+    def swept_sub_unitaries(self, values):
+        return np.exp(1j*degrees_to_radians(values)).reshape(-1, 1, 1)
+
 
 class PermanentLoss(PermanentComponent):
     def __init__(self, backend, *, wires, eta = 1):
@@ -169,6 +319,9 @@ class PermanentLoss(PermanentComponent):
 
     def apply(self):
         raise ValueError("Loss is not implemented yet in the permanent backend.")
+
+    def apply_sweep(self, values):
+        self.apply()
     
     def sub_unitary(self):
         pass
@@ -184,12 +337,13 @@ class PermanentDetector(PermanentComponent):
     def validate(self):
         self.validate_detector(self.wires, self.herald)
 
+    def heralded(self, occupations):
+        """Which rows of an occupation number array match the herald."""
+        return np.all(occupations[:, self.reindexed_wires] == self.herald, axis=1)
+
     def apply(self):
-        for rank in range(self.backend.hilbert_dimension):
-            basis_element = np.array(self.backend.rank_to_basis(rank))
-            keep = np.all(basis_element[self.reindexed_wires] == self.herald)
-            if not keep:
-                self.backend.output_probabilities[rank] = 0
+        occupations = fock_basis_array(self.backend.n_wires, self.backend.n_photons)
+        self.backend.output_probabilities[~self.heralded(occupations)] = 0
 
         if len(self.backend._occupied_ranks) == 0:
             raise ValueError("No population remaining.")
@@ -0,0 +1,159 @@
+"""
+Opt-in profiling of simulations. While a Profiler is attached to a backend, every component's apply() and every
+phase of a run is timed, along with the memory it allocated and the size of the simulation state afterwards.
+
+The profiler works by shadowing the methods it measures with instance attributes, which are removed when it is
+detached, so a backend that is not being profiled runs exactly the same code as before.
+"""
+
+import json
+import time
+import tracemalloc
+from collections import namedtuple
+import numpy as np
+
+class ProfileRecord(namedtuple("ProfileRecord", ["name", "category", "start", "seconds", "allocated_bytes", "state_bytes", "depth"])):
+    """
+    One measured call.
+
+    name (str): phase, or class of the component that was applied.
+    category (str): "phase" or "component".
+    start (float): seconds since the profiler was attached.
+    seconds (float): wall time of the call.
+    allocated_bytes (int): change in memory allocated by Python and NumPy during the call, or None if memory is not traced.
+    state_bytes (int): size of the backend's simulation state after the call.
+    depth (int): number of measured calls this one is nested in.
+    """
+    __slots__ = ()
+
+class Profiler:
+    """
+    Records a ProfileRecord for each measured call made by a backend. Use it as a context manager:
+
+        with circuit.profile() as profiler:
+            circuit.run()
+        print(profiler.report())
+
+    backend (BaseBackend): backend to profile.
+    callback (function): if given, called with each ProfileRecord as soon as its call returns.
+    trace_memory (bool): measure allocations with tracemalloc, which slows down the simulation.
+    """
+    def __init__(self, backend, callback=None, trace_memory=True):
+        self.backend = backend
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.records = []
+
+        self._origin = None
+        self._depth = 0
+        self._started_tracing = False
+        self._instrumented = []
+
+    def __enter__(self):
+        self.attach()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.detach()
+
+    def attach(self):
+        """Starts measuring the backend's calls."""
+        if self.backend.profiler is not None:
+            raise ValueError("Backend is already being profiled.")
+        self.backend.profiler = self
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._origin = time.perf_counter()
+
+        for phase in self.backend.profiled_phases:
+            setattr(self.backend, phase, self._measured(getattr(self.backend, phase), phase, "phase"))
+
+        # Components created while profiling, including compiled ones, are instrumented as they are created
+        create_component = self.backend.create_component
+        def create_instrumented_component(component_type, **kwargs):
+            component = create_component(component_type, **kwargs)
+            self._instrument(component)
+            return component
+        self.backend.create_component = create_instrumented_component
+
+        for component in self.backend.component_list:
+            self._instrument(component)
+
+    def detach(self):
+        """Stops measuring and restores the backend's methods."""
+        for name in self.backend.profiled_phases + ("create_component",):
+            self.backend.__dict__.pop(name, None)
+        for component in self._instrumented:
+            component.__dict__.pop("apply", None)
+        self._instrumented = []
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self.backend.profiler = None
+
+    def _instrument(self, component):
+        if "apply" not in component.__dict__:
+            component.apply = self._measured(component.apply, type(component).__name__, "component")
+            self._instrumented.append(component)
+
+    def _measured(self, method, name, category):
+        def measured_method(*args, **kwargs):
+            tracing = tracemalloc.is_tracing()
+            allocated = tracemalloc.get_traced_memory()[0] if tracing else None
+            depth = self._depth
+            self._depth += 1
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                self._depth = depth
+                if tracing:
+                    allocated = tracemalloc.get_traced_memory()[0] - allocated
+                self._record(ProfileRecord(name, category, start - self._origin, seconds, allocated, self.backend.state_nbytes(), depth))
+        return measured_method
+
+    def _record(self, record):
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def table(self):
+        """Structured array with one row per record, in the order the calls started."""
+        dtype = [("name", object), ("category", object), ("start", float), ("seconds", float), ("allocated_bytes", float), ("state_bytes", np.int64), ("depth", int)]
+        rows = [record._replace(allocated_bytes=np.nan if record.allocated_bytes is None else record.allocated_bytes) for record in self.records]
+        return np.sort(np.array([tuple(row) for row in rows], dtype=dtype), order="start", kind="stable")
+
+    def summary(self):
+        """Dict of {name: (calls, total seconds, total allocated bytes)}, for each phase and component class."""
+        summary = {}
+        for record in self.records:
+            calls, seconds, allocated = summary.get(record.name, (0, 0.0, 0))
+            summary[record.name] = (calls + 1, seconds + record.seconds, allocated + (record.allocated_bytes or 0))
+        return summary
+
+    def report(self):
+        """Text table of the summary, slowest first."""
+        lines = [f"{'name':<28} {'calls':>7} {'total ms':>11} {'allocated MiB':>14}"]
+        for name, (calls, seconds, allocated) in sorted(self.summary().items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<28} {calls:>7} {seconds*1e3:>11.3f} {allocated/2**20:>14.3f}")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """Records as Chrome trace events, which can be opened in chrome://tracing or Perfetto."""
+        events = []
+        for record in self.records:
+            args = {"state_bytes": record.state_bytes}
+            if record.allocated_bytes is not None:
+                args["allocated_bytes"] = record.allocated_bytes
+            events.append({"name": record.name, "cat": record.category, "ph": "X", "ts": record.start*1e6,
+                           "dur": record.seconds*1e6, "pid": 0, "tid": 0, "args": args})
+        events.sort(key=lambda event: event["ts"])
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"backend": type(self.backend).__name__}}
+
+    def save_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
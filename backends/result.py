@@ -0,0 +1,126 @@
+"""
+Output of a simulation, stored compactly as arrays. Labels and tables are only formatted when they are asked for.
+"""
+
+import functools
+import numpy as np
+from backends.utils import fill_table
+
+def _read_only(values, dtype):
+    array = np.array(values, dtype=dtype)
+    array.flags.writeable = False
+    return array
+
+def _group_sum(keys, weights):
+    """
+    Distinct keys in increasing order and the sum of weights for each. Keys are integers, or rows of integers.
+    Small non-negative integer keys are grouped with np.bincount in O(n), and others by sorting.
+    """
+    if keys.ndim == 1 and keys.dtype != object and len(keys) and keys.min() >= 0 and keys.max() < 4*len(keys) + 1024:
+        sums = np.bincount(keys, weights=weights)
+        present = np.bincount(keys) > 0
+        return np.nonzero(present)[0], sums[present]
+    unique, inverse = np.unique(keys, return_inverse=True, axis=0 if keys.ndim > 1 else None)
+    return unique, np.bincount(inverse.ravel(), weights=weights, minlength=len(unique))
+
+class Result:
+    """
+    Immutable result of a run: the ranks of the basis elements with nonzero probability, in rank order, and their
+    probabilities. The occupation numbers, labels and output table are derived on first use and kept. top_k and
+    above select part of a result, so only the selected basis elements are ever formatted.
+
+    ranks (array): ranks of the basis elements with nonzero probability.
+    probabilities (array): probability of each of those basis elements.
+    basis (FockBasis or QubitBasis): basis the ranks refer to.
+    """
+    def __init__(self, ranks, probabilities, basis):
+        # Ranks of more than 63 qubits are kept as Python integers
+        ranks = np.asarray(ranks)
+        self._ranks = _read_only(ranks, object if ranks.dtype == object else np.int64)
+        self._probabilities = _read_only(probabilities, float)
+        self._basis = basis
+
+        if self._ranks.shape != self._probabilities.shape:
+            raise ValueError("Result must have one probability per rank.")
+
+    @property
+    def ranks(self):
+        return self._ranks
+
+    @property
+    def probabilities(self):
+        return self._probabilities
+
+    @property
+    def basis(self):
+        return self._basis
+
+    def __len__(self):
+        return len(self._ranks)
+
+    def __repr__(self):
+        return f"Result({len(self)} nonzero basis elements)"
+
+    def top_k(self, k):
+        """Result containing the k most likely basis elements, most likely first. Ties are kept in rank order."""
+        if k < 0:
+            raise ValueError("k must not be negative.")
+        if k < len(self):
+            indices = np.argpartition(-self._probabilities, k - 1)[:k] if k > 0 else np.array([], dtype=int)
+        else:
+            indices = np.arange(len(self))
+        indices = indices[np.lexsort((indices, -self._probabilities[indices]))]
+        return self._select(indices)
+
+    def above(self, threshold):
+        """Result containing the basis elements with probability greater than threshold, in rank order."""
+        return self._select(np.nonzero(self._probabilities > threshold)[0])
+
+    def _select(self, indices):
+        return Result(self._ranks[indices], self._probabilities[indices], self._basis)
+
+    def marginal(self, wires):
+        """
+        Result on a subset of the wires, or qubits, summing the probabilities of the basis elements that agree on them.
+
+        wires (list): 1-indexed wires to keep, in the order they appear in the marginal's basis elements.
+        """
+        n_wires = self.occupations.shape[1]
+        if len(set(wires)) != len(wires) or not all(isinstance(w, (int, np.integer)) and 1 <= w <= n_wires for w in wires):
+            raise ValueError(f"Wires must be distinct integers between 1 and {n_wires}.")
+
+        basis = self._basis.subsystem(len(wires))
+        ranks, probabilities = _group_sum(basis.ranks(self.occupations[:, [w - 1 for w in wires]]), self._probabilities)
+        return Result(ranks, probabilities, basis)
+
+    def coarse_grain(self, fn):
+        """
+        Groups the basis elements by a property of their occupation numbers and sums the probability of each group.
+
+        fn (function): maps the occupation matrix, with one row per basis element, to an integer for each row, or
+        a row of integers. For example, lambda occupations: occupations[:, 2:4].sum(axis=1) gives the photon number
+        distribution on wires 3 and 4.
+
+        Returns the distinct values of fn in increasing order, and their probabilities.
+        """
+        keys = np.asarray(fn(self.occupations))
+        if len(keys) != len(self):
+            raise ValueError("fn must return one value for each basis element.")
+        return _group_sum(keys, self._probabilities)
+
+    @functools.cached_property
+    def occupations(self):
+        """Occupation numbers, or qubit states, of each basis element, one row per element."""
+        return _read_only(self._basis.occupations(self._ranks), int)
+
+    @functools.cached_property
+    def labels(self):
+        """String representation of each basis element, ex. '0101'."""
+        return tuple("".join(str(n) for n in row) for row in self.occupations.tolist())
+
+    @functools.cached_property
+    def table(self):
+        """2-column array containing the labels and their probabilities, as returned by get_output_data."""
+        table = fill_table(self.labels, self._probabilities.tolist())
+        table.flags.writeable = False
+        return table
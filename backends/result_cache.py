@@ -0,0 +1,203 @@
+"""
+Content-addressed cache of simulation results. A result is stored under a hash of everything that determines it,
+so rerunning an identical circuit returns the stored result instead of simulating it again. Results are kept in
+memory up to a byte budget, least recently used first out, and optionally in a directory of compressed .npz files
+indexed by an SQLite database, which persists between sessions.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple, OrderedDict
+import numpy as np
+from backends.utils import TOLERANCE
+
+class CachedResult(namedtuple("CachedResult", ["ranks", "probabilities", "seconds"])):
+    """Ranks of the nonzero basis elements and their probabilities, and how long the simulation took in seconds."""
+    __slots__ = ()
+
+    @property
+    def nbytes(self):
+        return self.ranks.nbytes + self.probabilities.nbytes
+
+def _update_hash(digest, value):
+    """Feeds a component argument to the hash in a form that does not depend on how it is stored in memory."""
+    if isinstance(value, (list, tuple)):
+        digest.update(b"(")
+        for v in value:
+            _update_hash(digest, v)
+        digest.update(b")")
+    elif isinstance(value, np.ndarray):
+        digest.update(f"array{value.dtype.str}{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    else:
+        digest.update(f"{type(value).__name__}:{value!r};".encode())
+
+def result_key(backend):
+    """
+    Canonical hash of a run: the backend class and its settings, the components and their parameters, the input
+    state and the tolerance below which probabilities are set to zero.
+    """
+    digest = hashlib.sha256()
+    backend_class = type(backend)
+    _update_hash(digest, f"{backend_class.__module__}.{backend_class.__qualname__}")
+    _update_hash(digest, [(name, getattr(backend, name)) for name in backend.cache_settings])
+    _update_hash(digest, [(op.component_type, op.params) for op in backend.operations])
+    _update_hash(digest, backend.input_basis_element)
+    _update_hash(digest, TOLERANCE)
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Cache shared by any number of backends, which use it when it is assigned to their cache attribute.
+
+    max_bytes (int): memory budget for the stored arrays.
+    directory (str): if given, results are also written to this directory and survive the session.
+    max_disk_bytes (int): budget for the files in directory. The least recently used are deleted first.
+    """
+    def __init__(self, max_bytes=2**28, directory=None, max_disk_bytes=2**30):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+        self._index = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            # The GUI runs circuits in a worker thread, so the connection is shared between threads under the lock
+            self._index = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+            self._index.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, bytes INTEGER, seconds REAL, last_used REAL)")
+            self._index.commit()
+
+    def key(self, backend):
+        return result_key(backend)
+
+    def get(self, key):
+        """Returns the CachedResult stored under key, or None, and counts the hit or miss."""
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+            elif self._index is not None:
+                result = self._load(key)
+                if result is not None:
+                    self._store_in_memory(key, result)
+
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.saved_seconds += result.seconds
+            return result
+
+    def put(self, key, ranks, probabilities, seconds):
+        """Stores the nonzero ranks and probabilities of a run that took seconds to simulate."""
+        result = CachedResult(self._frozen(ranks, np.int64), self._frozen(probabilities, float), seconds)
+        with self._lock:
+            self._store_in_memory(key, result)
+            if self._index is not None:
+                self._save(key, result)
+
+    def clear(self):
+        """Removes every stored result, from memory and from disk, and resets the statistics."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self._index is not None:
+                for (key,) in self._index.execute("SELECT key FROM results").fetchall():
+                    self._remove_file(key)
+                self._index.execute("DELETE FROM results")
+                self._index.commit()
+            self.hits = 0
+            self.misses = 0
+            self.saved_seconds = 0.0
+
+    @property
+    def stats(self):
+        """Hits, misses, simulation time saved by the hits, and the number and size of stored results."""
+        with self._lock:
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "saved_seconds": self.saved_seconds,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
+            if self._index is not None:
+                entries, disk_bytes = self._index.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM results").fetchone()
+                stats["disk_entries"] = entries
+                stats["disk_bytes"] = disk_bytes
+            return stats
+
+    def report(self):
+        """One-line summary of the statistics."""
+        stats = self.stats
+        return f"Result cache: {stats['hits']} hits, {stats['misses']} misses, {stats['saved_seconds']:.3g} s saved"
+
+    @staticmethod
+    def _frozen(values, dtype):
+        array = np.array(values, dtype=dtype)
+        array.flags.writeable = False
+        return array
+
+    # Memory tier
+
+    def _store_in_memory(self, key, result):
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key).nbytes
+        if result.nbytes > self.max_bytes:
+            return
+        self._memory[key] = result
+        self._memory_bytes += result.nbytes
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    # Disk tier
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def _load(self, key):
+        if self._index.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone() is None:
+            return None
+        try:
+            with np.load(self._path(key)) as data:
+                result = CachedResult(self._frozen(data["ranks"], np.int64), self._frozen(data["probabilities"], float), float(data["seconds"]))
+        except (OSError, KeyError, ValueError):
+            # The file is missing or damaged, so forget it and simulate again
+            self._index.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._index.commit()
+            return None
+        self._index.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._index.commit()
+        return result
+
+    def _save(self, key, result):
+        path = self._path(key)
+        np.savez_compressed(path, ranks=result.ranks, probabilities=result.probabilities, seconds=result.seconds)
+        self._index.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, os.path.getsize(path), result.seconds, time.time()))
+
+        total_bytes = self._index.execute("SELECT COALESCE(SUM(bytes), 0) FROM results").fetchone()[0]
+        for evicted_key, size in self._index.execute("SELECT key, bytes FROM results ORDER BY last_used").fetchall():
+            if total_bytes <= self.max_disk_bytes:
+                break
+            self._index.execute("DELETE FROM results WHERE key = ?", (evicted_key,))
+            self._remove_file(evicted_key)
+            total_bytes -= size
+        self._index.commit()
+
+    def _remove_file(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
@@ -1,3 +1,4 @@
+import functools
 import itertools
 import math
 import numpy as np
@@ -13,6 +14,32 @@ def rank_to_fock_basis(n_wires, n_photons, rank):
         element[mode] += 1
     return tuple(element)
 
+@functools.lru_cache(maxsize=32)
+def fock_basis_array(n_wires, n_photons):
+    """
+    Occupation numbers of every Fock basis element with up to n_photons photons, as an array with one row
+    per element, in rank order. The array is cached, so it is read-only.
+    """
+    blocks = [block for n_p in range(n_photons + 1) for block in fock_basis_chunks(n_wires, n_p, fock_hilbert_dimension_fixed_number(n_wires, n_p))]
+    occupations = np.concatenate(blocks)
+    occupations.flags.writeable = False
+    return occupations
+
+def fock_basis_chunks(n_wires, n_photons, chunk_size):
+    """
+    Occupation numbers of the Fock basis elements with exactly n_photons photons, in rank order, as arrays of up
+    to chunk_size rows. Each chunk is generated when it is needed, so the whole basis is never held in memory.
+    """
+    mode_lists = itertools.combinations_with_replacement(range(n_wires), n_photons)
+    while True:
+        chunk = np.array(list(itertools.islice(mode_lists, chunk_size)), dtype=int)
+        if len(chunk) == 0:
+            return
+        chunk = chunk.reshape(len(chunk), n_photons)
+        block = np.zeros((len(chunk), n_wires), dtype=int)
+        np.add.at(block, (np.repeat(np.arange(len(chunk)), n_photons), chunk.ravel()), 1)
+        yield block
+
 def fock_basis_to_rank(element):
     n_photons = int(sum(element))
     n_wires = len(element)
@@ -22,6 +49,44 @@ def fock_basis_to_rank(element):
         rank += sum(math.comb(n_pp + remaining_modes - 1, n_pp) for n_pp in range(int(remaining_photons)))
     return rank
 
+def fock_ranks(occupations):
+    """fock_basis_to_rank for every row of an array of occupation numbers, vectorized over the rows."""
+    occupations = np.asarray(occupations, dtype=np.int64)
+    n_wires = occupations.shape[1]
+    photons = occupations.sum(axis=1)
+    max_photons = int(photons.max()) if len(photons) else 0
+
+    # states_below[m - 1, r] is the number of ways to put fewer than r photons in m wires
+    states_below = np.array([[sum(math.comb(n_p + m - 1, n_p) for n_p in range(r)) for r in range(max_photons + 1)] for m in range(1, n_wires + 1)], dtype=np.int64)
+
+    ranks = states_below[n_wires - 1, photons]
+    used_photons = np.cumsum(occupations, axis=1)
+    for wire, remaining_modes in enumerate(reversed(range(1, n_wires))):
+        ranks += states_below[remaining_modes - 1, photons - used_photons[:, wire]]
+    return ranks
+
+def fock_unrank(n_wires, n_photons, ranks):
+    """
+    Occupation numbers of the Fock basis elements with the given ranks, one row per rank. This is the inverse of
+    fock_ranks: the photon number, and then the photons left after each wire, are the largest whose number of
+    basis elements below them fits in the rank, so only the requested rows are built.
+    """
+    ranks = np.asarray(ranks, dtype=np.int64).reshape(-1)
+
+    # states_below[m - 1, r] is the number of ways to put fewer than r photons in m wires
+    states_below = np.array([[math.comb(r + m - 1, m) for r in range(n_photons + 2)] for m in range(1, n_wires + 1)], dtype=np.int64)
+
+    photons = np.searchsorted(states_below[n_wires - 1], ranks, side="right") - 1
+    remainder = ranks - states_below[n_wires - 1, photons]
+    occupations = np.zeros((len(ranks), n_wires), dtype=int)
+    for wire, remaining_modes in enumerate(reversed(range(1, n_wires))):
+        remaining_photons = np.searchsorted(states_below[remaining_modes - 1], remainder, side="right") - 1
+        remainder -= states_below[remaining_modes - 1, remaining_photons]
+        occupations[:, wire] = photons - remaining_photons
+        photons = remaining_photons
+    occupations[:, -1] = photons
+    return occupations
+
 def fock_hilbert_dimension(n_wires, n_photons):
     """Total Hilbert space dimension, including all photon numbers up to n_photons."""
     return sum(fock_hilbert_dimension_fixed_number(n_wires, n) for n in range(n_photons + 1))
@@ -38,6 +103,12 @@ def spin_y_matrix(size):
             sy[a, b] = 1j*(int(a == (b+1)) - int((a+1) == b)) * np.sqrt(((size + 1)/2)*(a+b+1) - (a+1)*(b+1))
     return sy
 
+def hermitian_exponentials(matrix, coefficients):
+    """Stack of exp(1j*c*matrix) for each c in coefficients, from a single eigendecomposition of the Hermitian matrix."""
+    eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+    phases = np.exp(1j*np.multiply.outer(coefficients, eigenvalues))
+    return (eigenvectors * phases[..., None, :]) @ np.conjugate(eigenvectors).T
+
 def degrees_to_radians(deg):
     return (np.pi/180)*deg
 
@@ -63,10 +134,40 @@ def pauli_y():
 def pauli_z():
     return np.array([[1, 0], [0, -1]], dtype=complex)
 
+def hadamard():
+    return (1/np.sqrt(2))*np.array([[1, 1], [1, -1]], dtype=complex)
+
+def cnot():
+    """CNOT in the basis |control, target>."""
+    return np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]], dtype=complex)
+
 def insert_gate(gate, qubit, n_qubits):
     """Inserts a 2x2 matrix acting on a specific qubit into the N-qubit product space"""
     return np.kron(np.kron(np.eye(2**qubit), gate), np.eye(2**(n_qubits-qubit-1)))
 
+def apply_local_gate(density_matrix, gate, qubits, n_qubits):
+    """
+    Applies a 2^k x 2^k gate acting on k specific qubits to an N-qubit density matrix,
+    by contracting the gate with the targeted tensor axes only. The full-space operator is never built.
+    """
+    n_targets = len(qubits)
+    gate_tensor = gate.reshape((2,)*2*n_targets)
+    input_axes = list(range(n_targets, 2*n_targets))
+    row_axes = list(qubits)
+    column_axes = [n_qubits + q for q in qubits]
+
+    rho = density_matrix.reshape((2,)*2*n_qubits)
+
+    # U rho: contract the gate inputs with the row axes, then put the new axes back in place
+    rho = np.tensordot(gate_tensor, rho, axes=(input_axes, row_axes))
+    rho = np.moveaxis(rho, list(range(n_targets)), row_axes)
+
+    # rho U^dagger: contract the conjugate gate inputs with the column axes
+    rho = np.tensordot(rho, np.conjugate(gate_tensor), axes=(column_axes, input_axes))
+    rho = np.moveaxis(rho, list(range(2*n_qubits - n_targets, 2*n_qubits)), column_axes)
+
+    return rho.reshape((2**n_qubits, 2**n_qubits))
+
 def tuple_to_str(tup):
     """Convert a basis element into a string."""
     return str(tup).translate(str.maketrans("", "", " (),|>"))
@@ -75,6 +176,9 @@ def fill_table(col1, col2):
     """Combines two columns of data into a 2-column array."""
     return np.array(list(zip(col1, col2)), dtype=object)
 
-def eliminate_tolerance(mat, tol=1E-10):
+# Magnitude below which amplitudes and probabilities are set to zero
+TOLERANCE = 1E-10
+
+def eliminate_tolerance(mat, tol=TOLERANCE):
     mat[np.abs(mat) < tol] = 0
     return mat
\ No newline at end of file
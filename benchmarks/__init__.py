@@ -0,0 +1,6 @@
+"""
+Scaling benchmarks of the backends. Run python -m benchmarks --help for the command line options.
+"""
+
+from benchmarks.scenarios import Scenario, SCENARIOS
+from benchmarks.runner import measure, run_scenario, run_benchmarks, compare
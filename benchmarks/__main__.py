@@ -0,0 +1,79 @@
+"""
+Command line interface of the benchmarks.
+
+    python -m benchmarks run --scenario mmi hom --repeats 5 --output results.json
+    python -m benchmarks run --baseline baseline.json
+    python -m benchmarks compare results.json baseline.json
+
+The exit status is 1 when a comparison finds a regression.
+"""
+
+import argparse
+import json
+import sys
+from benchmarks.scenarios import SCENARIOS, PHOTONIC_BACKENDS, GATEBASED_BACKENDS
+from benchmarks.runner import run_benchmarks, compare, format_size
+
+def print_regressions(regressions, threshold):
+    if not regressions:
+        print(f"No regressions above {threshold:.0%}.")
+        return
+    print(f"{len(regressions)} regressions above {threshold:.0%}:")
+    for record, baseline_record, ratio in regressions:
+        if record["status"] == "ok":
+            change = f"{baseline_record['median_seconds']*1e3:.3f} ms -> {record['median_seconds']*1e3:.3f} ms ({ratio:.2f}x)"
+        else:
+            change = f"{baseline_record['median_seconds']*1e3:.3f} ms -> {record['status']}"
+        print(f"  {record['scenario']} {record['backend']} {format_size(record['size'])}: {change}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Scaling benchmarks of the backends.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run scenarios and write the results as JSON")
+    run_parser.add_argument("--scenario", nargs="+", choices=list(SCENARIOS), help="scenarios to run (default: all)")
+    run_parser.add_argument("--backend", nargs="+", choices=PHOTONIC_BACKENDS + GATEBASED_BACKENDS, help="backends to run (default: all available)")
+    run_parser.add_argument("--warmup", type=int, default=1, help="untimed runs before timing (default: 1)")
+    run_parser.add_argument("--repeats", type=int, default=5, help="timed runs of each circuit (default: 5)")
+    run_parser.add_argument("--timeout", type=float, default=60, help="seconds allowed per run before larger sizes are skipped (default: 60)")
+    run_parser.add_argument("--max-sizes", type=int, help="only run the first sizes of each scenario")
+    run_parser.add_argument("--output", help="file to write the results to")
+    run_parser.add_argument("--baseline", help="results file to compare with")
+    run_parser.add_argument("--threshold", type=float, default=0.25, help="slowdown counted as a regression (default: 0.25)")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("results", help="results file")
+    compare_parser.add_argument("baseline", help="results file to compare with")
+    compare_parser.add_argument("--threshold", type=float, default=0.25, help="slowdown counted as a regression (default: 0.25)")
+
+    subparsers.add_parser("list", help="list the scenarios")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for scenario in SCENARIOS.values():
+            sizes = "; ".join(format_size(size) for size in scenario.sizes)
+            print(f"{scenario.name:<10} {scenario.description} ({scenario.simulation_type}): {sizes}")
+        return 0
+
+    if args.command == "run":
+        results = run_benchmarks(args.scenario, args.backend, args.warmup, args.repeats, args.timeout, args.max_sizes)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        if not args.baseline:
+            return 0
+        baseline_file = args.baseline
+    else:
+        with open(args.results) as f:
+            results = json.load(f)
+        baseline_file = args.baseline
+
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    print_regressions(regressions, args.threshold)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
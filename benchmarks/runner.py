@@ -0,0 +1,170 @@
+"""
+Runs benchmark scenarios and compares results with a baseline.
+
+Each scenario and backend pair runs in its own process, which goes through the sizes from smallest to largest. A
+size that takes longer than the timeout stops the process, and the larger sizes are skipped.
+"""
+
+import multiprocessing
+import platform
+import queue
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+import backends
+from benchmarks.scenarios import SCENARIOS
+
+# Time allowed for a worker process to import its backend, in seconds
+IMPORT_TIMEOUT = 300
+
+def measure(scenario, backend_class, size, warmup=1, repeats=5):
+    """
+    Times circuit.run() for one size of a scenario. The circuit is built once and the input state is set before
+    every run. Peak memory is measured with tracemalloc in one extra run, so it does not slow down the timed runs.
+    """
+    record = {"size": size}
+    try:
+        circuit, input_state = scenario.build(backend_class, **size)
+
+        for _ in range(warmup):
+            circuit.set_input_state(input_state)
+            circuit.run()
+
+        times = []
+        for _ in range(repeats):
+            circuit.set_input_state(input_state)
+            start = time.perf_counter()
+            circuit.run()
+            times.append(time.perf_counter() - start)
+
+        circuit.set_input_state(input_state)
+        tracemalloc.start()
+        try:
+            circuit.run()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    except Exception as e:
+        record.update(status="error", message=f"{type(e).__name__}: {e}")
+        return record
+
+    record.update(status="ok", times=times, median_seconds=statistics.median(times), min_seconds=min(times), peak_memory_bytes=peak_memory)
+    return record
+
+def _worker(scenario_name, backend_name, warmup, repeats, results):
+    """Runs every size of a scenario on one backend, putting each record on the results queue."""
+    scenario = SCENARIOS[scenario_name]
+    backend_class = getattr(backends, backend_name)
+    results.put("ready")
+    for size in scenario.sizes:
+        results.put(measure(scenario, backend_class, size, warmup, repeats))
+
+def _wait_until_ready(process, results):
+    """
+    Waits for the worker to import its backend. Returns False if it exits first, for example because an installed
+    package is broken, or if it takes longer than IMPORT_TIMEOUT.
+    """
+    deadline = time.monotonic() + IMPORT_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            results.get(timeout=1)
+            return True
+        except queue.Empty:
+            if not process.is_alive():
+                return False
+    return False
+
+def run_scenario(scenario, backend_name, warmup=1, repeats=5, timeout=60, max_sizes=None):
+    """Returns a list of records, one for each size of the scenario, measured in a separate process."""
+    sizes = scenario.sizes[:max_sizes]
+    records = []
+
+    if not backends.is_available(backend_name):
+        return [{"size": size, "status": "unavailable"} for size in sizes]
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_worker, args=(scenario.name, backend_name, warmup, repeats, results), daemon=True)
+    process.start()
+    try:
+        if not _wait_until_ready(process, results):
+            records = [{"size": size, "status": "error", "message": "import failed"} for size in sizes]
+        else:
+            for size in sizes:
+                try:
+                    records.append(results.get(timeout=timeout*(warmup + repeats + 1)))
+                except queue.Empty:
+                    records.append({"size": size, "status": "timeout"})
+                    break
+    finally:
+        process.terminate()
+        process.join()
+
+    records += [{"size": size, "status": "skipped"} for size in sizes[len(records):]]
+    for record in records:
+        record.update(scenario=scenario.name, backend=backend_name)
+    return records
+
+def run_benchmarks(scenario_names=None, backend_names=None, warmup=1, repeats=5, timeout=60, max_sizes=None, progress=print):
+    """Runs scenarios on every available backend, or the given ones, and returns the results as a JSON-serializable dict."""
+    records = []
+    for scenario_name in scenario_names or list(SCENARIOS):
+        scenario = SCENARIOS[scenario_name]
+        for backend_name in scenario.backends:
+            if backend_names and backend_name not in backend_names:
+                continue
+            for record in run_scenario(scenario, backend_name, warmup, repeats, timeout, max_sizes):
+                records.append(record)
+                if progress:
+                    progress(format_record(record))
+
+    return {
+        "metadata": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "warmup": warmup,
+            "repeats": repeats,
+            "timeout": timeout,
+        },
+        "results": records,
+    }
+
+def format_size(size):
+    return ", ".join(f"{name}={value}" for name, value in size.items())
+
+def format_record(record):
+    line = f"{record['scenario']:<10} {record['backend']:<18} {format_size(record['size']):<22} {record['status']:<11}"
+    if record["status"] == "ok":
+        line += f" {record['median_seconds']*1e3:10.3f} ms {record['peak_memory_bytes']/2**20:10.2f} MiB"
+    elif "message" in record:
+        line += f" {record['message']}"
+    return line
+
+def _key(record):
+    return record["scenario"], record["backend"], tuple(sorted(record["size"].items()))
+
+def compare(results, baseline, threshold=0.25, min_seconds=1e-3):
+    """
+    Compares the median times of results with a baseline. Returns a list of (record, baseline_record, ratio) for
+    every case that was at least threshold slower, ignoring differences below min_seconds, which are noise.
+    Cases that ran in the baseline but no longer finish are also regressions, with a ratio of infinity.
+    """
+    baseline_records = {_key(record): record for record in baseline["results"] if record["status"] == "ok"}
+    regressions = []
+    for record in results["results"]:
+        baseline_record = baseline_records.get(_key(record))
+        if baseline_record is None:
+            continue
+        if record["status"] != "ok":
+            if record["status"] in ("error", "timeout"):
+                regressions.append((record, baseline_record, float("inf")))
+            continue
+        ratio = record["median_seconds"]/baseline_record["median_seconds"]
+        if ratio > 1 + threshold and record["median_seconds"] - baseline_record["median_seconds"] > min_seconds:
+            regressions.append((record, baseline_record, ratio))
+    return regressions
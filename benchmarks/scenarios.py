@@ -0,0 +1,85 @@
+"""
+Benchmark scenarios. Each scenario is a family of circuits of increasing size, built the same way in every backend.
+"""
+
+PHOTONIC_BACKENDS = ["FockBackend", "PermanentBackend", "MrMustardBackend", "PercevalBackend"]
+GATEBASED_BACKENDS = ["MPBackend", "QiskitBackend", "StabilizerBackend"]
+
+class Scenario:
+    """
+    name (str): name used on the command line and in the results.
+    description (str): what the circuits are.
+    simulation_type (str): "photonic" or "gatebased", which decides the backends it runs on.
+    sizes (list): dicts of keyword arguments for build, from smallest to largest.
+    build (function): build(backend_class, **size) returns (circuit, input_state), with every component added.
+    """
+    def __init__(self, name, description, simulation_type, sizes, build):
+        self.name = name
+        self.description = description
+        self.simulation_type = simulation_type
+        self.sizes = sizes
+        self.build = build
+
+    @property
+    def backends(self):
+        return PHOTONIC_BACKENDS if self.simulation_type == "photonic" else GATEBASED_BACKENDS
+
+def mmi_wire_pairs(n_wires):
+    """Beam splitter connections for a symmetric multi-mode interferometer, which couples each input to each output with equal probability."""
+    if n_wires % 2 != 0 or n_wires < 1:
+        raise ValueError("A symmetric MMI needs an even number of wires.")
+    wire_pairs = [[wire + 1, wire + 2] for wire in range(0, n_wires, 2)]
+    wire_pairs += [[wire + 1, wire + 2] for wire in range(1, n_wires - 1, 2)]
+    if n_wires > 2:
+        wire_pairs.append([1, n_wires])
+    return wire_pairs
+
+def build_mmi(backend, wires, photons):
+    """MMI with one photon in each of the first wires."""
+    circuit = backend(n_wires = wires, n_photons = photons)
+    for wire_pair in mmi_wire_pairs(wires):
+        circuit.add_beamsplitter(wires = wire_pair)
+    return circuit, (1,)*photons + (0,)*(wires - photons)
+
+def build_hom(backend, photons):
+    """Hong-Ou-Mandel interference of photons in each input of a balanced beam splitter."""
+    circuit = backend(n_wires = 2, n_photons = 2*photons)
+    circuit.add_beamsplitter(wires = [1, 2])
+    return circuit, (photons, photons)
+
+def build_lossy_mmi(backend, wires, photons):
+    """MMI followed by 10% loss on every wire."""
+    circuit, input_state = build_mmi(backend, wires, photons)
+    for wire in range(1, wires + 1):
+        circuit.add_loss(wires = [wire], eta = 0.9)
+    return circuit, input_state
+
+def build_heralded_mmi(backend, wires, photons):
+    """MMI with a detector heralding no photons in the last wire."""
+    circuit, input_state = build_mmi(backend, wires, photons)
+    circuit.add_detector(wires = [wires], herald = [0])
+    return circuit, input_state
+
+def build_clifford(backend, qubits):
+    """GHZ state followed by a layer of Pauli gates and a Hadamard, which only contains Clifford gates."""
+    circuit = backend(n_qubits = qubits)
+    circuit.add_hadamard(qubits = [1])
+    for qubit in range(1, qubits):
+        circuit.add_cnot(qubits = [qubit, qubit + 1])
+    for qubit in range(1, qubits + 1):
+        [circuit.add_xgate, circuit.add_ygate, circuit.add_zgate][qubit % 3](qubits = [qubit])
+    circuit.add_hadamard(qubits = [qubits])
+    return circuit, (0,)*qubits
+
+SCENARIOS = {scenario.name: scenario for scenario in [
+    Scenario("mmi", "Symmetric multi-mode interferometer", "photonic",
+             [{"wires": wires, "photons": wires//2} for wires in [2, 4, 6, 8, 10, 12]], build_mmi),
+    Scenario("hom", "Hong-Ou-Mandel interference of n photons per input", "photonic",
+             [{"photons": photons} for photons in [1, 2, 4, 8, 16]], build_hom),
+    Scenario("lossy", "Symmetric multi-mode interferometer with loss", "photonic",
+             [{"wires": wires, "photons": wires//2} for wires in [2, 4, 6, 8]], build_lossy_mmi),
+    Scenario("heralded", "Symmetric multi-mode interferometer with a heralding detector", "photonic",
+             [{"wires": wires, "photons": wires//2} for wires in [2, 4, 6, 8, 10]], build_heralded_mmi),
+    Scenario("clifford", "GHZ state and a layer of Clifford gates", "gatebased",
+             [{"qubits": qubits} for qubits in [2, 4, 8, 12, 16, 20, 24]], build_clifford),
+]}
@@ -2,11 +2,21 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import json
+import subprocess
+import tracemalloc
 import pytest
 import numpy as np
-from backends import FockBackend, PermanentBackend, MrMustardBackend, PercevalBackend, MPBackend, QiskitBackend
+from functools import partial
+from backends import FockBackend, PermanentBackend, MrMustardBackend, PercevalBackend, MPBackend, QiskitBackend, StabilizerBackend, AutoPhotonicBackend, AutoGateBasedBackend
+from backends.gatebased import qiskit_backend, statevector_kernels
+from backends.result_cache import ResultCache
+from backends.cost_model import CircuitFeatures
+from backends.basis import FockBasis
+from backends.result import Result
 
 photonic_backends = [FockBackend, PermanentBackend, MrMustardBackend, PercevalBackend]
+gatebased_backends = [MPBackend, partial(MPBackend, method = "statevector"), QiskitBackend, StabilizerBackend]
 
 # PHOTONIC CIRCUIT TESTS
 
@@ -56,4 +66,816 @@ def test_mzi():
 
         # test probabilities
         probs = [float(p) for p in output_data[:, 1]]
-        assert np.all(np.isclose(probs, [1], atol=1e-10))
\ No newline at end of file
+        assert np.all(np.isclose(probs, [1], atol=1e-10))
+
+def test_herald():
+    # Perceval renormalizes the heralded output, so it is not compared here
+    for backend in [FockBackend, PermanentBackend, MrMustardBackend]:
+        circuit = backend(n_wires = 3, n_photons = 2)
+        circuit.set_input_state((1, 1, 0))
+        circuit.add_beamsplitter(wires = [1, 2], theta = 60)
+        circuit.add_beamsplitter(wires = [2, 3])
+        circuit.add_detector(wires = [3], herald = [0])
+        circuit.run()
+        output_data = circuit.get_output_data()
+
+        # test labels
+        assert np.all(output_data[:, 0] == ["200", "110", "020"])
+
+        # test probabilities
+        probs = [float(p) for p in output_data[:, 1]]
+        assert np.all(np.isclose(probs, [0.375, 0.125, 0.09375], atol=1e-10))
+
+def test_perceval_herald_input():
+    # Perceval heralds the input of a detected wire too, so a different input photon number is refused
+    circuit = PercevalBackend(n_wires = 3, n_photons = 1)
+    circuit.set_input_state((1, 0, 0))
+    phaseshift = circuit.add_phaseshift(wires = [1])
+    circuit.add_beamsplitter(wires = [1, 3])
+    circuit.add_detector(wires = [2], herald = [1])
+    for run in [circuit.run, partial(circuit.run_many, [(1, 0, 0)]), partial(circuit.run_sweep, {phaseshift: [0, 90]})]:
+        with pytest.raises(ValueError, match = "heralds"):
+            run()
+
+    circuit.set_input_state((0, 1, 0))
+    result = circuit.run()
+    assert result.labels == ("010",)
+    assert np.allclose(circuit.run_many([(0, 1, 0)]), [[0, 0, 1, 0]])
+
+def test_perceval_simulators():
+    outputs = []
+    for simulator in ["SLOS", "Naive", "MPS"]:
+        # MPS truncates the bond dimension, which is exact for three wires
+        circuit = PercevalBackend(n_wires = 3, n_photons = 2, simulator = simulator)
+        circuit.set_input_state((1, 1, 0))
+        circuit.add_beamsplitter(wires = [1, 2], theta = 60)
+        circuit.add_beamsplitter(wires = [3, 1])
+        circuit.add_phaseshift(wires = [3], phase = 45)
+        circuit.add_beamsplitter(wires = [2, 3])
+        circuit.run()
+        outputs.append(circuit.get_output_data())
+
+    for output_data in outputs[1:]:
+        assert np.all(output_data[:, 0] == outputs[0][:, 0])
+        assert np.allclose(output_data[:, 1].astype(float), outputs[0][:, 1].astype(float), atol=1e-10)
+
+    # MPS does not support loss
+    circuit = PercevalBackend(n_wires = 3, n_photons = 2, simulator = "MPS")
+    circuit.set_input_state((1, 1, 0))
+    circuit.add_loss(wires = [2], eta = 0.7)
+    with pytest.raises(ValueError):
+        circuit.run()
+
+def test_perceval_composed_unitary():
+    # consecutive beam splitters, phase shifts and switches are given to Perceval as one unitary
+    for simulator in ["SLOS", "Naive"]:
+        for herald in [False, True]:
+            circuits = [PercevalBackend(n_wires = 4, n_photons = 2, simulator = simulator), PermanentBackend(n_wires = 4, n_photons = 2)]
+            for circuit in circuits:
+                circuit.set_input_state((1, 1, 0, 0))
+                circuit.add_beamsplitter(wires = [1, 2], theta = 60)
+                circuit.add_phaseshift(wires = [2], phase = 45)
+                circuit.add_switch(wires = [2, 3])
+                circuit.add_beamsplitter(wires = [3, 4], theta = 30)
+                circuit.add_phaseshift(wires = [1], phase = 120)
+                circuit.add_beamsplitter(wires = [1, 2])
+                circuit.add_beamsplitter(wires = [2, 4], theta = 75)
+                if herald:
+                    circuit.add_detector(wires = [4], herald = [0])
+            perceval, permanent = [circuit.run() for circuit in circuits]
+
+            # Perceval renormalizes the heralded output
+            assert np.all(perceval.ranks == permanent.ranks)
+            assert np.allclose(perceval.probabilities, permanent.probabilities/permanent.probabilities.sum(), atol=1e-10)
+
+def test_mr_mustard_cutoffs():
+    n_wires = 8
+    circuit = MrMustardBackend(n_wires = n_wires, n_photons = n_wires)
+    circuit.set_input_state((1, 1) + (0,)*(n_wires - 2))
+
+    # each mode only needs room for the two input photons
+    assert circuit.tensor_size["cutoffs"] == [3]*n_wires
+    assert circuit.tensor_size["entries"] == 3**n_wires
+
+    for wire in range(1, n_wires):
+        circuit.add_beamsplitter(wires = [wire, wire + 1])
+    circuit.run()
+    probs = [float(p) for p in circuit.get_output_data()[:, 1]]
+    assert np.isclose(sum(probs), 1, atol=1e-10)
+
+    # the cutoff must fit the input photons, and the tensor must fit the memory limit
+    with pytest.raises(ValueError):
+        MrMustardBackend(n_wires = 2, n_photons = 2, cutoff = 2).set_input_state((1, 1))
+    with pytest.raises(ValueError):
+        MrMustardBackend(n_wires = 40, n_photons = 2).set_input_state((1, 1) + (0,)*38)
+
+def test_mr_mustard_math_backend():
+    circuit = MrMustardBackend(n_wires = 2, n_photons = 2)
+    circuit.set_input_state((1, 1))
+    circuit.add_beamsplitter(wires = [1, 2])
+    circuit.run()
+    assert circuit.math_backend == "numpy"
+    assert np.all(circuit.get_output_data()[:, 0] == ["20", "02"])
+
+    # Mr Mustard can't switch math backends once it has been used
+    with pytest.raises(ValueError):
+        MrMustardBackend(n_wires = 2, n_photons = 2, math_backend = "tensorflow")
+    with pytest.raises(ValueError):
+        MrMustardBackend(n_wires = 2, n_photons = 2, math_backend = "jax")
+
+def test_perceval_rerun():
+    circuit = PercevalBackend(n_wires = 2, n_photons = 1)
+    circuit.add_beamsplitter(wires = [1, 2])
+    circuit.set_input_state((1, 0))
+    circuit.run()
+    processor = circuit.circuit
+
+    # changing the input reuses the compiled processor
+    circuit.set_input_state((0, 1))
+    circuit.run()
+    assert circuit.circuit is processor
+    assert np.allclose(circuit.get_output_data()[:, 1].astype(float), [0.5, 0.5], atol=1e-10)
+
+    # sampling estimates the same distribution
+    circuit.shots = 2000
+    circuit.run()
+    assert circuit.circuit is processor
+    assert np.allclose(circuit.get_output_data()[:, 1].astype(float), [0.5, 0.5], atol=0.1)
+
+def test_photonic_compiled_execution():
+    for backend in photonic_backends:
+        circuit = backend(n_wires = 3, n_photons = 2)
+        circuit.add_beamsplitter(wires = [1, 2], theta = 60)
+        circuit.add_phaseshift(wires = [2], phase = 45)
+        circuit.add_beamsplitter(wires = [2, 3])
+
+        # the IR can be compiled by a different instance, then executed for many inputs
+        executor = backend(n_wires = 3, n_photons = 2)
+        compiled = executor.compile(circuit.ir)
+        for input_state in [(1, 1, 0), (0, 1, 1), (2, 0, 0)]:
+            output_data = executor.execute(compiled, input_state)
+            circuit.set_input_state(input_state)
+            circuit.run()
+            assert np.all(output_data == circuit.get_output_data())
+
+        # compiled circuits belong to the backend that compiled them
+        with pytest.raises(ValueError):
+            circuit.execute(compiled, (1, 1, 0))
+
+def test_run_many():
+    input_states = [(2, 0, 0), (1, 1, 0), (1, 0, 1), (0, 2, 0), (0, 1, 1), (0, 0, 2)]
+    for backend in photonic_backends:
+        circuit = backend(n_wires = 3, n_photons = 2)
+        circuit.add_beamsplitter(wires = [1, 2], theta = 60)
+        circuit.add_phaseshift(wires = [2], phase = 30)
+        circuit.add_beamsplitter(wires = [2, 3])
+        probabilities = circuit.run_many(input_states)
+        assert probabilities.shape == (len(input_states), circuit.hilbert_dimension)
+
+        # each row matches running that input state on its own
+        for row, input_state in zip(probabilities, input_states):
+            circuit.set_input_state(input_state)
+            circuit.run()
+            assert np.allclose(row, circuit._probabilities, atol=1e-10)
+
+        # the batch leaves the input state and output of the last run as they were
+        circuit.set_input_state((0, 1, 1))
+        expected = circuit.run()
+        circuit.run_many(input_states[:2])
+        assert circuit.input_basis_element == (0, 1, 1)
+        assert circuit.result is expected
+        assert np.allclose(circuit._probabilities[expected.ranks], expected.probabilities, atol=1e-10)
+        circuit.run_many(input_states[:2])
+        circuit.set_input_state((0, 1, 1))
+        assert np.allclose(circuit.run().probabilities, expected.probabilities, atol=1e-10)
+
+    # the unitary of the last run still matches its output after other circuits are composed
+    circuit = PermanentBackend(n_wires = 2, n_photons = 1)
+    circuit.set_input_state((1, 0))
+    circuit.add_beamsplitter(wires = [1, 2], theta = 60)
+    circuit.run()
+    circuit_unitary = circuit.circuit_unitary.copy()
+    circuit.add_phaseshift(wires = [1], phase = 90)
+    circuit.run_many([(0, 1)])
+    circuit.compile(circuit.ir)
+    assert np.array_equal(circuit.circuit_unitary, circuit_unitary)
+
+    # state changed in place inside preserving_state is restored
+    circuit = FockBackend(n_wires = 2, n_photons = 1)
+    circuit.set_input_state((1, 0))
+    density_matrix = circuit.density_matrix.copy()
+    with circuit.preserving_state():
+        circuit.density_matrix[:] = 0
+    assert np.array_equal(circuit.density_matrix, density_matrix)
+
+def test_batch_herald():
+    # the switch moves the photon onto the heralded wire, so every outcome of (1, 0) is heralded out, as in run()
+    for backend in photonic_backends + [AutoPhotonicBackend]:
+        circuit = backend(n_wires = 2, n_photons = 1)
+        phaseshift = circuit.add_phaseshift(wires = [1])
+        circuit.add_switch(wires = [1, 2])
+        circuit.add_detector(wires = [2], herald = [0])
+        assert np.allclose(circuit.run_many([(0, 0)]), [[1, 0, 0]])
+        with pytest.raises(ValueError, match = "No population remaining"):
+            circuit.run_many([(0, 0), (1, 0)])
+        circuit.set_input_state((1, 0))
+        with pytest.raises(ValueError, match = "No population remaining"):
+            circuit.run_sweep({phaseshift: [0, 90]})
+        circuit.set_input_state((1, 0))
+        with pytest.raises(ValueError, match = "No population remaining"):
+            circuit.run()
+
+def test_run_sweep():
+    phases = np.linspace(0, 180, 5)
+    for backend in photonic_backends:
+        circuit = backend(n_wires = 2, n_photons = 1)
+        circuit.set_input_state((1, 0))
+        circuit.add_beamsplitter(wires = [1, 2])
+        phaseshift = circuit.add_phaseshift(wires = [1])
+        circuit.add_beamsplitter(wires = [1, 2])
+        probabilities = circuit.run_sweep({phaseshift: phases})
+        assert probabilities.shape == (len(phases), circuit.hilbert_dimension)
+
+        # Mach-Zehnder fringes
+        phi = np.radians(phases)
+        assert np.allclose(probabilities[:, 1], np.sin(phi/2)**2, atol=1e-10)
+        assert np.allclose(probabilities[:, 2], np.cos(phi/2)**2, atol=1e-10)
+
+        with pytest.raises(ValueError):
+            circuit.run_sweep({phaseshift: [-90, 0]})
+
+def test_result():
+    for backend in photonic_backends:
+        circuit = backend(n_wires = 3, n_photons = 2)
+        circuit.set_input_state((1, 1, 0))
+        circuit.add_beamsplitter(wires = [1, 2])
+        result = circuit.run()
+        assert np.all(result.ranks == [4, 7])
+        assert np.all(result.occupations == [[2, 0, 0], [0, 2, 0]])
+        assert result.labels == ("200", "020")
+        assert np.allclose(result.probabilities, [0.5, 0.5], atol=1e-10)
+        assert np.all(circuit.get_output_data() == result.table)
+        with pytest.raises(ValueError):
+            result.probabilities[0] = 1
+
+def test_top_k():
+    for backend in photonic_backends:
+        circuit = backend(n_wires = 3, n_photons = 2)
+        circuit.set_input_state((1, 1, 0))
+        circuit.add_beamsplitter(wires = [1, 2], theta = 60)
+        result = circuit.run()
+
+        # most likely first, with ties in rank order
+        assert result.top_k(1).labels == ("200",)
+        assert result.top_k(100).labels == ("200", "020", "110")
+        assert np.allclose(result.top_k(100).probabilities, [0.375, 0.375, 0.25], atol=1e-10)
+        assert len(result.top_k(0)) == 0
+
+        # rank order
+        assert result.above(0.3).labels == ("200", "020")
+
+    # labels are found without listing the whole basis, which has 3.4e11 elements here
+    basis = FockBasis(n_wires = 30, n_photons = 15)
+    result = Result(np.array([0, basis.dimension - 1]), np.array([0.5, 0.5]), basis)
+    assert result.labels == ("0"*30, "0"*29 + "15")
+    assert np.all(basis.ranks(result.occupations) == result.ranks)
+
+def test_marginal():
+    for backend in photonic_backends:
+        circuit = backend(n_wires = 3, n_photons = 2)
+        circuit.set_input_state((1, 1, 0))
+        circuit.add_beamsplitter(wires = [1, 2], theta = 60)
+        result = circuit.run()
+
+        # photon numbers on wire 1, and on wires 2 and 3 together
+        marginal = result.marginal([1])
+        assert marginal.labels == ("0", "1", "2")
+        assert np.allclose(marginal.probabilities, [0.375, 0.25, 0.375], atol=1e-10)
+        photons, probabilities = result.coarse_grain(lambda occupations: occupations[:, 1:].sum(axis=1))
+        assert np.all(photons == [0, 1, 2])
+        assert np.allclose(probabilities, [0.375, 0.25, 0.375], atol=1e-10)
+
+    # the diagonal of the partial trace is the marginal
+    circuit = FockBackend(n_wires = 3, n_photons = 2)
+    circuit.set_input_state((1, 1, 0))
+    circuit.add_beamsplitter(wires = [1, 2], theta = 60)
+    circuit.add_beamsplitter(wires = [2, 3], theta = 30)
+    marginal = circuit.run().marginal([3, 1])
+    reduced_density_matrix = circuit.reduced_density_matrix([3, 1])
+    assert np.isclose(np.trace(reduced_density_matrix), 1)
+    assert np.allclose(np.diag(reduced_density_matrix)[marginal.ranks], marginal.probabilities, atol=1e-10)
+
+def test_iter_outputs():
+    for backend in photonic_backends:
+        circuit = backend(n_wires = 4, n_photons = 3)
+        circuit.set_input_state((1, 1, 1, 0))
+        for wires in [[1, 2], [2, 3], [3, 4], [1, 2]]:
+            circuit.add_beamsplitter(wires = wires, theta = 50)
+        circuit.add_detector(wires = [4], herald = [0])
+        chunks = list(circuit.iter_outputs(chunk_size = 3))
+        assert all(len(probabilities) <= 3 for _, probabilities in chunks)
+
+        # the chunks put together are the whole result
+        circuit.set_input_state((1, 1, 1, 0))
+        result = circuit.run()
+        assert np.all(np.concatenate([occupations for occupations, _ in chunks]) == result.occupations)
+        assert np.allclose(np.concatenate([probabilities for _, probabilities in chunks]), result.probabilities, atol=1e-10)
+
+def test_profiling(tmp_path):
+    for backend in [FockBackend, PermanentBackend]:
+        circuit = backend(n_wires = 3, n_photons = 2)
+        circuit.set_input_state((1, 1, 0))
+        circuit.add_beamsplitter(wires = [1, 2])
+        circuit.add_phaseshift(wires = [2], phase = 30)
+        circuit.add_detector(wires = [3], herald = [0])
+        calls = []
+        with circuit.profile(callback = calls.append) as profiler:
+            circuit.run()
+            circuit.get_output_data()
+        assert calls == profiler.records
+
+        # one record per component, nested in the phase that applied it
+        components = [r for r in profiler.records if r.category == "component"]
+        assert [r.name for r in components] == [type(comp).__name__ for comp in circuit.component_list]
+        assert all(r.depth > 0 and r.allocated_bytes is not None for r in components)
+        assert {"simulate", "create_result", "get_output_data"} <= set(profiler.summary())
+        assert profiler.table()["state_bytes"].max() > 0
+
+        trace = profiler.chrome_trace()
+        assert len(trace["traceEvents"]) == len(profiler.records)
+        assert all(event["ph"] == "X" for event in trace["traceEvents"])
+        profiler.save_chrome_trace(tmp_path / "trace.json")
+        assert json.loads((tmp_path / "trace.json").read_text()) == trace
+
+        # detaching restores the backend, which runs unprofiled again
+        assert circuit.profiler is None
+        assert "simulate" not in vars(circuit) and all("apply" not in vars(comp) for comp in circuit.component_list)
+        circuit.set_input_state((1, 1, 0))
+        circuit.run()
+        assert len(profiler.records) == len(calls)
+
+def test_estimate():
+    for backend in photonic_backends:
+        small = backend(n_wires = 2, n_photons = 2)
+        large = backend(n_wires = 6, n_photons = 3)
+        for circuit in [small, large]:
+            circuit.add_beamsplitter(wires = [1, 2])
+        small_estimate, large_estimate = small.estimate((1, 1)), large.estimate((1, 1, 1, 0, 0, 0))
+        assert small_estimate.backend == backend.__name__
+        assert 0 < small_estimate.peak_bytes < large_estimate.peak_bytes
+        assert 0 < small_estimate.seconds < large_estimate.seconds
+
+    # the density matrix of 8 wires and 8 photons does not fit in 1 GiB, but the permanents do
+    circuit = FockBackend(n_wires = 8, n_photons = 8)
+    circuit.add_beamsplitter(wires = [1, 2])
+    circuit.memory_budget = 2**30
+    with pytest.raises(ValueError, match = "memory budget"):
+        circuit.check_memory_budget((1,)*8)
+
+    # and it is refused before it is allocated
+    tracemalloc.start()
+    try:
+        circuit = FockBackend(n_wires = 8, n_photons = 8)
+        circuit.memory_budget = 2**30
+        with pytest.raises(ValueError, match = "memory budget"):
+            circuit.set_input_state((1,)*8)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert circuit.density_matrix is None
+    assert peak_memory < 2**20
+    circuit = PermanentBackend(n_wires = 8, n_photons = 2)
+    circuit.add_beamsplitter(wires = [1, 2])
+    circuit.memory_budget = 2**30
+    circuit.set_input_state((1, 1, 0, 0, 0, 0, 0, 0))
+    circuit.run()
+
+def test_auto_backend():
+    for loss in [False, True]:
+        circuit, reference = AutoPhotonicBackend(n_wires = 3, n_photons = 2), FockBackend(n_wires = 3, n_photons = 2)
+        for backend in [circuit, reference]:
+            backend.set_input_state((1, 1, 0))
+            backend.add_beamsplitter(wires = [1, 2])
+            backend.add_beamsplitter(wires = [2, 3], theta = 60)
+            if loss:
+                backend.add_loss(wires = [3], eta = 0.5)
+        result = circuit.run()
+        assert np.allclose(result.probabilities, reference.run().probabilities)
+        assert circuit.choice in circuit.reason
+        if loss:
+            assert circuit.choice in ("FockBackend", "PercevalBackend")
+            assert "PermanentBackend can't simulate loss" in circuit.reason
+
+    # compiled circuits are dispatched too
+    circuit = AutoPhotonicBackend(n_wires = 2, n_photons = 1)
+    circuit.set_input_state((1, 0))
+    circuit.add_beamsplitter(wires = [1, 2])
+    phaseshift = circuit.add_phaseshift(wires = [1])
+    circuit.add_beamsplitter(wires = [1, 2])
+    probabilities = circuit.run_sweep({phaseshift: [0, 180]})
+    assert np.allclose(probabilities, [[0, 0, 1], [0, 1, 0]])
+    assert np.allclose(circuit.run_many([(1, 0), (0, 1)]), [[0, 1, 0], [0, 0, 1]])
+    compiled = circuit.compile(circuit.ir)
+    for input_state in [(1, 0), (0, 1)]:
+        circuit.execute(compiled, input_state)
+        assert circuit.engine is compiled.engine
+        assert circuit.choice == type(compiled.engine).__name__
+
+    # nothing runs if no engine fits in the memory budget
+    circuit.memory_budget = 1
+    assert circuit.estimate().peak_bytes == min(estimate.peak_bytes for estimate in circuit.estimates)
+    for run in [circuit.run, partial(circuit.run_many, [(1, 0)]), partial(circuit.run_sweep, {phaseshift: [0]})]:
+        with pytest.raises(ValueError, match = "memory budget"):
+            run()
+
+def test_result_cache(tmp_path):
+    cache = ResultCache(directory = tmp_path)
+    for backend in photonic_backends:
+        circuit = backend(n_wires = 2, n_photons = 2)
+        circuit.cache = cache
+        circuit.set_input_state((1, 1))
+        circuit.add_beamsplitter(wires = [1, 2])
+        circuit.run()
+        expected = circuit.get_output_data()
+        circuit.run()
+        assert circuit.cached_result is not None
+        assert np.all(circuit.get_output_data() == expected)
+
+    stats = cache.stats
+    assert (stats["hits"], stats["misses"], stats["disk_entries"]) == (4, 4, 4)
+
+    # a different parameter is a different circuit
+    circuit = PermanentBackend(2, 2)
+    circuit.cache = cache
+    circuit.set_input_state((1, 1))
+    circuit.add_beamsplitter(wires = [1, 2], theta = 60)
+    circuit.run()
+    assert circuit.cached_result is None
+
+    # results on disk are found by a new cache using the same directory
+    circuit.cache = ResultCache(directory = tmp_path)
+    circuit.run()
+    assert circuit.cached_result is not None
+    assert circuit.cache.stats["hits"] == 1
+
+    # least recently used files are evicted beyond the disk budget
+    small_cache = ResultCache(directory = tmp_path, max_disk_bytes = 1)
+    small_cache.put("key", [0], [1.0], 0)
+    assert small_cache.stats["disk_entries"] <= 1
+
+# GATE-BASED CIRCUIT TESTS
+
+def test_bell_state():
+    for backend in gatebased_backends:
+        circuit = backend(n_qubits = 3)
+        circuit.set_input_state((0, 0, 0))
+        circuit.add_hadamard(qubits = [1])
+        circuit.add_cnot(qubits = [1, 3])
+        circuit.run()
+        output_data = circuit.get_output_data()
+
+        # test labels
+        assert np.all(output_data[:, 0] == ["000", "101"])
+
+        # test probabilities
+        probs = [float(p) for p in output_data[:, 1]]
+        assert np.all(np.isclose(probs, [0.5, 0.5], atol=1e-10))
+
+def test_reversed_cnot():
+    for backend in gatebased_backends:
+        circuit = backend(n_qubits = 3)
+        circuit.set_input_state((0, 0, 1))
+        circuit.add_ygate(qubits = [2])
+        circuit.add_cnot(qubits = [3, 1])
+        circuit.add_zgate(qubits = [1])
+        circuit.run()
+        output_data = circuit.get_output_data()
+
+        # test labels
+        assert np.all(output_data[:, 0] == ["111"])
+
+        # test probabilities
+        probs = [float(p) for p in output_data[:, 1]]
+        assert np.all(np.isclose(probs, [1], atol=1e-10))
+
+def test_large_ghz_state():
+    n_qubits = 500
+    circuit = StabilizerBackend(n_qubits = n_qubits)
+    circuit.set_input_state((0,)*n_qubits)
+    circuit.add_hadamard(qubits = [1])
+    for qubit in range(1, n_qubits):
+        circuit.add_cnot(qubits = [qubit, qubit + 1])
+    circuit.run()
+
+    # the output is an equal superposition of all zeros and all ones
+    offset, generators = circuit.output_subspace
+    assert np.all(offset == 0)
+    assert np.all(generators == np.ones((1, n_qubits)))
+    assert np.all(circuit.get_output_data()[:, 0] == ["0"*n_qubits, "1"*n_qubits])
+
+def test_stabilizer_top_k():
+    n_qubits = 100
+    circuit = StabilizerBackend(n_qubits = n_qubits)
+    circuit.set_input_state((0,)*n_qubits)
+    for qubit in range(1, n_qubits + 1):
+        circuit.add_hadamard(qubits = [qubit])
+
+    # only 3 of the 2^100 equally likely outputs are expanded
+    result = circuit.run_top_k(3)
+    assert result.labels == ("0"*n_qubits, "0"*(n_qubits - 1) + "1", "0"*(n_qubits - 2) + "10")
+    assert np.allclose(result.probabilities, 2.0**-n_qubits)
+
+    # after a full run, the circuit is not applied a second time
+    circuit = StabilizerBackend(n_qubits = 2)
+    circuit.set_input_state((0, 0))
+    circuit.add_hadamard(qubits = [1])
+    circuit.add_cnot(qubits = [1, 2])
+    circuit.cache = ResultCache()
+    circuit.run()
+    for _ in range(2):
+        result = circuit.run_top_k(4)
+        assert result.labels == ("00", "11")
+        assert np.allclose(result.probabilities, 0.5)
+    assert circuit.cache.stats["hits"] == 2
+    circuit.cache = None
+    result = circuit.run_top_k(4)
+    assert result.labels == ("00", "11")
+    circuit.set_input_state((0, 0))
+    assert circuit.run().labels == ("00", "11")
+
+    # the memory budget is checked as in run()
+    circuit.memory_budget = 1
+    with pytest.raises(ValueError, match = "memory budget"):
+        circuit.run_top_k(1)
+
+def test_statevector_chunks(monkeypatch):
+    # tiny chunks send every gate through the thread pool
+    monkeypatch.setattr(statevector_kernels, "CHUNK_SIZE", 4)
+    submitted = []
+    pool = statevector_kernels.thread_pool()
+    monkeypatch.setattr(statevector_kernels, "thread_pool", lambda: submitted.append(1) or pool)
+
+    outputs = []
+    for method in ["statevector", "density_matrix"]:
+        circuit = MPBackend(n_qubits = 6, method = method)
+        circuit.set_input_state((1, 0, 0, 1, 0, 0))
+        for qubit in range(1, 7):
+            circuit.add_hadamard(qubits = [qubit])
+        circuit.add_xgate(qubits = [2])
+        circuit.add_zgate(qubits = [5])
+        circuit.add_cnot(qubits = [1, 6])
+        circuit.add_cnot(qubits = [4, 2])
+        circuit.add_hadamard(qubits = [3])
+        circuit.add_zgate(qubits = [1])
+        circuit.add_hadamard(qubits = [1])
+        circuit.add_cnot(qubits = [6, 3])
+        circuit.add_xgate(qubits = [6])
+        circuit.add_hadamard(qubits = [6])
+        outputs.append(circuit.run())
+
+    assert submitted
+    assert len(outputs[0]) > 1
+    assert np.all(outputs[0].ranks == outputs[1].ranks)
+    assert np.allclose(outputs[0].probabilities, outputs[1].probabilities, atol=1e-10)
+
+def test_gatebased_marginal():
+    for backend in gatebased_backends:
+        circuit = backend(n_qubits = 3)
+        circuit.set_input_state((0, 1, 0))
+        circuit.add_hadamard(qubits = [1])
+        circuit.add_cnot(qubits = [1, 3])
+        marginal = circuit.run().marginal([3, 2])
+        assert marginal.labels == ("01", "11")
+        assert np.allclose(marginal.probabilities, [0.5, 0.5], atol=1e-10)
+
+    for method in MPBackend.methods:
+        circuit = MPBackend(n_qubits = 3, method = method)
+        circuit.set_input_state((0, 1, 0))
+        circuit.add_hadamard(qubits = [1])
+        circuit.add_cnot(qubits = [1, 3])
+        circuit.run()
+
+        # a Bell pair between qubits 1 and 3
+        reduced_density_matrix = circuit.reduced_density_matrix([1, 3])
+        bell_state = np.array([1, 0, 0, 1])/np.sqrt(2)
+        assert np.allclose(reduced_density_matrix, np.outer(bell_state, bell_state), atol=1e-10)
+
+def test_gatebased_estimate():
+    estimates = {}
+    for backend in gatebased_backends:
+        circuit = backend(n_qubits = 10)
+        circuit.set_input_state((0,)*10)
+        circuit.add_hadamard(qubits = [1])
+        circuit.add_cnot(qubits = [1, 2])
+        estimates[circuit.estimate().backend, getattr(circuit, "method", None)] = circuit.estimate()
+
+    assert estimates["MPBackend", "density_matrix"].state_bytes == 16*4**10
+    assert estimates["MPBackend", "statevector"].state_bytes == 16*2**10
+    assert estimates["StabilizerBackend", None].peak_bytes < estimates["MPBackend", "statevector"].peak_bytes
+
+    # estimates are of the optimized gates
+    circuit = MPBackend(n_qubits = 10, method = "statevector")
+    for _ in range(3):
+        circuit.add_hadamard(qubits = [1])
+        circuit.add_xgate(qubits = [1])
+    before = circuit.estimate()
+    circuit.optimize()
+    assert CircuitFeatures.of(circuit).component_counts == {"unitary": 1}
+    assert circuit.estimate().seconds < before.seconds
+
+    # a budget too small for the density matrix stops the run before it starts
+    circuit = MPBackend(n_qubits = 10)
+    circuit.memory_budget = 2**20
+    with pytest.raises(ValueError, match = "memory budget"):
+        circuit.set_input_state((0,)*10)
+    assert circuit.density_matrix is None
+    with pytest.raises(ValueError, match = "memory budget"):
+        circuit.run()
+    assert circuit.result is None
+
+def test_auto_gatebased_backend():
+    # a large Clifford circuit only fits in memory as a stabilizer tableau
+    circuit = AutoGateBasedBackend(n_qubits = 40)
+    circuit.memory_budget = 2**30
+    circuit.set_input_state((0,)*40)
+    circuit.add_hadamard(qubits = [1])
+    for qubit in range(1, 40):
+        circuit.add_cnot(qubits = [qubit, qubit + 1])
+    circuit.run()
+    assert circuit.choice == "StabilizerBackend"
+    assert list(circuit.result.labels) == ["0"*40, "1"*40]
+
+    # gates outside the Clifford group go to a state vector
+    circuit = AutoGateBasedBackend(n_qubits = 2)
+    circuit.set_input_state((0, 0))
+    circuit.add_unitary(qubits = [1], unitary = np.array([[1, 0], [0, np.exp(0.1j)]]))
+    circuit.add_xgate(qubits = [2])
+    circuit.optimize()
+    circuit.run()
+    assert circuit.choice != "StabilizerBackend"
+    assert "StabilizerBackend can't simulate unitary" in circuit.reason
+    assert list(circuit.result.labels) == ["01"]
+
+def test_gate_optimization():
+    for backend in gatebased_backends:
+        circuit = backend(n_qubits = 2)
+        circuit.set_input_state((0, 0))
+        circuit.add_xgate(qubits = [1])
+        circuit.add_hadamard(qubits = [2])
+        circuit.add_hadamard(qubits = [2])
+        circuit.add_xgate(qubits = [1])
+        circuit.add_hadamard(qubits = [1])
+        circuit.add_zgate(qubits = [1])
+        circuit.add_cnot(qubits = [1, 2])
+        circuit.add_cnot(qubits = [1, 2])
+        circuit.add_hadamard(qubits = [1])
+        gate_counts = circuit.optimize()
+        circuit.run()
+        output_data = circuit.get_output_data()
+
+        # the X and H pairs cancel, then the CNOT pair cancels, leaving H, Z, H, which is fused if the backend can
+        if "unitary" in circuit._component_registry:
+            expected = ["unitary"]
+            assert np.allclose(circuit.component_list[0].unitary, [[0, 1], [1, 0]], atol=1e-10)
+        else:
+            expected = ["hadamard", "zgate", "hadamard"]
+        assert gate_counts == {"before": 9, "after": len(expected)}
+        assert circuit.component_types(circuit.component_list) == expected
+        assert [op.component_type for op in circuit.ir] == expected
+        assert all(comp.targeted_qubits == [1] for comp in circuit.component_list)
+
+        # the IR is of the optimized gates, so compiling it has nothing left to remove
+        compiled = circuit.compile(circuit.ir)
+        assert compiled.gate_counts == {"before": len(expected), "after": len(expected)}
+        assert np.all(circuit.execute(compiled, (0, 0))[:, 0] == ["10"])
+        circuit.set_input_state((0, 0))
+
+        # HZH is an X gate
+        assert np.all(output_data[:, 0] == ["10"])
+        probs = [float(p) for p in output_data[:, 1]]
+        assert np.all(np.isclose(probs, [1], atol=1e-10))
+
+def test_gatebased_compiled_execution():
+    for backend in gatebased_backends:
+        circuit = backend(n_qubits = 2)
+        circuit.add_hadamard(qubits = [1])
+        circuit.add_xgate(qubits = [2])
+        circuit.add_xgate(qubits = [2])
+        circuit.add_cnot(qubits = [1, 2])
+        assert [op.component_type for op in circuit.ir] == ["hadamard", "xgate", "xgate", "cnot"]
+
+        executor = backend(n_qubits = 2)
+        compiled = executor.compile(circuit.ir)
+        assert compiled.gate_counts["after"] < compiled.gate_counts["before"]
+        for input_state in [(0, 0), (0, 1), (1, 1)]:
+            output_data = executor.execute(compiled, input_state)
+            circuit.set_input_state(input_state)
+            circuit.run()
+            assert np.all(output_data[:, 0] == circuit.get_output_data()[:, 0])
+            assert np.allclose(output_data[:, 1].astype(float), circuit.get_output_data()[:, 1].astype(float), atol=1e-10)
+
+def test_qiskit_rerun():
+    circuit = QiskitBackend(n_qubits = 2)
+    circuit.set_input_state((0, 0))
+    circuit.add_xgate(qubits = [1])
+    circuit.run()
+    first_output = circuit.get_output_data()
+
+    # running again must not stack the gates a second time
+    circuit.run()
+    assert np.all(circuit.get_output_data() == first_output)
+
+    # changing the input state reuses the transpiled circuit
+    compiled_circuit = qiskit_backend.transpile_cached(circuit.build_circuit(), qiskit_backend.get_simulator(circuit.simulator_options), circuit.simulator_options)
+    circuit.set_input_state((1, 1))
+    circuit.run()
+    assert np.all(circuit.get_output_data()[:, 0] == ["01"])
+    assert qiskit_backend.transpile_cached(circuit.build_circuit(), qiskit_backend.get_simulator(circuit.simulator_options), circuit.simulator_options) is compiled_circuit
+
+def test_qiskit_method_selection():
+    circuit = QiskitBackend(n_qubits = 2)
+    circuit.set_input_state((0, 0))
+    circuit.add_hadamard(qubits = [1])
+    circuit.add_cnot(qubits = [1, 2])
+    assert circuit.simulation_method == "stabilizer"
+
+    # the fused gate is no longer a Clifford gate that qiskit recognizes
+    circuit.add_xgate(qubits = [2])
+    circuit.optimize()
+    assert circuit.simulation_method == "statevector"
+
+    circuit.run()
+    assert np.all(circuit.get_output_data()[:, 0] == ["01", "10"])
+
+def test_qiskit_batch():
+    circuit = QiskitBackend(n_qubits = 2)
+    circuit.add_cnot(qubits = [1, 2])
+    probabilities = circuit.run_batch(input_states = [(0, 0), (0, 1), (1, 0), (1, 1)])
+
+    # the CNOT truth table, with outputs in rank order 00, 01, 10, 11
+    assert np.all(np.isclose(probabilities, [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]], atol=1e-10))
+
+    variants = []
+    for n_hadamards in range(3):
+        variant = QiskitBackend(n_qubits = 2)
+        variant.set_input_state((0, 0))
+        for qubit in range(1, n_hadamards + 1):
+            variant.add_hadamard(qubits = [qubit])
+        variants.append(variant)
+    probabilities = circuit.run_batch(variants = variants)
+    assert np.all(np.count_nonzero(probabilities, axis = 1) == [1, 2, 4])
+
+    with pytest.raises(ValueError):
+        circuit.run_batch()
+
+# IMPORT TESTS
+
+def test_lazy_backend_imports():
+    # importing one backend must not load the dependencies of the others
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "from backends import FockBackend, MPBackend, is_available\n"
+        "elapsed = time.perf_counter() - start\n"
+        "heavy = ['qiskit', 'qiskit_aer', 'perceval', 'mrmustard', 'tensorflow']\n"
+        "print(json.dumps({'elapsed': elapsed, 'loaded': [m for m in heavy if m in sys.modules], 'available': is_available('FockBackend')}))\n"
+    )
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    result = json.loads(subprocess.run([sys.executable, "-c", script], cwd = root, capture_output = True, text = True, check = True).stdout)
+
+    assert result["loaded"] == []
+    assert result["available"]
+    assert result["elapsed"] < 5
+
+# BENCHMARK TESTS
+
+def test_benchmarks(tmp_path):
+    from benchmarks import SCENARIOS, measure, compare
+
+    record = measure(SCENARIOS["hom"], PermanentBackend, {"photons": 2}, warmup = 0, repeats = 2)
+    assert record["status"] == "ok"
+    assert len(record["times"]) == 2
+    assert record["peak_memory_bytes"] > 0
+    assert measure(SCENARIOS["lossy"], PermanentBackend, {"wires": 2, "photons": 1})["status"] == "error"
+
+    # the command line runs each backend in a worker process and writes JSON
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    output = tmp_path / "results.json"
+    subprocess.run([sys.executable, "-m", "benchmarks", "run", "--scenario", "hom", "--backend", "FockBackend",
+                    "--max-sizes", "2", "--repeats", "1", "--output", str(output)], cwd = root, capture_output = True, check = True)
+    results = json.loads(output.read_text())
+    assert [r["size"] for r in results["results"]] == [{"photons": 1}, {"photons": 2}]
+    assert all(r["status"] == "ok" and r["scenario"] == "hom" for r in results["results"])
+
+    # a baseline twice as fast flags every case that is slow enough to measure
+    baseline = json.loads(output.read_text())
+    for r in baseline["results"]:
+        r["median_seconds"] /= 2
+    assert compare(results, baseline, threshold = 0.25, min_seconds = 0) != []
+    assert compare(results, results) == []
+
+    # a worker that fails before it is ready records an error for every size, without waiting for the timeout
+    from benchmarks import Scenario, run_scenario
+    broken = Scenario("missing", "Scenario the worker can't find", "photonic", [{"photons": 1}, {"photons": 2}], SCENARIOS["hom"].build)
+    records = run_scenario(broken, "FockBackend", timeout = 1)
+    assert [(r["status"], r["message"]) for r in records] == [("error", "import failed")]*2